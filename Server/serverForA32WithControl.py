@@ -1,9 +1,7 @@
-import socket
 import threading
 import os
 import sys
-import shutil
-from datetime import datetime
+import time
 
 # Add path to your OWL script
 sys.path.append(rf"C:\Users\88690\Desktop\Dissertation\image_processing")
@@ -11,191 +9,538 @@ import owlv2_singleImage as owl  # assuming you wrapped OWL detection as a funct
 import doclayout_singleImage as dlo
 import filterByVisualCue as fvc
 import tesseractAndGemini as tg
+import answerStrategy
+from test_callGemini import client_stats as llm_client_stats
+from imageFrame import Frame
+from stagePipeline import Pipeline, Stage, Jump, BLOCK
+from microBatcher import MicroBatcher
+from sceneChangeGate import SceneChangeGate
+from penTracker import PenTracker, TwoPenTrigger
+from layoutCache import LayoutCache
+from speculativeLayout import SpeculativeLayout
+from debugWriter import DebugWriter
+from socketServer import SocketServer, TIER_LOW, TIER_FULL, quality_message
+from sessions import SessionManager, FairScheduler
+from frameRing import SharedFrameRing, InProcessModels, ProcessPoolModels, WORKER_MODELS
+import tracing
+from modelRegistry import REGISTRY
 # import yolo_singleImage as yolo
 # Folder to save incoming images
 save_folder = os.path.join(os.path.dirname(__file__), "imageFromPhone")
 os.makedirs(save_folder, exist_ok=True)
 
 # Globals
-image_clients = []     # sockets for image streaming
-control_clients = []   # sockets for control + text
 latest_image_path = os.path.join(save_folder, "latest.jpg")
-processing_image_path = os.path.join(save_folder, "processing.jpg")
-#processing_lock = threading.Lock()
-new_image_event = threading.Event()
-pause_event = threading.Event()
-pause_event.set()  # allow processing initially
+SAVE_DEBUG_FRAMES = False  # also write every received frame to latest.jpg
+# Fraction of triggered frames whose annotated images and JSON are written to
+# DEBUG_FOLDER (0 = none, 1 = all); rendering happens on a background thread
+DEBUG_SAMPLE_RATE = float(os.environ.get("DEBUG_SAMPLE_RATE", "0"))
+DEBUG_FOLDER = os.path.join(os.path.dirname(__file__), "debugOutput")
+# Inference backends: torch, torch-int8 (OWLv2 only), onnx, onnx-int8
+OWL_BACKEND = os.environ.get("OWL_BACKEND", "torch")
+DOCLAYOUT_BACKEND = os.environ.get("DOCLAYOUT_BACKEND", "torch")
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0")) or None
+# Stream answers as PARTIAL:/FINAL: messages instead of one plain-text answer
+STREAM_ANSWERS = True
+# Layout on the full page, or only on the corridor around the pen tips ("roi")
+LAYOUT_MODE = os.environ.get("LAYOUT_MODE", "full")
+# Pen detection on every changed frame ("detect"), or OWLv2 on keyframes with
+# optical-flow tracking in between ("track")
+PEN_MODE = os.environ.get("PEN_MODE", "detect")
+# Consecutive frames with / without two pens before the trigger fires / re-arms
+PEN_TRIGGER_FRAMES = (3, 5) if PEN_MODE == "track" else (1, 1)
+# Phones that send FrameHeaders stream at the LOW tier for pen detection and
+# send one FULL frame for layout/OCR once two pens are locked
+# tier -> (max long side in pixels, 0 = native; JPEG quality)
+QUALITY_TIERS = {TIER_LOW: (640, 70), TIER_FULL: (0, 95)}
+FULL_RES_TIMEOUT = 3.0  # seconds to wait for the full-res frame before using the low-res one
+# How triggered frames are answered: text-ocr (DocLayout -> filter -> OCR -> LLM),
+# multimodal-crop (pen-corridor crop to a multimodal LLM) or race (both, first
+# acceptable answer wins)
+ANSWER_STRATEGY = os.environ.get("ANSWER_STRATEGY", answerStrategy.TEXT_OCR)
+RACE_TIMEOUT = 60.0  # seconds to wait for any acceptable answer in race mode
+if ANSWER_STRATEGY not in answerStrategy.STRATEGIES:
+    raise ValueError(f"Unknown ANSWER_STRATEGY: {ANSWER_STRATEGY} (expected one of {answerStrategy.STRATEGIES})")
+# Start DocLayout while the user is still pointing (one pen seen, or the page
+# held still for SPECULATION_STABLE_FRAMES frames), using at most
+# SPECULATION_CPU_BUDGET of one worker's time; only for full-page layout on
+# full-resolution frames, and not needed by the multimodal-crop strategy
+SPECULATIVE_LAYOUT = os.environ.get("SPECULATIVE_LAYOUT", "0") == "1"
+SPECULATION_CPU_BUDGET = 0.5
+SPECULATION_STABLE_FRAMES = 5
+SPECULATE = SPECULATIVE_LAYOUT and LAYOUT_MODE == "full" and ANSWER_STRATEGY != answerStrategy.MULTIMODAL_CROP
+# Run OWLv2/DocLayout/OCR in this many worker processes (0 = in the server process);
+# frames reach them through a shared-memory ring of RING_SLOTS decoded frames
+PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", "0"))
+RING_SLOTS = int(os.environ.get("RING_SLOTS", "8"))
+# Prometheus metrics on http://127.0.0.1:METRICS_PORT/metrics (0 = off); set
+# TRACE_DUMP to a .jsonl path to also keep every frame's trace
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+TRACE_DUMP = os.environ.get("TRACE_DUMP")
+# Cheap settings only; worker processes re-run this part when they re-import the script
+owl.set_backend(OWL_BACKEND, INFERENCE_THREADS)
+dlo.set_backend(DOCLAYOUT_BACKEND, INFERENCE_THREADS)
+# Replaced by ProcessPoolModels at startup when PROCESS_WORKERS > 0
+models = InProcessModels()
+
+# Server objects, built by setup(). Spawned worker processes re-import this
+# script as __mp_main__, so nothing at module level may open sockets, start
+# threads or open the caches.
+sessions = None
+frame_scheduler = None
+socket_server = None
+pen_batcher = None
+layout_cache = None
+speculative_layout = None
+debug_writer = None
+pipeline = None
 
 
 # -------------------------
 # Image handling
 # -------------------------
-def handle_image_client(client_socket, addr):
-    print(f"[ImageClient] Connected: {addr}")
-    image_clients.append(client_socket)
-    try:
-        while True:
-            # Read length of incoming image
-            length_bytes = client_socket.recv(4)
-            if not length_bytes:
-                break
-            length = int.from_bytes(length_bytes, "big")
-
-            # Read image data
-            data = b""
-            while len(data) < length:
-                packet = client_socket.recv(length - len(data))
-                if not packet:
-                    break
-                data += packet
-
-            # Save latest image
-            with open(latest_image_path, "wb") as f:
-                f.write(data)
-            print(f"[ImageClient] Received image ({len(data)} bytes) from {addr}, saved as latest.jpg")
-
-            # Notify processing thread
-            new_image_event.set()
-    except Exception as e:
-        print(f"[ImageClient] {addr} disconnected: {e}")
-    finally:
-        if client_socket in image_clients:
-            image_clients.remove(client_socket)
-        client_socket.close()
+def on_frame(client, data, header=None):
+    # Hand the frame over in memory; decoding happens once, on first use
+    frame = Frame(data, header=header)
+    session = sessions.get(client.session_id)
+    frame.trace = tracing.Trace(frame.frame_id, started_at=client.last_receive_started, session=session.session_id)
+    tracing.record_span("receive", client.last_receive_started, client.last_receive_seconds,
+                        trace=frame.trace, bytes=len(data))
+    session.frames_received += 1
+    if SAVE_DEBUG_FRAMES:
+        frame.save(latest_image_path)
+    print(f"[ImageClient] Received image {frame.frame_id} ({len(data)} bytes) from {client.addr} (session {session.session_id})")
+
+    if header is not None:
+        if session.frame_protocol < 2:
+            # First frame with a header: switch the phone to the low-res detection tier
+            session.frame_protocol = 2
+            send_to_session(session, quality_message(TIER_LOW, *QUALITY_TIERS[TIER_LOW]))
+        if header.tier == TIER_FULL:
+            job = take_full_res_job(session)
+            if job is not None:
+                # Pens were found on the low-res frame; layout/OCR run on this one. Both
+                # detections are in upright pixels, so scale to the upright size (the
+                # header's width/height are the encoded, pre-rotation dimensions)
+                job["frame"] = frame
+                job["pens"] = owl.scale_detection(job["pens"], frame.size)
+                pipeline.submit(job, stage=route_triggered_job(job))
+                return
+
+    # Becomes the session's latest frame; an unprocessed older one is dropped
+    pipeline.submit({"frame": frame, "session": session})
+
+
+def request_full_res(session, job):
+    """Ask the phone for one full-resolution frame to continue `job` with."""
+    with session.trigger_lock:
+        session.pending_full_res = job
+    send_to_session(session, quality_message(TIER_FULL, *QUALITY_TIERS[TIER_FULL], once=True))
+    timer = threading.Timer(FULL_RES_TIMEOUT, full_res_timeout, args=(session, job))
+    timer.daemon = True
+    timer.start()
+
+
+def take_full_res_job(session, job=None):
+    """Claim the job waiting for a full-res frame (only `job`, if given)."""
+    with session.trigger_lock:
+        pending = session.pending_full_res
+        if pending is None or (job is not None and pending is not job):
+            return None
+        session.pending_full_res = None
+        return pending
+
+
+def full_res_timeout(session, job):
+    if take_full_res_job(session, job) is None:
+        return
+    print(f"No full-res frame from session {session.session_id}, continuing with the low-res frame.")
+    # The low-res frame's trace ended with the pens stage
+    frame = job["frame"]
+    frame.trace = tracing.Trace(frame.frame_id, session=session.session_id, full_res_fallback=True)
+    pipeline.submit(job, stage=route_triggered_job(job))
+
+
+def route_triggered_job(job):
+    """Start the answer strategy for a triggered job; returns the stage it continues at."""
+    if ANSWER_STRATEGY == answerStrategy.MULTIMODAL_CROP:
+        return "llm"  # DocLayout and OCR are not needed
+    if ANSWER_STRATEGY == answerStrategy.RACE:
+        # The multimodal request runs while the text path does layout and OCR; an
+        # acceptable multimodal answer is sent as soon as it arrives, and the text
+        # path then stops at its next stage
+        race = answerStrategy.Race(("multimodal", "text"), timeout=RACE_TIMEOUT,
+                                   on_answer=lambda answer, source: send_race_answer(job, answer, source))
+        job["race"] = race
+        race.watch("multimodal", answerStrategy.start_multimodal(job["frame"], job["pens"].boxes))
+    return "layout"
+
+
+def race_settled(job):
+    """Whether a race already sent this job's answer, so the text path can stop."""
+    return "race" in job and job["race"].settled
+
+
+def send_race_answer(job, answer, source):
+    print(f"Answer from the {source} path:\n{answer}")
+    with tracing.use_trace(job["frame"].trace), tracing.span("send"):
+        send_to_session(job["session"], frame_message("FINAL", answer or "") if STREAM_ANSWERS else answer or "")
 
 
 # -------------------------
 # Control/Text handling
 # -------------------------
-def handle_control_client(client_socket, addr):
-    print(f"[ControlClient] Connected: {addr}")
-    control_clients.append(client_socket)
-    try:
-        while True:
-            cmd = client_socket.recv(1024).decode().strip()
-            if not cmd:
-                break
-            print(f"[ControlClient] Received command from {addr}: {cmd}")
-
-            if cmd == "RESUME":
-                pause_event.set()
-    except Exception as e:
-        print(f"[ControlClient] {addr} disconnected: {e}")
+def on_command(client, cmd):
+    print(f"[ControlClient] Received command from {client.addr}: {cmd}")
+
+    if cmd == "RESUME":
+        resume_session(sessions.get(client.session_id))
+
+
+def pause_session(session):
+    send_to_session(session, "PAUSE")
+    session.pause_event.clear()  # pause pen detection until client sends RESUME
+
+
+def resume_session(session):
+    # Pens still on the page may trigger again; the tracker restarts from a keyframe
+    take_full_res_job(session)
+    session.pen_trigger.reset()
+    session.pen_tracker.reset()
+    session.speculation.reset()
+    session.pause_event.set()
+    frame_scheduler.notify()
+
+
+def frame_message(tag: str, text: str) -> str:
+    """
+    One-line control message "<tag>:<text>" with backslashes and newlines
+    escaped, so multi-line answers cannot be mistaken for several messages.
+    """
+    return f"{tag}:" + text.replace("\\", "\\\\").replace("\n", "\\n")
 
 
 def send_to_control_clients(msg: str):
-    for client in control_clients:
-        try:
-            client.send((msg + "\n").encode())
-        except:
-            pass
+    socket_server.broadcast(msg)
+
+
+def send_to_session(session, msg: str):
+    socket_server.send_to_session(session.session_id, msg)
+
+
+def on_disconnect(client):
+    # A session ends with the last of its connections
+    if socket_server.session_connected(client.session_id):
+        return
+    session = sessions.remove(client.session_id)
+    if session is None:
+        return
+    frame_scheduler.remove(session.session_id)
+    take_full_res_job(session)
+    session.speculation.reset()
+    print(f"[Sessions] Session {session.session_id} closed")
+
+
+def on_control_connect(client):
+    # Models load in the background; tell the client whether answers can come yet
+    client.send_line(f"STATUS {REGISTRY.status()}")
+
+
+_last_model_status = None
+
+
+def on_model_status(status):
+    global _last_model_status
+    if status != _last_model_status:
+        _last_model_status = status
+        print(f"[Models] {status}: {REGISTRY.states()}")
+        send_to_control_clients(f"STATUS {status}")
+
 
 
-# -------------------------
-# Image Processing Loop
-# -------------------------
-def process_images_loop():
-    while True:
-        new_image_event.wait()
-        new_image_event.clear()
-
-        # Wait here if paused
-        pause_event.wait()
-
-        # Copy latest image to processing file
-        # with processing_lock: 
-        shutil.copy2(latest_image_path, processing_image_path)
-
-        try:
-            print("Processing image with OWL...")
-            pen_count = owl.detect_pens(processing_image_path, save_img_path = "owl_result.jpg", save_label_path = "owl_result.txt")
-            print(f"Detected {pen_count} pens in the image.")
-
-            if pen_count == 2:
-                print("Exactly 2 pens detected, sending PAUSE command.")
-                send_to_control_clients("PAUSE")
-                pause_event.clear()  # pause loop until client sends RESUME
-                resultDoclayout = dlo.predict_document(processing_image_path)
-                output = fvc.process_doclayout_with_pens(img_path = processing_image_path, owl_txt = "owl_result.txt", doclayout_detections = resultDoclayout)
-                answer = tg.process_image_and_query(image_path = processing_image_path, image_json_path = "filtered_text_between_pens.json")
-                print(answer)
-                send_to_control_clients(answer)
-
-        except Exception as e:
-            print(f"Error during OWL processing: {e}")
-
-        # Check if a new image arrived during processing
-        if os.path.exists(latest_image_path):
-            if os.path.getmtime(latest_image_path) > os.path.getmtime(processing_image_path):
-                print("New image received during processing, continuing loop...")
-                new_image_event.set()
-
-#'''
-if __name__ == "__main__":
-    processing_image_path = rf"C:\Users\88690\Desktop\Dissertation\imagesFromPhone\ground_truth_q02.jpg"
-    ground_truth_path = rf"C:\Users\88690\Desktop\Dissertation\imagesFromPhone\ground_truth_q02.txt"
-    print(f"Processing image with OWL... at {datetime.now().strftime('%H:%M:%S.%f')[:-3]}")
-    pen_count = owl.detect_pens(processing_image_path, save_img_path = "owl_result.jpg", save_label_path = "owl_result.txt")
-    #pen_count = yolo.detect_pens(processing_image_path, save_img_path="yolo_result.jpg", save_label_path="yolo_result.txt")
-    print(f"Detected {pen_count} pens in the image at {datetime.now().strftime('%H:%M:%S.%f')[:-3]}.")
-
-    if pen_count == 2:
-        print("Exactly 2 pens detected, sending PAUSE command.")
-        send_to_control_clients("PAUSE")
-        pause_event.clear()  # pause loop until client sends RESUME
-        print(f"\nProcessing image with Doclayout... at {datetime.now().strftime('%H:%M:%S.%f')[:-3]}")
-        resultDoclayout = dlo.predict_document(processing_image_path)
-        print(f"\nProcessing image with filterByVisualCue... at {datetime.now().strftime('%H:%M:%S.%f')[:-3]}")
-        output = fvc.process_doclayout_with_pens(img_path = processing_image_path, owl_txt = "owl_result.txt", doclayout_detections = resultDoclayout)
-        print(f"\nProcessing image with OCR and LLM... at {datetime.now().strftime('%H:%M:%S.%f')[:-3]}")
-        answer = tg.process_image_and_query(image_path = processing_image_path, image_json_path = "filtered_text_between_pens.json", ground_truth_path=ground_truth_path)
-        print(f"\nThis answer is returned from Gemini: {answer}")
-        send_to_control_clients(answer)
-#'''
 
 # -------------------------
-# Server setup
+# Image Processing Pipeline
 # -------------------------
-def start_image_server():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("0.0.0.0", 12345))
-    server.listen(5)
-    print("Image server running on port 12345...")
-    while True:
-        client_socket, addr = server.accept()
-        threading.Thread(target=handle_image_client, args=(client_socket, addr), daemon=True).start()
+# Each stage has its own worker threads and a bounded input queue, so pen
+# detection on a new frame overlaps with OCR/LLM for the previous trigger.
+# Pen detection takes frames from the fair scheduler (latest frame per
+# session, round-robin); triggered jobs then queue FIFO and are never dropped.
+# Frames from all connected phones are micro-batched into one OWLv2 pass
+PEN_BATCH_SIZE = 4
+PEN_BATCH_WAIT = 0.02  # seconds to wait for more frames before running a batch
 
+# Stage settings: (worker threads, queue size, drop policy)
+PIPELINE_CONFIG = {
+    "pens": (PEN_BATCH_SIZE, None, None),  # queue is the fair scheduler
+    "layout": (1, 8, BLOCK),
+    "filter": (1, 8, BLOCK),
+    "ocr": (1, 8, BLOCK),
+    "llm": (2, 8, BLOCK),
+}
 
-def start_control_server():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("0.0.0.0", 12346))
-    server.listen(5)
-    print("Control server running on port 12346...")
-    while True:
-        client_socket, addr = server.accept()
-        threading.Thread(target=handle_control_client, args=(client_socket, addr), daemon=True).start()
+
+def pens_stage(job):
+    # Paused sessions are skipped by the scheduler
+    frame, session = job["frame"], job["session"]
+    print(f"Processing image {frame.frame_id} of session {session.session_id} with OWL...")
+    if PEN_MODE == "track":
+        detection = session.pen_tracker.run(frame, pen_batcher)
+    else:
+        detection = session.scene_gate.run(frame, pen_batcher)
+    pen_count = owl.count_pens(detection)
+    print(f"Detected {pen_count} pens in the image.")
+    if not session.pen_trigger.update(pen_count):
+        # Low-res frames would give a worse layout than the full-res frame requested on trigger
+        if SPECULATE and (frame.header is None or frame.header.tier != TIER_LOW):
+            session.speculation.observe(frame, pen_count)
+        return None
+
+    # A session's frames may still be in flight on other workers; only the first triggers
+    with session.trigger_lock:
+        if session.paused:
+            return None
+        print(f"Exactly 2 pens detected, sending PAUSE command to session {session.session_id}.")
+        pause_session(session)
+        session.triggers += 1
+    job["pens"] = detection
+    job["trigger_id"] = frame.frame_id
+    job["debug"] = debug_writer.sample()
+    save_debug(job, "owl_result.jpg", lambda: owl.draw_detection(frame, detection))
+    save_debug(job, "owl_result.txt", lambda: owl.yolo_labels(detection))
+    if frame.header is not None and frame.header.tier == TIER_LOW:
+        request_full_res(session, job)
+        return None
+    stage = route_triggered_job(job)
+    return job if stage == "layout" else Jump(stage, job)
+
+
+def save_debug(job, name, render):
+    # Sampled once per trigger, so all files of a trigger are written together or not at all
+    if job.get("debug"):
+        debug_writer.submit(f"{job['session'].session_id}_{job['trigger_id']}_{name}", render)
+
+
+def layout_stage(job):
+    if race_settled(job):
+        return None
+    frame = job["frame"]
+    if LAYOUT_MODE == "roi":
+        # Corridor results only cover part of the page, so they bypass the page cache
+        layout = models.predict_document_roi(frame, job["pens"].boxes)
+    else:
+        # A speculative run for this page (still in flight or done) is used instead of a new one
+        layout = job["session"].speculation.commit(frame) if SPECULATE else None
+        if layout is None:
+            layout = layout_cache.get_or_predict(frame, models.predict_document)
+    job["layout"] = layout
+    save_debug(job, "doclayout_result.jpg", lambda: dlo.draw_detections(frame, layout))
+    return job
+
+
+def filter_stage(job):
+    if race_settled(job):
+        return None
+    frame = job["frame"]
+    filtered = fvc.process_doclayout_with_pens(frame, job["pens"], job["layout"])
+    job["filtered"] = filtered
+    save_debug(job, "filtered_text_between_pens.jpg", lambda: fvc.draw_filtered(frame, filtered))
+    save_debug(job, "filtered_text_between_pens.json", filtered.to_dict)
+    return job
+
+
+def ocr_stage(job):
+    if race_settled(job):
+        return None
+    job["text"] = models.ocr_regions(job["frame"], job["filtered"].regions)
+    print(f"\nThis is text recognized by OCR:\n{job['text']}")
+    return job
+
+
+def llm_stage(job):
+    session = job["session"]
+    if "race" in job:
+        # The text answer counts only if the multimodal one was not acceptable
+        if not job["race"].settled:
+            job["race"].report("text", tg.query_model(job["text"]))
+        return
+
+    if not STREAM_ANSWERS:
+        if ANSWER_STRATEGY == answerStrategy.MULTIMODAL_CROP:
+            answer = answerStrategy.ask_multimodal(job["frame"], job["pens"].boxes)
+        else:
+            answer = tg.query_model(job["text"])
+        print(answer)
+        with tracing.span("send"):
+            send_to_session(session, answer)
+        return
+
+    if ANSWER_STRATEGY == answerStrategy.MULTIMODAL_CROP:
+        stream_answer(session, answerStrategy.ask_multimodal_stream(job["frame"], job["pens"].boxes))
+    else:
+        stream_answer(session, tg.query_model_stream(job["text"]))
+
+
+def stream_answer(session, chunks):
+    # Forward chunks as they arrive; FINAL repeats the complete answer
+    received = []
+    start, t0 = time.time(), time.perf_counter()
+    for chunk in chunks:
+        if not received:
+            tracing.record_span("llm_first_token", start, time.perf_counter() - t0)
+        received.append(chunk)
+        send_to_session(session, frame_message("PARTIAL", chunk))
+    answer = "".join(received)
+    print(answer)
+    with tracing.span("send"):
+        send_to_session(session, frame_message("FINAL", answer))
+
+
+def on_session_throttle(session, active):
+    # Ask only the phone whose frames are being dropped to slow down
+    send_to_session(session, "THROTTLE ON" if active else "THROTTLE OFF")
+
+
+def on_backpressure(active):
+    # A blocked later stage holds up the pen workers, which then shows up as
+    # dropped frames of the sessions that are still streaming (on_session_throttle)
+    print(f"[Pipeline] {'Falling behind' if active else 'Keeping up again'}: {pipeline.queue_depths()}")
+
+
+def build_pipeline():
+    stage_fns = {"pens": pens_stage, "layout": layout_stage, "filter": filter_stage,
+                 "ocr": ocr_stage, "llm": llm_stage}
+    stages = [Stage(name, fn, *PIPELINE_CONFIG[name]) for name, fn in stage_fns.items() if name != "pens"]
+    workers = PIPELINE_CONFIG["pens"][0]
+    stages.insert(0, Stage("pens", pens_stage, workers, queue=frame_scheduler))
+    return Pipeline(stages, on_backpressure=on_backpressure, trace_of=lambda job: job["frame"].trace,
+                    on_done=on_job_done)
+
+
+def on_job_done(job):
+    # A finished job gives its frame's shared-memory slot back right away
+    job["frame"].release_shared()
+    # A text path that stopped early or failed leaves the race to the multimodal answer
+    if "race" in job:
+        job["race"].report("text", None)
+
+
+def setup():
+    """Build the server objects (sessions, sockets, batcher, caches, pipeline); call once, in the server process."""
+    global sessions, frame_scheduler, socket_server, pen_batcher, layout_cache, speculative_layout
+    global debug_writer, pipeline
+    # One session per phone/headset (paired via "HELLO <id>"), each with its own
+    # pause state and scene-change gate (reuses the last pen detection while the
+    # page is held still)
+    sessions = SessionManager(helpers={
+        "scene_gate": lambda: SceneChangeGate(change_threshold=0.01),
+        "pen_tracker": lambda: PenTracker(keyframe_interval=15),
+        "pen_trigger": lambda: TwoPenTrigger(*PEN_TRIGGER_FRAMES),
+        "speculation": lambda: speculative_layout.for_session(),
+    })
+    # Latest frame per session, shared round-robin by the pen detection workers;
+    # a session that keeps losing frames is asked to slow down
+    frame_scheduler = FairScheduler(on_throttle=on_session_throttle)
+
+    REGISTRY.add_listener(on_model_status)
+    socket_server = SocketServer(on_frame, on_command, on_control_connect, image_port=12345, control_port=12346,
+                                 on_disconnect=on_disconnect)
+
+    pen_batcher = MicroBatcher(lambda frames: models.detect_pens_batch(frames), max_batch_size=PEN_BATCH_SIZE,
+                               max_wait=PEN_BATCH_WAIT, name="owl-batcher")
+    # Reuse DocLayout boxes when the pens move on a page that was already laid out
+    layout_cache = LayoutCache(max_entries=16, max_bytes=32 * 1024 * 1024)
+    # Speculative layout results land in the same cache, so a later view of the page reuses them
+    speculative_layout = SpeculativeLayout(lambda frame: models.predict_document(frame), layout_cache,
+                                           cpu_budget=SPECULATION_CPU_BUDGET, stable_frames=SPECULATION_STABLE_FRAMES)
+    # Annotated images/JSON for a sample of triggered jobs, drawn off the stage threads
+    debug_writer = DebugWriter(DEBUG_FOLDER, sample_rate=DEBUG_SAMPLE_RATE, max_queue=8)
+
+    pipeline = build_pipeline()
+    register_metrics()
+
+
+def register_metrics():
+    tracing.METRICS.register_gauge("pipeline_queue_depth", pipeline.queue_depths, label="stage",
+                                   help="Items waiting in front of each stage.")
+    tracing.METRICS.register_gauge("pipeline_dropped_total", lambda: {name: stats["dropped"] for name, stats in pipeline.stats().items()},
+                                   label="stage", help="Frames dropped in front of each stage.", type="counter")
+    tracing.METRICS.register_gauge("pipeline_failed_total", lambda: {name: stats["failed"] for name, stats in pipeline.stats().items()},
+                                   label="stage", help="Stage calls that raised.", type="counter")
+    tracing.METRICS.register_gauge("speculative_layout_total", lambda: dict(speculative_layout.counts), label="outcome",
+                                   help="Speculative DocLayout runs by outcome (hits, misses, cancelled, ...).", type="counter")
+    tracing.METRICS.register_gauge("model_ready", lambda: {name: int(state == "READY") for name, state in REGISTRY.states().items()},
+                                   label="model", help="1 once a model is loaded and warmed up.")
+
+
+def start_process_workers():
+    """Move the model stages into PROCESS_WORKERS worker processes (no-op when 0)."""
+    global models
+    if PROCESS_WORKERS <= 0:
+        return
+    ocr_engine = tg.OCR_ENGINE
+    frame_ring = SharedFrameRing(slots=RING_SLOTS)
+    models = ProcessPoolModels(frame_ring, workers=PROCESS_WORKERS, ocr_config={
+        "workers": ocr_engine.workers, "lang": ocr_engine.lang, "preprocess": ocr_engine.preprocess,
+        "tessdata_path": ocr_engine.tessdata_path,
+        # Each worker keeps its own LRU on top of the shared SQLite file
+        "cache": ocr_engine.cache.settings() if ocr_engine.cache is not None else None,
+    })
+    # OWLv2 and DocLayout live in the workers: here their registry entries only
+    # wait for the workers to finish loading, so STATUS READY means the workers are
+    for name in WORKER_MODELS:
+        REGISTRY.register(name, models.wait_ready)
+    print(f"Model stages running in {PROCESS_WORKERS} worker processes ({RING_SLOTS} shared frame slots)")
 
 
 # -------------------------
 # Start everything
 # -------------------------
-threading.Thread(target=start_image_server, daemon=True).start()
-threading.Thread(target=start_control_server, daemon=True).start()
-threading.Thread(target=process_images_loop, daemon=True).start()
-
-# Optional manual control
-while True:
-    cmd = input("Enter command (PAUSE/RESUME/EXIT/TEXT <msg>): ").strip()
-    if cmd.upper() == "EXIT":
-        break
-    elif cmd.upper() == "RESUME":
-        pause_event.set()
-        send_to_control_clients("RESUME")
-    elif cmd.upper() == "PAUSE":
-        pause_event.clear()
-        send_to_control_clients("PAUSE")
-    elif cmd.startswith("TEXT "):
-        text = cmd[5:]
-        send_to_control_clients(f"TEXT:{text}")
+# Worker processes re-import this script (spawn start method), so everything
+# that binds ports or starts processes stays under the main guard
+if __name__ == "__main__":
+    setup()
+    start_process_workers()
+    if METRICS_PORT:
+        tracing.start_metrics_server(port=METRICS_PORT)
+    if TRACE_DUMP:
+        tracing.set_trace_dump(TRACE_DUMP)
+
+    # One asyncio loop serves every phone; model stages run on the pipeline workers
+    # Listen right away; frames wait in the scheduler until the models are ready
+    socket_server.start_in_thread()
+    REGISTRY.load_in_background()
+    pipeline.start()
+
+    # Optional manual control
+    while True:
+        cmd = input("Enter command (PAUSE/RESUME/STATS/EXIT/TEXT <msg>): ").strip()
+        if cmd.upper() == "EXIT":
+            break
+        elif cmd.upper() == "RESUME":
+            for session in sessions.all():
+                resume_session(session)
+            send_to_control_clients("RESUME")
+        elif cmd.upper() == "PAUSE":
+            for session in sessions.all():
+                session.pause_event.clear()
+            send_to_control_clients("PAUSE")
+        elif cmd.upper() == "STATS":
+            print(f"Clients: {len(socket_server.image_clients)} image, {len(socket_server.control_clients)} control")
+            print(f"Pipeline: {pipeline.stats()}")
+            for session in sessions.all():
+                print(f"Session {session.session_id}: paused={session.paused}, frames={session.frames_received}, "
+                      f"triggers={session.triggers}, scene gate={session.scene_gate.stats()}, "
+                      f"pen tracker={session.pen_tracker.stats()}")
+            print(f"Layout cache: {layout_cache.stats()}")
+            print(f"Speculative layout: {speculative_layout.stats()}")
+            print(f"Answer cache: {tg.ANSWER_CACHE.stats()}")
+            print(f"OCR cache: {tg.OCR_CACHE.stats()}")
+            print(f"LLM client: {llm_client_stats()}")
+            print(f"Debug writer: {debug_writer.stats()}")
+            print(f"Models: {REGISTRY.status()} {REGISTRY.states()}")
+        elif cmd.startswith("TEXT "):
+            text = cmd[5:]
+            send_to_control_clients(f"TEXT:{text}")
 
 
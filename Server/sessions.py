@@ -0,0 +1,146 @@
+import collections
+import threading
+import time
+
+DEFAULT_SESSION = "default"  # clients that connect without a HELLO handshake
+
+
+class Session:
+    """
+    One phone/headset: its image and control connections share a session ID.
+
+    Each session has its own pause state, its own per-device helpers (e.g. the
+    scene-change gate) and receives only its own answers.
+    """
+
+    def __init__(self, session_id, helpers=None):
+        self.session_id = session_id
+        self.pause_event = threading.Event()
+        self.pause_event.set()  # allow processing initially
+        self.trigger_lock = threading.Lock()
+        self.created_at = time.time()
+        self.frames_received = 0
+        self.triggers = 0
+        self.frame_protocol = 1        # 2 once the phone sends frames with a FrameHeader
+        self.pending_full_res = None   # triggered job waiting for its full-resolution frame
+        for name, factory in (helpers or {}).items():
+            setattr(self, name, factory())
+
+    @property
+    def paused(self) -> bool:
+        return not self.pause_event.is_set()
+
+
+class SessionManager:
+    """
+    Registry of sessions, created on first use.
+
+    Args:
+        helpers (dict): attribute name -> factory, instantiated per session
+            (e.g. {"scene_gate": SceneChangeGate}).
+    """
+
+    def __init__(self, helpers=None):
+        self.helpers = helpers or {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id=DEFAULT_SESSION) -> Session:
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = Session(session_id, self.helpers)
+            return self._sessions[session_id]
+
+    def all(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def remove(self, session_id):
+        """Forget a session (e.g. its last connection closed); returns it, or None."""
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+
+class FairScheduler:
+    """
+    Stage queue that keeps only the latest frame per session and serves the
+    sessions round-robin, skipping paused ones.
+
+    A new frame replaces the session's pending one in place; a session that
+    was just served goes to the back of the line. One busy phone can therefore
+    neither starve the others nor overwrite their frames, and one device's
+    PAUSE no longer stalls everyone. Jobs are dicts with a "session" entry.
+
+    Replacing a pending frame is how this queue works, so it is never
+    reported to the pipeline as congestion. Instead `on_throttle(session,
+    True)` is called when a running session loses a frame, and
+    `on_throttle(session, False)` once `release_after` of its frames in a row
+    were taken in time. Paused sessions keep streaming while nobody reads
+    their frames; that does not throttle them.
+
+    Args:
+        on_throttle (callable): session, active -> None.
+        release_after (int): Frames without a drop before the throttle is lifted.
+    """
+
+    def __init__(self, on_throttle=None, release_after=5):
+        self.on_throttle = on_throttle
+        self.release_after = release_after
+        self.dropped = 0
+        self._slots = collections.OrderedDict()  # session_id -> pending job
+        self._throttled = {}  # session_id -> frames taken in time since its last drop
+        self._cond = threading.Condition()
+
+    def put(self, job) -> bool:
+        """Store the session's newest frame; never reports congestion (see on_throttle)."""
+        session = job["session"]
+        session_id = session.session_id
+        throttle = None
+        with self._cond:
+            replaced = session_id in self._slots
+            if replaced:
+                self.dropped += 1
+            self._slots[session_id] = job
+            self._cond.notify_all()
+            if replaced and not session.paused:
+                if session_id not in self._throttled:
+                    throttle = True
+                self._throttled[session_id] = 0
+            elif session_id in self._throttled:
+                self._throttled[session_id] += 1
+                if self._throttled[session_id] >= self.release_after:
+                    del self._throttled[session_id]
+                    throttle = False
+        if throttle is not None and self.on_throttle is not None:
+            self.on_throttle(session, throttle)
+        return False
+
+    def remove(self, session_id):
+        """Drop a session's pending frame and throttle state (the session is gone)."""
+        with self._cond:
+            self._slots.pop(session_id, None)
+            self._throttled.pop(session_id, None)
+
+    def _next_ready(self):
+        for session_id, job in self._slots.items():
+            if not job["session"].paused:
+                return session_id
+        return None
+
+    def get(self):
+        with self._cond:
+            while True:
+                session_id = self._next_ready()
+                if session_id is not None:
+                    return self._slots.pop(session_id)
+                self._cond.wait()
+
+    def notify(self):
+        """Wake waiting workers, e.g. after a session resumed."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        """Number of sessions with a frame ready to process (paused ones excluded)."""
+        with self._cond:
+            return sum(1 for job in self._slots.values() if not job["session"].paused)
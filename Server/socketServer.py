@@ -0,0 +1,241 @@
+import asyncio
+import collections
+import struct
+import threading
+import time
+from sessions import DEFAULT_SESSION
+
+# Largest frame accepted from a phone; anything bigger is treated as a corrupt length prefix
+MAX_FRAME_BYTES = 32 * 1024 * 1024
+
+# Optional first line on either connection: "HELLO <session id>\n". On the
+# image port its first 4 bytes can never be a valid length prefix
+# (0x48454C4C > MAX_FRAME_BYTES), so clients without a handshake still work.
+HELLO = b"HELLO"
+
+# Version 2 frames start with this magic instead of the length prefix, followed
+# by a fixed header and the JPEG. Like HELLO it can never be a valid length.
+FRAME_V2 = b"FRM2"
+FRAME_V2_HEADER = struct.Struct("!IQHHBBI")
+FrameHeader = collections.namedtuple(
+    "FrameHeader",
+    ["frame_id",      # client-side frame counter
+     "timestamp_ms",  # capture time, client clock (ms since epoch)
+     "width", "height",
+     "orientation",   # EXIF orientation code 1-8 (0 = unknown)
+     "tier",          # quality tier the frame was captured at (TIER_LOW / TIER_FULL)
+     "length"],       # JPEG byte count
+)
+
+# Quality tiers the server can request with "QUALITY <tier> <max side> <jpeg quality> [ONCE]";
+# max side 0 means native resolution, ONCE means one frame at this tier, then back
+TIER_LOW = 0
+TIER_FULL = 1
+TIER_NAMES = {TIER_LOW: "LOW", TIER_FULL: "FULL"}
+
+
+def quality_message(tier: int, max_side: int, jpeg_quality: int, once: bool = False) -> str:
+    msg = f"QUALITY {TIER_NAMES[tier]} {max_side} {jpeg_quality}"
+    return msg + " ONCE" if once else msg
+
+
+class ClientState:
+    """Per-connection state, replacing the global image_clients/control_clients socket lists."""
+
+    def __init__(self, kind, addr, writer, loop):
+        self.kind = kind  # "image" or "control"
+        self.addr = addr
+        self.writer = writer
+        self.loop = loop
+        self.connected_at = time.time()
+        self.session_id = DEFAULT_SESSION
+        self.protocol = 1  # 2 once the client sent a FRAME_V2 frame
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.last_receive_started = None  # wall-clock time the last frame's length prefix arrived
+        self.last_receive_seconds = 0.0   # time spent reading the last frame's bytes
+
+    def apply_hello(self, line: bytes) -> bool:
+        """Take the session ID from a HELLO line; returns False if it is not one."""
+        parts = line.decode(errors="replace").split()
+        if len(parts) != 2 or parts[0].encode() != HELLO:
+            return False
+        self.session_id = parts[1]
+        return True
+
+    def send_line(self, msg: str):
+        """Queue one newline-terminated message; safe to call from any thread."""
+        data = (msg + "\n").encode()
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class SocketServer:
+    """
+    asyncio core for the image and control ports.
+
+    Image connections carry length-prefixed JPEG frames (4-byte big-endian
+    length, then the bytes), read with `readexactly` so a frame is assembled
+    in one piece instead of by repeated `data += packet`. Version 2 frames
+    replace the length with FRAME_V2 and a FrameHeader. Control connections
+    that start with HELLO are line framed: every newline-terminated line is
+    one command, however TCP splits or merges them. Legacy control clients
+    (no HELLO) may also send a bare command without a newline.
+
+    Callbacks run on the default executor so a slow consumer never stalls the
+    event loop:
+        on_frame(client, data, header): a complete frame arrived (header is
+            a FrameHeader, or None for a plain length-prefixed frame).
+        on_command(client, cmd): a control line arrived.
+        on_control_connect(client): a control client connected.
+        on_disconnect(client): an image or control connection closed.
+    """
+
+    def __init__(self, on_frame, on_command, on_control_connect=None,
+                 host="0.0.0.0", image_port=12345, control_port=12346, on_disconnect=None):
+        self.on_frame = on_frame
+        self.on_command = on_command
+        self.on_control_connect = on_control_connect
+        self.on_disconnect = on_disconnect
+        self.host = host
+        self.image_port = image_port
+        self.control_port = control_port
+        self.image_clients = set()
+        self.control_clients = set()
+        self.loop = None
+        self.error = None
+        self._ready = threading.Event()
+
+    async def _handle_image(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        client = ClientState("image", addr, writer, self.loop)
+        self.image_clients.add(client)
+        print(f"[ImageClient] Connected: {addr}")
+        try:
+            prefix = await reader.readexactly(4)
+            if prefix == HELLO[:4]:
+                client.apply_hello(prefix + await reader.readline())
+                print(f"[ImageClient] {addr} joined session {client.session_id}")
+                prefix = None
+            while True:
+                # Read length of incoming image
+                if prefix is None:
+                    prefix = await reader.readexactly(4)
+                header = None
+                if prefix == FRAME_V2:
+                    header = FrameHeader(*FRAME_V2_HEADER.unpack(await reader.readexactly(FRAME_V2_HEADER.size)))
+                    client.protocol = 2
+                    length = header.length
+                else:
+                    length = int.from_bytes(prefix, "big")
+                prefix = None
+                client.last_receive_started = time.time()
+                if length > MAX_FRAME_BYTES:
+                    raise ValueError(f"frame of {length} bytes exceeds MAX_FRAME_BYTES")
+
+                # Read image data in one piece
+                data = await reader.readexactly(length)
+                client.last_receive_seconds = time.time() - client.last_receive_started
+                client.frames_received += 1
+                client.bytes_received += length
+                await self.loop.run_in_executor(None, self.on_frame, client, data, header)
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            print(f"[ImageClient] {addr} disconnected: {e}")
+        finally:
+            self.image_clients.discard(client)
+            writer.close()
+            print(f"[ImageClient] Disconnected: {addr}")
+            await self._disconnected(client)
+
+    async def _handle_control(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        client = ClientState("control", addr, writer, self.loop)
+        self.control_clients.add(client)
+        print(f"[ControlClient] Connected: {addr}")
+        try:
+            if self.on_control_connect is not None:
+                await self.loop.run_in_executor(None, self.on_control_connect, client)
+            buffer = b""
+            framed = False  # True once the client sent HELLO
+            first = True
+            while True:
+                chunk = await reader.read(1024)
+                if not chunk:
+                    break
+                *lines, buffer = (buffer + chunk).split(b"\n")
+                if first and lines:
+                    first = False
+                    if client.apply_hello(lines[0]):
+                        framed = True
+                        lines.pop(0)
+                        print(f"[ControlClient] {addr} joined session {client.session_id}")
+                # Legacy clients send bare commands ("RESUME") without a newline, one
+                # per write; keep only what may still become a HELLO line
+                if not framed and buffer and not (first and HELLO.startswith(buffer[:len(HELLO)])):
+                    lines.append(buffer)
+                    buffer = b""
+                for line in lines:
+                    await self._command(client, line)
+            await self._command(client, buffer)
+        except Exception as e:
+            print(f"[ControlClient] {addr} disconnected: {e}")
+        finally:
+            self.control_clients.discard(client)
+            writer.close()
+            print(f"[ControlClient] Disconnected: {addr}")
+            await self._disconnected(client)
+
+    async def _disconnected(self, client):
+        if self.on_disconnect is not None:
+            await self.loop.run_in_executor(None, self.on_disconnect, client)
+
+    async def _command(self, client, line: bytes):
+        cmd = line.decode(errors="replace").strip()
+        if cmd:
+            await self.loop.run_in_executor(None, self.on_command, client, cmd)
+
+    def session_connected(self, session_id) -> bool:
+        """Whether any image or control connection of the session is still open."""
+        return any(client.session_id == session_id
+                   for client in list(self.image_clients) + list(self.control_clients))
+
+    def broadcast(self, msg: str):
+        """Send a message to every control client; safe to call from any thread."""
+        for client in list(self.control_clients):
+            client.send_line(msg)
+
+    def send_to_session(self, session_id, msg: str):
+        """Send a message to the control clients of one session."""
+        for client in list(self.control_clients):
+            if client.session_id == session_id:
+                client.send_line(msg)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        image_server = await asyncio.start_server(self._handle_image, self.host, self.image_port)
+        control_server = await asyncio.start_server(self._handle_control, self.host, self.control_port)
+        print(f"Image server running on port {self.image_port}...")
+        print(f"Control server running on port {self.control_port}...")
+        self._ready.set()
+        async with image_server, control_server:
+            await asyncio.gather(image_server.serve_forever(), control_server.serve_forever())
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+
+    def start_in_thread(self):
+        """Run the event loop on a daemon thread and return once both ports listen."""
+        threading.Thread(target=self._run, name="socket-server", daemon=True).start()
+        self._ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self
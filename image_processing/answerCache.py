@@ -0,0 +1,137 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from ocrMetrics import normalize_text, text_error_rates
+
+# Numbers and operators: a near match must reproduce these exactly, since
+# "124 + 357" and "124 + 358" are one character apart but different questions
+_EXACT_TOKENS = re.compile(r"\d+(?:[.,]\d+)*|[-+*/×÷=<>^%]")
+
+
+def exact_tokens(context: str) -> list:
+    return _EXACT_TOKENS.findall(context)
+
+
+class AnswerCache:
+    """
+    Persistent cache of LLM answers keyed on model name, prompt and the
+    normalized OCR context.
+
+    An exact fingerprint match is tried first. With `near_match` (the
+    default), recent entries for the same model and prompt are then compared
+    by character error rate, so the same question read from a slightly
+    different frame (a few OCR characters off) still hits and skips the
+    network call; the numbers and operators of both contexts must still be
+    identical.
+    Contexts shorter than `min_context_chars` (e.g. an empty OCR result) are
+    never stored or served.
+
+    Args:
+        db_path (str): SQLite file (":memory:" for a non-persistent cache).
+        ttl (float): Seconds an answer stays valid.
+        max_entries (int): Size bound; least recently used entries are evicted.
+        near_match (bool): Also accept near-duplicate contexts.
+        max_cer (float): Maximum CER between two contexts to count as the same question.
+        near_candidates (int): Recent entries compared for a near-duplicate match.
+        min_context_chars (int): Shorter (normalized) contexts bypass the cache.
+    """
+
+    def __init__(self, db_path="answer_cache.sqlite3", ttl=24 * 3600, max_entries=1000,
+                 near_match=True, max_cer=0.1, near_candidates=50, min_context_chars=20):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.near_match = near_match
+        self.max_cer = max_cer
+        self.min_context_chars = min_context_chars
+        self.near_candidates = near_candidates
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = None  # opened on first use, so importing a module that builds a cache stays cheap
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY, model TEXT, prompt TEXT, context TEXT,"
+                " answer TEXT, created REAL, last_used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS answers_model_prompt ON answers (model, prompt, last_used)")
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def fingerprint(model: str, prompt: str, context: str) -> str:
+        key = "\x1f".join([model, prompt, normalize_text(context)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str, context: str):
+        """Cached answer for this question, or None."""
+        context = normalize_text(context)
+        if len(context) < self.min_context_chars:
+            return None
+        key = self.fingerprint(model, prompt, context)
+        now = time.time()
+        with self._lock:
+            self._connect().execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+            row = self._db.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                self._touch(key, now)
+                return row[0]
+
+            rows = [] if not self.near_match else self._db.execute(
+                "SELECT key, context, answer FROM answers WHERE model = ? AND prompt = ?"
+                " ORDER BY last_used DESC LIMIT ?",
+                (model, prompt, self.near_candidates),
+            ).fetchall()
+            numbers = exact_tokens(context)
+            for cached_key, cached_context, answer in rows:
+                # CER is at least the relative length difference; skip hopeless candidates cheaply
+                if not cached_context or abs(len(cached_context) - len(context)) > self.max_cer * len(cached_context):
+                    continue
+                if exact_tokens(cached_context) != numbers:
+                    continue
+                if text_error_rates(cached_context, context)["cer"] <= self.max_cer:
+                    self.near_hits += 1
+                    self._touch(cached_key, now)
+                    return answer
+
+            self.misses += 1
+            self._db.commit()
+            return None
+
+    def put(self, model: str, prompt: str, context: str, answer: str):
+        context = normalize_text(context)
+        if len(context) < self.min_context_chars:
+            return
+        key = self.fingerprint(model, prompt, context)
+        now = time.time()
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, prompt, context, answer, now, now),
+            )
+            self._db.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def _touch(self, key, now):
+        self._db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.near_hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.near_hits) / total if total else 0.0,
+        }
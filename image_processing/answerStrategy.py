@@ -0,0 +1,146 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+from imageFrame import load_pil
+from doclayout_singleImage import pen_corridor
+from test_callGemini import ask_model_multimodal, ask_model_multimodal_stream
+
+# How a triggered frame is answered
+TEXT_OCR = "text-ocr"                # DocLayout -> filter -> Tesseract -> text-only LLM
+MULTIMODAL_CROP = "multimodal-crop"  # pen-corridor crop straight to a multimodal LLM
+RACE = "race"                        # both at once, first acceptable answer wins
+STRATEGIES = (TEXT_OCR, MULTIMODAL_CROP, RACE)
+
+POINTING_PROMPT = ("Give me the answer to the question marked by the two pens in this image. "
+                   "State the question first, then provide the answer in a clear and concise manner.")
+
+# Answers shorter than this, or that say the question cannot be read, lose a race
+MIN_ANSWER_CHARS = 20
+_REFUSAL = re.compile(r"\b(can(?:no|')t|unable to|not able to)\b.{0,40}\b(see|read|find|identify|determine)\b",
+                      re.IGNORECASE)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="answer")
+
+
+def corridor_crop(image, pen_boxes, filtered=None, padding=20):
+    """
+    Crop of the region marked by the pens.
+
+    Args:
+        image: Frame, BGR numpy array, PIL image or path.
+        pen_boxes (list): The two pen boxes.
+        filtered (list[LayoutDetection]): Optional blocks kept by
+            `process_doclayout_with_pens`; the crop then spans those blocks
+            (plus `padding` pixels) instead of the raw pen-geometry corridor.
+
+    Returns:
+        PIL.Image.Image: The cropped region.
+    """
+    image = load_pil(image)
+    if filtered:
+        x1 = max(0, int(min(det.bbox[0] for det in filtered)) - padding)
+        y1 = max(0, int(min(det.bbox[1] for det in filtered)) - padding)
+        x2 = min(image.width, int(max(det.bbox[2] for det in filtered)) + padding)
+        y2 = min(image.height, int(max(det.bbox[3] for det in filtered)) + padding)
+        box = [x1, y1, x2, y2]
+    else:
+        box = pen_corridor(pen_boxes, image.size)
+    return image.crop(box)
+
+
+def is_acceptable(answer: str) -> bool:
+    """Heuristic check that an answer is usable (not empty, not a refusal)."""
+    return bool(answer) and len(answer.strip()) >= MIN_ANSWER_CHARS and not _REFUSAL.search(answer)
+
+
+def ask_multimodal(image, pen_boxes, prompt=POINTING_PROMPT, filtered=None) -> str:
+    crop = corridor_crop(image, pen_boxes, filtered)
+    with tracing.span("llm_multimodal"):
+        return ask_model_multimodal(prompt, crop)
+
+
+def ask_multimodal_stream(image, pen_boxes, prompt=POINTING_PROMPT, filtered=None):
+    """Yield the multimodal answer for the pen-corridor crop chunk by chunk."""
+    crop = corridor_crop(image, pen_boxes, filtered)
+    yield from ask_model_multimodal_stream(prompt, crop)
+
+
+def start(fn, *args):
+    """Run `fn(*args)` on the answer pool; returns a Future."""
+    return _executor.submit(fn, *args)
+
+
+def start_multimodal(image, pen_boxes, prompt=POINTING_PROMPT):
+    """Start the multimodal request early (e.g. right after pen detection) for a race."""
+    return start(ask_multimodal, image, pen_boxes, prompt)
+
+
+class Race:
+    """
+    First acceptable answer among several sources, delivered as soon as it is known.
+
+    Each source reports once, with `report(source, answer)` (None if it
+    failed) or by handing its Future to `watch`. The first acceptable answer
+    goes to `on_answer(answer, source)` right away; if every source reported
+    and none was acceptable, the longest non-empty answer is sent instead
+    ((None, None) if all failed). After `timeout` seconds the best answer so
+    far is sent. Sources still working can check `settled` and stop early.
+
+    Args:
+        sources (iterable): Names of the competing sources.
+        on_answer (callable): answer, source -> None; called exactly once.
+        timeout (float): Seconds until the race is decided regardless.
+    """
+
+    def __init__(self, sources, on_answer, timeout=None):
+        self.on_answer = on_answer
+        self.settled = False
+        self._waiting = set(sources)
+        self._fallback = (None, None)
+        self._lock = threading.Lock()
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def watch(self, source, future):
+        """Report `future`'s answer for `source` when it completes."""
+        def done(f):
+            try:
+                answer = f.result()
+            except Exception as e:
+                print(f"[Answer] {source} request failed: {e}")
+                answer = None
+            self.report(source, answer)
+        future.add_done_callback(done)
+
+    def report(self, source, answer):
+        with self._lock:
+            if self.settled or source not in self._waiting:
+                return
+            self._waiting.discard(source)
+            if is_acceptable(answer):
+                result = (answer, source)
+            else:
+                if answer and len(answer) > len(self._fallback[0] or ""):
+                    self._fallback = (answer, source)
+                if self._waiting:
+                    return
+                result = self._fallback
+            self.settled = True
+        self._settle(result)
+
+    def _expire(self):
+        with self._lock:
+            if self.settled:
+                return
+            self.settled = True
+            print(f"[Answer] No acceptable answer in time (waiting for {sorted(self._waiting)})")
+        self._settle(self._fallback)
+
+    def _settle(self, result):
+        if self._timer is not None:
+            self._timer.cancel()
+        self.on_answer(*result)
@@ -0,0 +1,359 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from benchmarkReplay import frame_sort_key, latency_summary, percentile
+
+# Offline evaluation of an image corpus: pens -> layout -> filter -> OCR
+# (-> optional LLM) for every image, with WER/CER against ground truth.
+#
+#   python batchProcess.py dataset/ --output run.jsonl --workers 4
+#   python batchProcess.py dataset/ --output run.jsonl --workers 4    (resumes)
+#   python batchProcess.py dataset/ --shard 0/2 --output run.0.jsonl  (one of two machines)
+#   python batchProcess.py --summarize run.0.jsonl run.1.jsonl --parquet run.parquet
+#
+# Images are found recursively (.jpg/.jpeg/.png). Ground truth follows the
+# benchmark convention: the .txt with the same name, or the only
+# ground_truth_*.txt in the image's folder.
+# Each image's result is appended to the JSONL output as soon as it is done and
+# then checkpointed in <output>.manifest; rerunning the same command skips
+# every image in the manifest that did not fail. A manifest only resumes a run
+# with the same settings (threshold, backends, layout mode, LLM, shard), so a
+# threshold change needs a new output file.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+LLM_MODES = ("none", "stub", "gemini")
+
+
+def find_items(folder):
+    """(key, image path, ground-truth path or None) for every image below `folder`, in capture order."""
+    items = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        shared = [name for name in filenames if name.startswith("ground_truth_") and name.endswith(".txt")]
+        default_truth = os.path.join(dirpath, shared[0]) if len(shared) == 1 else None
+        images = [os.path.join(dirpath, name) for name in filenames if name.lower().endswith(IMAGE_EXTENSIONS)]
+        for path in sorted(images, key=frame_sort_key):
+            truth = os.path.splitext(path)[0] + ".txt"
+            key = os.path.relpath(path, folder).replace(os.sep, "/")
+            items.append((key, path, truth if os.path.exists(truth) else default_truth))
+    return items
+
+
+def in_shard(key, shard, shards):
+    """Stable assignment of an image to one of `shards` shards (same on every machine)."""
+    return zlib.crc32(key.encode("utf-8")) % shards == shard
+
+
+def read_jsonl(path):
+    """Records of a JSONL file; a line cut off by an interrupted run is skipped."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+class Manifest:
+    """
+    Checkpoint of a batch run: the run settings on the first line, then one
+    {"key", "status"} line per finished image, flushed to disk immediately.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        self.done = {}
+        lines = read_jsonl(path)
+        if lines:
+            if lines[0].get("config") != config:
+                raise ValueError(f"{path} was written with different settings {lines[0].get('config')}; "
+                                 f"use a new --output to start a separate run")
+            self.done = {line["key"]: line["status"] for line in lines[1:] if "key" in line}
+            self._file = open(path, "a", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+            self._write({"config": config})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, key, status):
+        self._write({"key": key, "status": status})
+        self.done[key] = status
+
+    def close(self):
+        self._file.close()
+
+
+# -------------------------
+# Worker side
+# -------------------------
+# Loaded once per worker process by _init_worker
+_config = None
+_ocr_engine = None
+
+
+def _init_worker(config, parent_sys_path=()):
+    global _config, _ocr_engine
+    for path in parent_sys_path:
+        if path not in sys.path:
+            sys.path.append(path)
+    _config = config
+    import owlv2_singleImage as owl
+    import doclayout_singleImage as dlo
+    import tesseractAndGemini as tg
+    from answerCache import AnswerCache
+    from modelRegistry import REGISTRY
+    from ocrEngine import OcrEngine
+
+    owl.set_backend(config["owl_backend"], config["threads"])
+    dlo.set_backend(config["doclayout_backend"], config["threads"])
+    # Both models load (in parallel) before the worker takes its first image
+    REGISTRY.load_in_background(["owlv2", "doclayout"])
+    REGISTRY.get("owlv2")
+    REGISTRY.get("doclayout")
+    # Images are already spread over processes; one OCR thread per process, and
+    # no OCR cache, so near-duplicate crops cannot blur the WER/CER of a run
+    engine = tg.OCR_ENGINE
+    _ocr_engine = OcrEngine(workers=1, lang=engine.lang, preprocess=engine.preprocess,
+                            tessdata_path=engine.tessdata_path)
+    # Answers cached by the server or an earlier run would not come from this
+    # run's LLM; each worker starts with an empty, in-memory cache
+    tg.ANSWER_CACHE = AnswerCache(":memory:")
+
+
+def process_item(key, path, truth_path):
+    """Run one image through the pipeline; returns its result record (never raises)."""
+    import owlv2_singleImage as owl
+    import doclayout_singleImage as dlo
+    import filterByVisualCue as fvc
+    import tesseractAndGemini as tg
+    import tracing
+    from imageFrame import Frame
+    from ocrMetrics import text_error_rates
+
+    record = {"key": key, "image": path, "ground_truth": truth_path}
+    trace = tracing.Trace(key)
+    try:
+        with tracing.use_trace(trace):
+            frame = Frame.from_file(path)
+            with tracing.span("pens"):
+                detection = owl.detect_pens_batch([frame], threshold=_config["threshold"])[0]
+            record["pens"] = owl.count_pens(detection)
+            record["pen_boxes"] = detection.boxes
+            if record["pens"] != 2:
+                record["status"] = "no_pens"
+            else:
+                with tracing.span("layout"):
+                    if _config["layout_mode"] == "roi":
+                        layout = dlo.predict_document_roi(frame, detection.boxes)
+                    else:
+                        layout = dlo.predict_document(frame)
+                with tracing.span("filter"):
+                    filtered = fvc.process_doclayout_with_pens(frame, detection, layout)
+                with tracing.span("ocr"):
+                    text = tg.ocr_regions(frame, filtered.regions, engine=_ocr_engine)
+                record.update(layout_blocks=len(layout), regions=len(filtered.regions), text=text)
+                if truth_path is not None:
+                    with open(truth_path, "r", encoding="utf-8") as f:
+                        record.update(text_error_rates(f.read(), text))
+                if _config["llm"] != "none":
+                    with tracing.span("llm"):
+                        record["answer"] = tg.query_model(text)
+                record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = {name: round(seconds, 4) for name, seconds in trace.span_durations().items()}
+    record["total_seconds"] = round(trace.duration, 4)
+    return record
+
+
+# -------------------------
+# Driver
+# -------------------------
+def _run_items(items, config, workers):
+    """Yield result records as images finish (in any order)."""
+    if workers <= 0:
+        _init_worker(config)
+        for item in items:
+            yield process_item(*item)
+        return
+
+    context = multiprocessing.get_context("spawn")  # same behaviour on Windows and Linux
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                               initargs=(config, list(sys.path)))
+    pending, queue = set(), iter(items)
+    try:
+        while True:
+            # Keep a couple of images per worker in flight, not the whole corpus
+            for item in queue:
+                pending.add(pool.submit(process_item, *item))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def summarize(records):
+    """Aggregate counts, WER/CER and latency over result records (latest record per image)."""
+    latest = {record["key"]: record for record in records}
+    scored = [record for record in latest.values() if "wer" in record]
+    statuses = Counter(record["status"] for record in latest.values())
+    wers = [record["wer"] for record in scored]
+    cers = [record["cer"] for record in scored]
+    spans = {}
+    for record in latest.values():
+        for name, seconds in record.get("seconds", {}).items():
+            spans.setdefault(name, []).append(seconds)
+    return {
+        "images": len(latest),
+        "status": dict(statuses),
+        "ocr": {
+            "scored": len(scored),
+            "mean_wer": sum(wers) / len(wers) if wers else None,
+            "mean_cer": sum(cers) / len(cers) if cers else None,
+            "p50_wer": percentile(wers, 50), "p95_wer": percentile(wers, 95),
+            "p50_cer": percentile(cers, 50), "p95_cer": percentile(cers, 95),
+        },
+        "latency": {
+            "total": latency_summary([record["total_seconds"] for record in latest.values() if "total_seconds" in record]),
+            "spans": {name: latency_summary(values) for name, values in sorted(spans.items())},
+        },
+    }
+
+
+def flat_record(record):
+    """A record with its per-span seconds as "seconds.<span>" columns."""
+    flat = {name: value for name, value in record.items() if name != "seconds"}
+    for name, seconds in record.get("seconds", {}).items():
+        flat[f"seconds.{name}"] = seconds
+    return flat
+
+
+def write_parquet(records, path):
+    """Write the latest record per image as a Parquet table (needs pyarrow)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet output needs pyarrow (pip install pyarrow)")
+    latest = [flat_record(record) for record in {record["key"]: record for record in records}.values()]
+    # Records differ by status (no_pens has no text, only errors have "error"),
+    # so every column comes from the union of keys, missing values as nulls
+    columns = list(dict.fromkeys(name for record in latest for name in record))
+    table = pa.table({name: pa.array([record.get(name) for record in latest]) for name in columns})
+    pq.write_table(table, path)
+    print(f"{len(latest)} records written to {path}")
+
+
+def print_summary(summary):
+    print(f"\n{summary['images']} images: " + ", ".join(f"{count} {status}" for status, count in summary["status"].items()))
+    ocr = summary["ocr"]
+    if ocr["scored"]:
+        print(f"OCR over {ocr['scored']} images with ground truth: mean WER {ocr['mean_wer']:.3f} "
+              f"(p95 {ocr['p95_wer']:.3f}), mean CER {ocr['mean_cer']:.3f} (p95 {ocr['p95_cer']:.3f})")
+    total = summary["latency"]["total"]
+    if total["count"]:
+        print(f"Per image: p50 {total['p50']:.2f} s, p95 {total['p95']:.2f} s")
+
+
+def run_batch(folder, output, workers=2, shard=0, shards=1, threshold=0.3, layout_mode="full",
+              llm="none", owl_backend="torch", doclayout_backend="torch", threads=None):
+    """
+    Process every image of `folder` in this shard that the manifest does not list yet.
+
+    Returns:
+        dict: Summary over all records in `output` (including earlier, resumed runs).
+    """
+    items = [item for item in find_items(folder) if in_shard(item[0], shard, shards)]
+    config = {"folder": os.path.abspath(folder), "shard": [shard, shards], "threshold": threshold,
+              "layout_mode": layout_mode, "llm": llm, "owl_backend": owl_backend,
+              "doclayout_backend": doclayout_backend}
+    manifest = Manifest(output + ".manifest", config)
+    # Images that failed last time are tried again
+    todo = [item for item in items if manifest.done.get(item[0]) in (None, "error")]
+    print(f"{len(items)} images in shard {shard}/{shards}: {len(items) - len(todo)} already done, {len(todo)} to process")
+
+    stub = None
+    if llm == "stub":
+        import stubLLMServer
+        stub = stubLLMServer.start_stub_server(port=0)
+        # Read by test_callGemini when the workers import it
+        os.environ["LLM_STUB_URL"] = f"http://127.0.0.1:{stub.server_address[1]}/"
+
+    worker_config = dict(config, threads=threads or max(1, (os.cpu_count() or 1) // max(1, workers)))
+    start = time.perf_counter()
+    try:
+        with open(output, "a", encoding="utf-8") as out:
+            for done, record in enumerate(_run_items(todo, worker_config, workers), 1):
+                # Result first, then the checkpoint: a crash in between only repeats this image
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                manifest.record(record["key"], record["status"])
+                if record["status"] == "error":
+                    print(f"[Batch] {record['key']}: {record['error']}")
+                if done % 50 == 0 or done == len(todo):
+                    rate = done / (time.perf_counter() - start)
+                    print(f"[Batch] {done}/{len(todo)} images ({rate:.2f}/s)")
+    finally:
+        manifest.close()
+        if stub is not None:
+            stub.shutdown()
+    return summarize(read_jsonl(output))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pen/layout/OCR pipeline over an image folder.")
+    parser.add_argument("folder", nargs="?", help="Folder with images and ground-truth .txt files")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL results file (also the resume key)")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes (0 = run in this process)")
+    parser.add_argument("--shard", default="0/1", help="This machine's shard as I/N")
+    parser.add_argument("--threshold", type=float, default=0.3, help="OWLv2 pen score threshold")
+    parser.add_argument("--layout-mode", choices=("full", "roi"), default=os.environ.get("LAYOUT_MODE", "full"))
+    parser.add_argument("--llm", choices=LLM_MODES, default="none", help="Also ask the LLM (stub = local stub server)")
+    parser.add_argument("--owl-backend", default=os.environ.get("OWL_BACKEND", "torch"))
+    parser.add_argument("--doclayout-backend", default=os.environ.get("DOCLAYOUT_BACKEND", "torch"))
+    parser.add_argument("--threads", type=int, help="Inference threads per worker (default: CPUs / workers)")
+    parser.add_argument("--parquet", help="Also write the results as Parquet to this file")
+    parser.add_argument("--summary", help="Write the aggregate summary as JSON to this file")
+    parser.add_argument("--summarize", nargs="+", metavar="JSONL",
+                        help="Only aggregate existing result files (e.g. all shards), no processing")
+    args = parser.parse_args()
+
+    if args.summarize:
+        records = [record for path in args.summarize for record in read_jsonl(path)]
+        summary = summarize(records)
+    elif args.folder:
+        shard, shards = map(int, args.shard.split("/"))
+        summary = run_batch(args.folder, args.output, workers=args.workers, shard=shard, shards=shards,
+                            threshold=args.threshold, layout_mode=args.layout_mode, llm=args.llm,
+                            owl_backend=args.owl_backend, doclayout_backend=args.doclayout_backend,
+                            threads=args.threads)
+        records = read_jsonl(args.output)
+    else:
+        parser.error("give an image folder, or --summarize with result files")
+
+    print_summary(summary)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.parquet:
+        write_parquet(records, args.parquet)
@@ -0,0 +1,297 @@
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+# Replays recorded frames (received_N.jpg from Server/serverForGlass.py, or any
+# *.jpg) through the real server pipeline against a local stub LLM, and reports
+# throughput, per-stage latency percentiles, peak RSS and OCR WER/CER.
+#
+#   python benchmarkReplay.py recordings/ --fps 5 --output run.json
+#   python benchmarkReplay.py recordings/ --fps 5 --baseline run.json
+#
+# Ground truth for a frame is the .txt with the same name (ground_truth_q02.jpg
+# -> ground_truth_q02.txt); if a frame has none and the folder holds exactly one
+# ground_truth_*.txt, that page is assumed for every frame.
+# Backends and modes come from the same environment variables as the server
+# (OWL_BACKEND, DOCLAYOUT_BACKEND, LAYOUT_MODE, PROCESS_WORKERS, ...).
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server")
+BASELINE_TOLERANCE = 0.10  # relative p95 slowdown that counts as a regression
+
+
+def frame_sort_key(path):
+    numbers = re.findall(r"\d+", os.path.basename(path))
+    return (int(numbers[-1]) if numbers else -1, path)
+
+
+def find_recordings(folder):
+    """Frame paths in capture order and their ground-truth file (or None)."""
+    frames = sorted(glob.glob(os.path.join(folder, "*.jpg")), key=frame_sort_key)
+    shared = glob.glob(os.path.join(folder, "ground_truth_*.txt"))
+    default_truth = shared[0] if len(shared) == 1 else None
+    recordings = []
+    for path in frames:
+        truth = os.path.splitext(path)[0] + ".txt"
+        recordings.append((path, truth if os.path.exists(truth) else default_truth))
+    return recordings
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (q in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(values):
+    return {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+            "p99": percentile(values, 99), "max": max(values) if values else None}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if it cannot be measured)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in KB elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def is_triggered(trace):
+    """True if the frame got past pen detection (every answer strategy reaches layout or llm)."""
+    spans = trace.span_durations()
+    return "layout" in spans or "llm" in spans
+
+
+def run_benchmark(folder, fps=2.0, loops=1, llm_delay=0.05, drain_timeout=300.0):
+    """
+    Replay a recording folder through the server pipeline.
+
+    Returns:
+        dict: Machine-readable results (config, throughput, latency, memory, ocr).
+    """
+    from stubLLMServer import start_stub_server
+
+    # The LLM client reads LLM_STUB_URL on import, so the stub must be up first
+    stub = start_stub_server(port=0, chunk_delay=llm_delay, first_token_delay=llm_delay)
+    os.environ["LLM_STUB_URL"] = f"http://127.0.0.1:{stub.server_address[1]}/"
+    sys.path.append(SERVER_DIR)
+    import serverForA32WithControl as server
+    import tesseractAndGemini as tg
+    import tracing
+    from answerCache import AnswerCache
+    from imageFrame import Frame
+    from ocrCache import OcrCache
+    from modelRegistry import REGISTRY
+
+    # The sockets are built but never started; frames are submitted directly
+    server.setup()
+
+    # Fresh answer and OCR caches, so every trigger reaches the (stub) LLM and
+    # no region is read from a cache filled by the server or an earlier run
+    cache_dir = tempfile.mkdtemp(prefix="benchmark_")
+    tg.ANSWER_CACHE = AnswerCache(os.path.join(cache_dir, "answer_cache.sqlite3"))
+    tg.OCR_CACHE = tg.OCR_ENGINE.cache = OcrCache()
+
+    recordings = find_recordings(folder)
+    if not recordings:
+        raise ValueError(f"No .jpg frames found in {folder}")
+
+    session = server.sessions.get("benchmark")
+    sources = {}  # frame_id -> (frame path, ground truth path)
+    ocr_texts = {}
+    traces = []
+    done = threading.Condition()
+
+    def on_trace(trace):
+        with done:
+            traces.append(trace)
+            done.notify_all()
+        # A triggered frame paused the session, as the phone would wait for RESUME
+        if is_triggered(trace):
+            server.resume_session(session)
+
+    tracing.add_trace_listener(on_trace)
+
+    ocr = next(stage for stage in server.pipeline.stages if stage.name == "ocr")
+    ocr_fn = ocr.fn
+
+    def recording_ocr_stage(job):
+        job = ocr_fn(job)
+        ocr_texts[job["frame"].frame_id] = job["text"]
+        return job
+
+    ocr.fn = recording_ocr_stage
+
+    # Load and warm up the models first (in the workers, with PROCESS_WORKERS),
+    # so cold start is not counted as frame latency
+    load_started = time.perf_counter()
+    server.start_process_workers()
+    REGISTRY.load_in_background()
+    REGISTRY.wait_ready()
+    model_load_seconds = time.perf_counter() - load_started
+
+    server.pipeline.start()
+
+    interval = 1.0 / fps if fps > 0 else 0.0
+    submitted = 0
+    started = time.perf_counter()
+    for _ in range(loops):
+        for path, truth in recordings:
+            due = started + submitted * interval
+            time.sleep(max(0.0, due - time.perf_counter()))
+            frame = Frame.from_file(path)
+            frame.trace = tracing.Trace(frame.frame_id, source=os.path.basename(path))
+            sources[frame.frame_id] = (path, truth)
+            server.pipeline.submit({"frame": frame, "session": session})
+            submitted += 1
+    replay_seconds = time.perf_counter() - started
+
+    # Every frame either finishes its trace or is replaced in the scheduler
+    deadline = time.monotonic() + drain_timeout
+    with done:
+        while len(traces) + server.frame_scheduler.dropped < submitted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"[Benchmark] Timed out with {submitted - len(traces) - server.frame_scheduler.dropped} frames in flight")
+                break
+            done.wait(remaining)
+    total_seconds = time.perf_counter() - started
+    stub.shutdown()
+
+    # Latency per span name, plus end to end
+    spans = {}
+    for trace in traces:
+        for name, seconds in trace.span_durations().items():
+            spans.setdefault(name, []).append(seconds)
+    triggered = [trace for trace in traces if is_triggered(trace)]
+
+    ocr_scores = []
+    for frame_id, text in sorted(ocr_texts.items()):
+        path, truth = sources[frame_id]
+        if truth is None:
+            continue
+        rates = tg.evaluate_ocr_text(truth, text)
+        ocr_scores.append({"frame": os.path.basename(path), **rates})
+
+    return {
+        "config": {
+            "folder": os.path.abspath(folder), "frames": len(recordings), "loops": loops, "fps": fps,
+            "owl_backend": server.OWL_BACKEND, "doclayout_backend": server.DOCLAYOUT_BACKEND,
+            "layout_mode": server.LAYOUT_MODE, "process_workers": server.PROCESS_WORKERS,
+            "pen_mode": server.PEN_MODE, "answer_strategy": server.ANSWER_STRATEGY,
+            "speculative_layout": server.SPECULATE, "llm_delay": llm_delay,
+        },
+        "startup": {"model_load_seconds": model_load_seconds, "models": REGISTRY.states()},
+        "throughput": {
+            "submitted": submitted, "completed": len(traces), "triggered": len(triggered),
+            "dropped": server.frame_scheduler.dropped, "replay_seconds": replay_seconds,
+            "total_seconds": total_seconds,
+            "frames_per_second": len(traces) / total_seconds if total_seconds else None,
+            "triggers_per_minute": 60 * len(triggered) / total_seconds if total_seconds else None,
+        },
+        "latency": {
+            "end_to_end": latency_summary([trace.duration for trace in traces]),
+            "triggered_end_to_end": latency_summary([trace.duration for trace in triggered]),
+            "spans": {name: latency_summary(values) for name, values in sorted(spans.items())},
+        },
+        "memory": {"peak_rss_mb": peak_rss_mb()},
+        "ocr": {
+            "frames": ocr_scores,
+            "mean_wer": sum(s["wer"] for s in ocr_scores) / len(ocr_scores) if ocr_scores else None,
+            "mean_cer": sum(s["cer"] for s in ocr_scores) / len(ocr_scores) if ocr_scores else None,
+        },
+        "pipeline": server.pipeline.stats(),
+        "speculative_layout": server.speculative_layout.stats(),
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=BASELINE_TOLERANCE):
+    """
+    Print the change of the headline numbers against a baseline run.
+
+    Returns:
+        list[str]: Regressions (p95 latency slower, or WER/CER higher, by more than `tolerance`).
+    """
+    regressions = []
+
+    def check(name, new, old, higher_is_worse=True):
+        if new is None or old is None:
+            return
+        change = (new - old) / old if old else 0.0
+        print(f"  {name}: {old:.4f} -> {new:.4f} ({change:+.1%})")
+        worse = change > tolerance if higher_is_worse else change < -tolerance
+        if worse:
+            regressions.append(f"{name} {change:+.1%}")
+
+    print("Compared to baseline:")
+    check("frames_per_second", results["throughput"]["frames_per_second"],
+          baseline["throughput"]["frames_per_second"], higher_is_worse=False)
+    check("end_to_end.p95", results["latency"]["end_to_end"]["p95"], baseline["latency"]["end_to_end"]["p95"])
+    for name, summary in results["latency"]["spans"].items():
+        old = baseline["latency"]["spans"].get(name)
+        if old is not None:
+            check(f"{name}.p95", summary["p95"], old["p95"])
+    check("peak_rss_mb", results["memory"]["peak_rss_mb"], baseline["memory"]["peak_rss_mb"])
+    check("mean_wer", results["ocr"]["mean_wer"], baseline["ocr"]["mean_wer"])
+    check("mean_cer", results["ocr"]["mean_cer"], baseline["ocr"]["mean_cer"])
+    return regressions
+
+
+def print_report(results):
+    throughput = results["throughput"]
+    print(f"\nReplayed {throughput['submitted']} frames in {throughput['total_seconds']:.1f} s: "
+          f"{throughput['completed']} completed, {throughput['triggered']} triggered, {throughput['dropped']} dropped")
+    print(f"Throughput: {throughput['frames_per_second']:.2f} frames/s")
+    print(f"{'span':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [("end_to_end", results["latency"]["end_to_end"])] + list(results["latency"]["spans"].items())
+    for name, summary in rows:
+        if summary["count"]:
+            print(f"{name:<20}{summary['count']:>7}{summary['p50'] * 1000:>10.1f}"
+                  f"{summary['p95'] * 1000:>10.1f}{summary['p99'] * 1000:>10.1f}")
+    if results["memory"]["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {results['memory']['peak_rss_mb']:.0f} MB")
+    if results["ocr"]["mean_wer"] is not None:
+        print(f"OCR: mean WER {results['ocr']['mean_wer']:.3f}, mean CER {results['ocr']['mean_cer']:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the pipeline and report latency.")
+    parser.add_argument("folder", help="Folder with the recorded .jpg frames and ground-truth .txt files")
+    parser.add_argument("--fps", type=float, default=2.0, help="Replay frame rate (0 = as fast as possible)")
+    parser.add_argument("--loops", type=int, default=1, help="Replay the folder this many times")
+    parser.add_argument("--llm-delay", type=float, default=0.05, help="Stub LLM delay per chunk in seconds")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=BASELINE_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.folder, fps=args.fps, loops=args.loops, llm_delay=args.llm_delay)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
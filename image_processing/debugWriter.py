@@ -0,0 +1,109 @@
+import json
+import math
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+
+
+class DebugWriter:
+    """
+    Renders and writes debug artefacts (annotated images, JSON dumps) on a
+    background thread, so the pipeline stages never draw or serialise.
+
+    `sample()` is called once per trigger and decides whether its artefacts
+    are written; it counts triggers, so exactly `sample_rate` of them are
+    kept (0.3: 3 of every 10), spread evenly. Stages of a sampled trigger then
+    call `submit(filename, render)` where `render()` returns what to write: a
+    PIL image, a BGR numpy array, a dict/list (JSON) or a string. When more
+    than `max_queue` renders are waiting, new ones are dropped instead of
+    blocking the caller.
+
+    Args:
+        folder (str): Output folder (created on first write).
+        sample_rate (float): Fraction of triggers to write, 0 (off) to 1 (all).
+        max_queue (int): Pending renders before new ones are dropped.
+    """
+
+    def __init__(self, folder: str, sample_rate: float = 0.0, max_queue: int = 8):
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.triggers = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def sample(self) -> bool:
+        """Count a trigger; True if its artefacts should be written."""
+        if self.sample_rate <= 0:
+            return False
+        with self._lock:
+            self.triggers += 1
+            n = self.triggers
+        if self.sample_rate >= 1:
+            return True
+        # Sampled whenever the running total of sample_rate reaches the next whole number
+        return math.floor(n * self.sample_rate + 1e-9) > math.floor((n - 1) * self.sample_rate + 1e-9)
+
+    def submit(self, filename: str, render) -> bool:
+        """Queue `render()` to be written to `filename`; returns False if dropped."""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((filename, render))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="debug-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            filename, render = self._queue.get()
+            try:
+                self._write(os.path.join(self.folder, filename), render())
+                with self._lock:
+                    self.written += 1
+            except Exception as e:
+                print(f"[Debug] Could not write {filename}: {e}")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if isinstance(content, np.ndarray):
+            cv2.imwrite(path, content)
+        elif hasattr(content, "save"):
+            content.save(path)
+        elif isinstance(content, str):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(content, f, indent=2, ensure_ascii=False)
+
+    def flush(self):
+        """Block until every queued render has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "triggers": self.triggers,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -1,70 +1,250 @@
 import json
+import os
+import threading
 import cv2
-import time
+import tracing
+import numpy as np
 from doclayout_yolo import YOLOv10
 from huggingface_hub import hf_hub_download
-from typing import Union, Dict
+from typing import List
+from imageFrame import load_bgr
+from stageResults import LayoutDetection
+from filterByVisualCue import pen_tips
+import inferenceBackend as ib
+from modelRegistry import REGISTRY, hub_kwargs
 
-# Load model once globally to avoid reloading on every call
-MODEL_PATH = hf_hub_download(
-    repo_id="juliozhao/DocLayout-YOLO-DocStructBench",
-    filename="doclayout_yolo_docstructbench_imgsz1024.pt"
-)
-MODEL = YOLOv10(MODEL_PATH)
+# Model is loaded once, on first use or by REGISTRY.load_in_background()
+def _load_model():
+    model_path = hf_hub_download(
+        repo_id="juliozhao/DocLayout-YOLO-DocStructBench",
+        filename="doclayout_yolo_docstructbench_imgsz1024.pt",
+        **hub_kwargs()
+    )
+    return YOLOv10(model_path)
+
+def _warmup(_):
+    # A blank page: builds the backend (ONNX export if needed) and the predictor
+    predict_document(np.full((1280, 960, 3), 255, dtype=np.uint8))
+
+REGISTRY.register("doclayout", _load_model, warmup=_warmup)
+
+def get_model():
+    return REGISTRY.get("doclayout")
+
+# -------------------------
+# Inference backends
+# -------------------------
+# Every backend returns (boxes (N, 4) xyxy, scores (N,), class_ids (N,)) in
+# the pixel coordinates of the input image.
+class TorchDocLayoutBackend:
+    """Eager PyTorch through the doclayout_yolo predictor."""
+
+    def __init__(self, num_threads=None):
+        ib.pin_threads(num_threads)
+
+    def predict(self, image, imgsz, conf, device):
+        det_res = get_model().predict(image, imgsz=imgsz, conf=conf, device=device)
+        result = det_res[0]
+        return (result.boxes.xyxy.cpu().numpy(),
+                result.boxes.conf.cpu().numpy(),
+                result.boxes.cls.cpu().numpy())
+
+class OnnxDocLayoutBackend:
+    """
+    ONNX Runtime on CPU, optionally with dynamic INT8 weights.
+
+    YOLOv10 is NMS-free, so the exported graph already returns the final
+    (1, 300, 6) [x1, y1, x2, y2, score, class] detections in letterboxed
+    coordinates; only letterboxing and rescaling happen here.
+    """
+
+    def __init__(self, imgsz=1024, quantize_int8=False, num_threads=None):
+        self.imgsz = imgsz
+        onnx_path = ib.export_path(f"doclayout_yolo_{imgsz}.onnx")
+        if not os.path.exists(onnx_path):
+            exported = get_model().export(format="onnx", imgsz=imgsz, dynamic=False)
+            os.replace(exported, onnx_path)
+        if quantize_int8:
+            onnx_path = ib.quantize_onnx_int8(onnx_path, ib.export_path(f"doclayout_yolo_{imgsz}_int8.onnx"))
+        self.session = ib.create_onnx_session(onnx_path, num_threads)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _letterbox(self, image):
+        h, w = image.shape[:2]
+        ratio = min(self.imgsz / h, self.imgsz / w)
+        new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+        pad_x, pad_y = (self.imgsz - new_w) / 2, (self.imgsz - new_h) / 2
+        canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+        canvas[top:top + new_h, left:left + new_w] = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        blob = canvas[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+        return np.ascontiguousarray(blob), ratio, left, top
+
+    def predict(self, image, imgsz, conf, device):
+        if imgsz != self.imgsz:
+            raise ValueError(f"ONNX DocLayout backend was exported for imgsz={self.imgsz}, got {imgsz}")
+        blob, ratio, left, top = self._letterbox(image)
+        output = self.session.run(None, {self.input_name: blob})[0][0]
+        output = output[output[:, 4] >= conf]
+        h, w = image.shape[:2]
+        boxes = output[:, :4].copy()
+        boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - left) / ratio, 0, w)
+        boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - top) / ratio, 0, h)
+        return boxes, output[:, 4], output[:, 5]
+
+def create_backend(name, num_threads=None, imgsz=1024):
+    if name == "torch":
+        return TorchDocLayoutBackend(num_threads=num_threads)
+    if name == "onnx":
+        return OnnxDocLayoutBackend(imgsz=imgsz, num_threads=num_threads)
+    if name == "onnx-int8":
+        return OnnxDocLayoutBackend(imgsz=imgsz, quantize_int8=True, num_threads=num_threads)
+    # Dynamic quantization only covers Linear layers, which YOLO barely has
+    raise ValueError(f"Unknown DocLayout backend: {name} (expected torch, onnx or onnx-int8)")
+
+# Selected backend, created on first use (see get_backend)
+BACKEND = None
+_backend_config = ("torch", None)
+_backend_lock = threading.Lock()
+
+def set_backend(name, num_threads=None):
+    """Select the inference backend used by predict_document."""
+    global BACKEND, _backend_config
+    if name not in ("torch", "onnx", "onnx-int8"):
+        raise ValueError(f"Unknown DocLayout backend: {name} (expected torch, onnx or onnx-int8)")
+    with _backend_lock:
+        _backend_config = (name, num_threads)
+        BACKEND = None
+
+def get_backend():
+    global BACKEND
+    with _backend_lock:
+        if BACKEND is None:
+            BACKEND = create_backend(*_backend_config)
+        return BACKEND
+
+def check_backend_parity(name, image_paths, iou_threshold=0.5, num_threads=None):
+    """Compare layout boxes of backend `name` against eager PyTorch on fixture images."""
+    reference, candidate = TorchDocLayoutBackend(num_threads=num_threads), create_backend(name, num_threads)
+    return ib.parity_check(
+        lambda path: [d.bbox for d in predict_document(path, backend=reference)],
+        lambda path: [d.bbox for d in predict_document(path, backend=candidate)],
+        image_paths, iou_threshold,
+    )
+
+def draw_detections(image, detections):
+    """Copy of the image (anything load_bgr accepts) with the layout blocks drawn on it."""
+    annotated = load_bgr(image).copy()
+    for det in detections:
+        x1, y1, x2, y2 = map(int, det.bbox)
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), (255, 0, 0), 5)
+        cv2.putText(annotated, f"{det.label} {det.confidence:.2f}", (x1, max(y1 - 10, 20)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 0, 0), 2)
+    return annotated
 
 def predict_document(
-    image_path: str,
+    image,
     imgsz: int = 1024,
     conf: float = 0.2,
     device: str = "cpu",
-    save_image: bool = True,
-    result_image_path: str = "doclayout_result.jpg"
-) -> Dict:
+    backend=None
+) -> List[LayoutDetection]:
     """
     Run document layout detection on a single image.
 
     Args:
-        image_path (str): Path to input image.
+        image: Frame, BGR numpy array, PIL image or path to input image.
         imgsz (int): Prediction image size.
         conf (float): Confidence threshold.
         device (str): Device to run the model ('cpu' or 'cuda:0').
-        save_image (bool): Whether to save the annotated image.
-        result_image_path (str): Path to save annotated image.
+        backend: Inference backend to use instead of the selected BACKEND.
 
     Returns:
-        dict: JSON-like dictionary with detections.
+        list[LayoutDetection]: Detected blocks. Annotated images are drawn
+        with `draw_detections`, off the hot path (see debugWriter.py).
     """
 
-    start_time = time.time()
-    det_res = MODEL.predict(
-        image_path,
-        imgsz=imgsz,
-        conf=conf,
-        device=device
-    )
-    end_time = time.time()
-    print(f"Prediction time: {end_time - start_time:.2f} seconds")
-
-    # Annotate and save
-    if save_image:
-        annotated_frame = det_res[0].plot(pil=True, line_width=5, font_size=20)
-        cv2.imwrite(result_image_path, annotated_frame)
-
-    # Extract results
-    result = det_res[0]
-    boxes = result.boxes.xyxy.cpu().numpy()
-    scores = result.boxes.conf.cpu().numpy()
-    class_ids = result.boxes.cls.cpu().numpy()
-    names = result.names
-
-    # Build JSON output
+    image = load_bgr(image)
+    with tracing.span("doclayout_predict", imgsz=imgsz):
+        boxes, scores, class_ids = (backend or get_backend()).predict(image, imgsz, conf, device)
+
+    names = get_model().names
+
     detections = []
     for box, score, cls in zip(boxes, scores, class_ids):
         x1, y1, x2, y2 = box
-        detections.append({
-            "label": names[int(cls)],
-            "confidence": float(score),
-            "bbox": [float(x1), float(y1), float(x2), float(y2)]
-        })
-
+        detections.append(LayoutDetection(names[int(cls)], float(score), [float(x1), float(y1), float(x2), float(y2)]))
     return detections
+
+# Labels that count as text when deciding whether a region-of-interest run found anything
+TEXT_LABELS = ("title", "plain text")
+
+def pen_corridor(pen_boxes, image_size, margin_x=0.1, margin_y=0.15):
+    """
+    Crop rectangle around the pen tips, expanded so that text blocks crossed
+    by the pen-tip line are not cut off.
+
+    Args:
+        pen_boxes (list): Two [x1, y1, x2, y2] pen boxes in pixels.
+        image_size (tuple): (width, height) of the full image.
+        margin_x (float): Horizontal margin as a fraction of the image width.
+        margin_y (float): Vertical margin as a fraction of the image height.
+
+    Returns:
+        list: [x1, y1, x2, y2] integer crop rectangle clipped to the image.
+    """
+    width, height = image_size
+    (tx1, ty1), (tx2, ty2) = pen_tips(pen_boxes)
+    x1 = max(0, int(min(tx1, tx2) - margin_x * width))
+    x2 = min(width, int(max(tx1, tx2) + margin_x * width))
+    y1 = max(0, int(min(ty1, ty2) - margin_y * height))
+    y2 = min(height, int(max(ty1, ty2) + margin_y * height))
+    return [x1, y1, x2, y2]
+
+def predict_document_roi(
+    image,
+    pen_boxes,
+    imgsz: int = 1024,
+    conf: float = 0.2,
+    device: str = "cpu",
+    margin_x: float = 0.1,
+    margin_y: float = 0.15,
+    backend=None
+) -> List[LayoutDetection]:
+    """
+    Run document layout detection only on the corridor around the pen tips.
+
+    The crop is predicted at a proportionally smaller image size, so text is
+    seen at the same scale as in a full-page run, and the boxes are translated
+    back to full-image coordinates. Falls back to full-page inference when the
+    crop yields no text regions.
+
+    Args:
+        image: Frame, BGR numpy array, PIL image or path to input image.
+        pen_boxes (list): Two [x1, y1, x2, y2] pen boxes from OWLv2.
+        imgsz (int): Prediction image size for the full page.
+        conf (float): Confidence threshold.
+        device (str): Device to run the model ('cpu' or 'cuda:0').
+        margin_x, margin_y (float): Corridor margins, see `pen_corridor`.
+        backend: Inference backend to use instead of the selected BACKEND.
+
+    Returns:
+        list[LayoutDetection]: Detected blocks in full-image coordinates.
+    """
+    image = load_bgr(image)
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = pen_corridor(pen_boxes, (width, height), margin_x, margin_y)
+    crop = image[y1:y2, x1:x2]
+
+    # Same pixel scale as the full page, rounded to the model stride of 32
+    roi_imgsz = getattr(backend or get_backend(), "imgsz", None)
+    if roi_imgsz is None:
+        scale = max(crop.shape[:2]) / max(height, width)
+        roi_imgsz = min(imgsz, max(320, int(round(imgsz * scale / 32)) * 32))
+
+    detections = predict_document(crop, imgsz=roi_imgsz, conf=conf, device=device, backend=backend)
+    if not any(det.label in TEXT_LABELS for det in detections):
+        print("No text regions in the pen corridor, falling back to full-page layout")
+        return predict_document(image, imgsz=imgsz, conf=conf, device=device, backend=backend)
+
+    return [det.translated(x1, y1) for det in detections]
@@ -1,47 +1,26 @@
-import os
-import json
 import cv2
-import math
-from PIL import Image, ImageOps
+import numpy as np
+from imageFrame import load_bgr
+from stageResults import FilteredRegions
 
-def process_doclayout_with_pens(img_path, owl_txt, doclayout_detections,
-                                output_json="filtered_text_between_pens.json",
-                                output_img="filtered_text_between_pens.jpg"):
+# A block is kept if it overlaps the pen-tip rectangle grown by RECT_TOL pixels,
+# or if it lies within LINE_TOL pixels of the line between the pen tips
+RECT_TOL = 5
+LINE_TOL = 5
+# Pages with at least this many blocks are pre-filtered through a GridIndex
+INDEX_MIN_BOXES = 200
+
+def pen_tips(pen_boxes):
     """
-    Process DocLayout detections and OWLv2 pen detections,
-    filter text between pens, and save outputs.
+    Inner tips of the left and right pen, taken as the mid-point of the
+    facing box edges.
 
     Args:
-        img_path (str): Path to the original image.
-        owl_txt (str): Path to OWLv2 label file (.txt, YOLO format).
-        doclayout_json (str): Path to DocLayout output JSON.
-        output_json (str): Path to save filtered JSON.
-        output_img (str): Path to save annotated image.
+        pen_boxes (list): Two [x1, y1, x2, y2] pen boxes in pixels.
 
     Returns:
-        dict: Filtered JSON content (same as saved file).
+        tuple: (left_tip, right_tip) as (x, y) points.
     """
-
-    # --- Load original image ---
-    image = Image.open(img_path)
-    image = ImageOps.exif_transpose(image)
-    IMG_W, IMG_H = image.size
-    img_cv = cv2.imread(img_path)
-
-    # --- Load OWLv2 boxes ---
-    def load_owl_boxes(txt_path, img_width, img_height):
-        boxes = []
-        with open(txt_path, "r") as f:
-            for line in f:
-                cls, x_c, y_c, w, h = map(float, line.strip().split())
-                x1 = (x_c - w/2) * img_width
-                y1 = (y_c - h/2) * img_height
-                x2 = (x_c + w/2) * img_width
-                y2 = (y_c + h/2) * img_height
-                boxes.append([x1, y1, x2, y2])
-        return boxes
-
-    pen_boxes = load_owl_boxes(owl_txt, IMG_W, IMG_H)
     if len(pen_boxes) != 2:
         raise ValueError("Expected exactly 2 OWLv2 detections (two pens).")
 
@@ -54,70 +33,178 @@ def process_doclayout_with_pens(img_path, owl_txt, doclayout_detections,
     # --- Pen tips ---
     pen1_tip = (left_pen[2], (left_pen[1]+left_pen[3])/2)
     pen2_tip = (right_pen[0], (right_pen[1]+right_pen[3])/2)
+    return pen1_tip, pen2_tip
 
-    # --- Pen-tip rectangle ---
-    TOL = 5
+def as_box_array(boxes):
+    """(N, 4) float array of [x1, y1, x2, y2] boxes (also for N = 0)."""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+# --- Vectorized geometry ---
+def point_box_distances(point, boxes):
+    """Distance from one point to each box (0 inside the box)."""
+    px, py = point
+    dx = np.maximum(np.maximum(boxes[:, 0] - px, px - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - py, py - boxes[:, 3]), 0)
+    return np.hypot(dx, dy)
+
+def point_segment_distances(points, p0, p1):
+    """Distance from each of the (M, 2) points to the segment p0-p1."""
+    p0, p1 = np.asarray(p0, dtype=np.float64), np.asarray(p1, dtype=np.float64)
+    d = p1 - p0
+    len_sq = d @ d
+    if len_sq == 0:
+        return np.hypot(*(points - p0).T)
+    t = np.clip(((points - p0) @ d) / len_sq, 0, 1)
+    closest = p0 + t[:, None] * d
+    return np.hypot(*(points - closest).T)
+
+def segment_intersects_boxes(p0, p1, boxes):
+    """Liang-Barsky clipping of the segment p0-p1 against every box at once."""
+    (x0, y0), (x1, y1) = p0, p1
+    dx, dy = x1 - x0, y1 - y0
+    t_enter = np.zeros(len(boxes))
+    t_exit = np.ones(len(boxes))
+    hit = np.ones(len(boxes), dtype=bool)
+    for p, q in ((-dx, x0 - boxes[:, 0]), (dx, boxes[:, 2] - x0),
+                 (-dy, y0 - boxes[:, 1]), (dy, boxes[:, 3] - y0)):
+        if p == 0:
+            hit &= q >= 0  # parallel to this edge: must already be on the inside
+        elif p < 0:
+            t_enter = np.maximum(t_enter, q / p)
+        else:
+            t_exit = np.minimum(t_exit, q / p)
+    return hit & (t_enter <= t_exit)
+
+def segment_box_distances(p0, p1, boxes):
+    """
+    Distance from the segment p0-p1 to each (N, 4) box, 0 where they intersect.
+
+    Unlike checking only the box corners, a long box crossed in the middle of
+    an edge gets distance 0. For disjoint convex shapes the closest pair always
+    involves a segment end point or a box corner, so those are all we measure.
+    """
+    boxes = as_box_array(boxes)
+    if len(boxes) == 0:
+        return np.zeros(0)
+    corners = np.stack([boxes[:, [0, 1]], boxes[:, [0, 3]], boxes[:, [2, 1]], boxes[:, [2, 3]]], axis=1)
+    corner_dist = point_segment_distances(corners.reshape(-1, 2), p0, p1).reshape(-1, 4).min(axis=1)
+    dist = np.minimum(np.minimum(point_box_distances(p0, boxes), point_box_distances(p1, boxes)), corner_dist)
+    dist[segment_intersects_boxes(p0, p1, boxes)] = 0
+    return dist
+
+class GridIndex:
+    """
+    Uniform grid over a page's layout boxes, for pages with hundreds of blocks.
+
+    Build it once per layout (e.g. alongside a cached DocLayout result) and
+    `query` returns the indices of the boxes that may touch a rectangle.
+    """
+
+    def __init__(self, boxes, cell_size=256):
+        self.boxes = as_box_array(boxes)
+        self.cell_size = cell_size
+        self.cells = {}
+        cells = np.floor(self.boxes / cell_size).astype(int)
+        for i, (cx1, cy1, cx2, cy2) in enumerate(cells):
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self.cells.setdefault((cx, cy), []).append(i)
+
+    def query(self, rect):
+        """Sorted indices of boxes whose grid cells overlap rect [x1, y1, x2, y2]."""
+        cx1, cy1, cx2, cy2 = np.floor(np.asarray(rect, dtype=np.float64) / self.cell_size).astype(int)
+        found = [self.cells.get((cx, cy), ()) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)]
+        if not any(found):
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate([np.asarray(f, dtype=int) for f in found if f]))
+
+def filter_boxes_between_pens(boxes, pen1_tip, pen2_tip, rect_tol=RECT_TOL, line_tol=LINE_TOL, index=None):
+    """
+    Boolean mask of the boxes that belong to the region marked by the pen tips.
+
+    Args:
+        boxes: (N, 4) array of [x1, y1, x2, y2] layout boxes.
+        pen1_tip, pen2_tip: (x, y) pen tips.
+        rect_tol (float): Margin around the pen-tip rectangle.
+        line_tol (float): Maximum distance from the tip-to-tip segment.
+        index (GridIndex): Optional index over the same boxes; built
+            automatically for pages with INDEX_MIN_BOXES or more boxes.
+
+    Returns:
+        np.ndarray: (N,) bool mask, True for boxes to keep.
+    """
+    boxes = as_box_array(boxes)
+    keep = np.zeros(len(boxes), dtype=bool)
+    if len(boxes) == 0:
+        return keep
     x_left, x_right = min(pen1_tip[0], pen2_tip[0]), max(pen1_tip[0], pen2_tip[0])
     y_top, y_bottom = min(pen1_tip[1], pen2_tip[1]), max(pen1_tip[1], pen2_tip[1])
 
-    # --- Distance helper ---
-    LINE_TOL = 5
-    def distance_point_to_line(px, py, x1, y1, x2, y2):
-        A = px - x1
-        B = py - y1
-        C = x2 - x1
-        D = y2 - y1
-        dot = A * C + B * D
-        len_sq = C * C + D * D
-        param = dot / len_sq if len_sq != 0 else -1
-        if param < 0:
-            xx, yy = x1, y1
-        elif param > 1:
-            xx, yy = x2, y2
-        else:
-            xx = x1 + param * C
-            yy = y1 + param * D
-        dx = px - xx
-        dy = py - yy
-        return math.sqrt(dx*dx + dy*dy)
+    # The segment lies inside the tip rectangle, so every match touches the rectangle grown by the larger tolerance
+    if index is None and len(boxes) >= INDEX_MIN_BOXES:
+        index = GridIndex(boxes)
+    if index is not None:
+        margin = max(rect_tol, line_tol)
+        candidates = index.query([x_left - margin, y_top - margin, x_right + margin, y_bottom + margin])
+    else:
+        candidates = np.arange(len(boxes))
+    if len(candidates) == 0:
+        return keep
+
+    b = boxes[candidates]
+    rect_overlap = ((b[:, 0] <= x_right + rect_tol) & (b[:, 2] >= x_left - rect_tol) &
+                    (b[:, 1] <= y_bottom + rect_tol) & (b[:, 3] >= y_top - rect_tol))
+    near_line = segment_box_distances(pen1_tip, pen2_tip, b) <= line_tol
+    keep[candidates] = rect_overlap | near_line
+    return keep
+
+def process_doclayout_with_pens(image, pens, doclayout_detections):
+    """
+    Keep the DocLayout detections that lie between the two pen tips.
+
+    Args:
+        image: Frame, BGR numpy array, PIL image or path to the original image.
+        pens: PenDetection from OWLv2, or its two [x1, y1, x2, y2] pen boxes.
+        doclayout_detections (list[LayoutDetection]): All layout blocks of the image.
+
+    Returns:
+        FilteredRegions: Kept blocks plus the pen geometry. Use
+        `draw_filtered` / `FilteredRegions.to_dict` for debug output.
+    """
+    pen_boxes = [list(map(float, box)) for box in getattr(pens, "boxes", pens)]
+    pen1_tip, pen2_tip = pen_tips(pen_boxes)
+
+    # --- Pen-tip rectangle ---
+    x_left, x_right = min(pen1_tip[0], pen2_tip[0]), max(pen1_tip[0], pen2_tip[0])
+    y_top, y_bottom = min(pen1_tip[1], pen2_tip[1]), max(pen1_tip[1], pen2_tip[1])
 
     detections = doclayout_detections
 
     # --- Filter detections ---
-    filtered = []
-    for det in detections:
-        x1, y1, x2, y2 = det["bbox"]
-        rect_overlap = (x1 <= x_right + TOL and x2 >= x_left - TOL and
-                        y1 <= y_bottom + TOL and y2 >= y_top - TOL)
-        box_points = [(x1, y1), (x1, y2), (x2, y1), (x2, y2)]
-        near_line = any(distance_point_to_line(px, py, *pen1_tip, *pen2_tip) <= LINE_TOL
-                        for (px, py) in box_points)
-        if rect_overlap or near_line:
-            filtered.append(det)
-
-    # --- Save JSON ---
-    output = {
-        "pens": pen_boxes,
-        "pen_tip_line": [pen1_tip, pen2_tip],
-        "pen_tip_rectangle": [x_left, y_top, x_right, y_bottom],
-        "filtered_doclayout": filtered,
-        "all_doclayout": detections
-    }
-    with open(output_json, "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
-
-    # --- Visualization ---
-    for (x1, y1, x2, y2) in pen_boxes:
+    keep = filter_boxes_between_pens([det.bbox for det in detections], pen1_tip, pen2_tip)
+    filtered = [det for det, kept in zip(detections, keep) if kept]
+
+    return FilteredRegions(
+        pens=pen_boxes,
+        pen_tip_line=(pen1_tip, pen2_tip),
+        pen_tip_rectangle=[x_left, y_top, x_right, y_bottom],
+        regions=filtered,
+        all_regions=list(detections),
+    )
+
+def draw_filtered(image, result):
+    """Copy of the image with the pens, pen-tip rectangle and line, and the kept blocks drawn on it."""
+    img_cv = load_bgr(image).copy()  # the decoded frame is shared with later stages
+    (pen1_tip, pen2_tip), (x_left, y_top, x_right, y_bottom) = result.pen_tip_line, result.pen_tip_rectangle
+    for (x1, y1, x2, y2) in result.pens:
         cv2.rectangle(img_cv, (int(x1), int(y1)), (int(x2), int(y2)), (0,0,255), 20)
     cv2.rectangle(img_cv, (int(x_left), int(y_top)), (int(x_right), int(y_bottom)), (255,0,0), 20)
     cv2.line(img_cv, (int(pen1_tip[0]), int(pen1_tip[1])),
                      (int(pen2_tip[0]), int(pen2_tip[1])),
                      (0,255,255), 20)
-    for det in filtered:
-        x1, y1, x2, y2 = map(int, det["bbox"])
+    for det in result.regions:
+        x1, y1, x2, y2 = map(int, det.bbox)
         cv2.rectangle(img_cv, (x1, y1), (x2, y2), (0,255,0), 20)
-        cv2.putText(img_cv, det["label"], (x1, y1-5),
+        cv2.putText(img_cv, det.label, (x1, y1-5),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 20)
-    cv2.imwrite(output_img, img_cv)
-
-    return output
+    return img_cv
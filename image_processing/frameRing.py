@@ -0,0 +1,320 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from imageFrame import Frame, load_bgr
+
+# Default slot size: one decoded 12 MP (4032x3024) BGR phone photo
+DEFAULT_SLOT_BYTES = 4032 * 3024 * 3
+
+
+class RingSlot:
+    """
+    A frame's claim on one slot of the ring.
+
+    Worker calls bracket their use of the slot with `use`/`unuse`. `release`
+    (called when the frame's job is finished) returns the slot to the ring as
+    soon as no call is using it any more; a handle that is garbage-collected
+    without being released frees its slot then.
+    """
+
+    def __init__(self, ring, meta):
+        self.ring = ring
+        self.meta = meta
+        self._users = 0
+        self._released = False
+        self._freed = False
+        self._lock = threading.Lock()
+
+    def use(self) -> bool:
+        """Claim the slot for one worker call; False once it was released."""
+        with self._lock:
+            if self._released:
+                return False
+            self._users += 1
+            return True
+
+    def unuse(self):
+        with self._lock:
+            self._users -= 1
+            free = self._released and self._users == 0
+        if free:
+            self._free()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+            free = self._users == 0
+        if free:
+            self._free()
+
+    def _free(self):
+        with self._lock:
+            if self._freed:
+                return
+            self._freed = True
+        self.ring.release(self.meta["slot"])
+
+    def __del__(self):
+        self._free()
+
+
+class SharedFrameRing:
+    """
+    Fixed number of equally sized `multiprocessing.shared_memory` slots holding
+    decoded frames.
+
+    The server process copies a decoded frame into a free slot once; worker
+    processes attach to the same block and build a numpy view from the small
+    metadata dict ({"slot", "shape", "dtype"}), so frame bytes are never pickled.
+
+    Args:
+        slots (int): Number of frames that can be shared at the same time.
+        slot_bytes (int): Capacity of one slot.
+        name (str): Attach to an existing ring (worker side) instead of creating one.
+    """
+
+    def __init__(self, slots: int = 8, slot_bytes: int = DEFAULT_SLOT_BYTES, name: str = None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            _untrack(self.shm)
+        self.name = self.shm.name
+        self._free = list(range(slots))
+        self._lock = threading.Lock()
+
+    def put(self, array: np.ndarray):
+        """Copy an array into a free slot; returns a RingSlot, or None if the ring is full or the array too big."""
+        if array.nbytes > self.slot_bytes:
+            return None
+        with self._lock:
+            if not self._free:
+                return None
+            slot = self._free.pop()
+        meta = {"slot": slot, "shape": array.shape, "dtype": array.dtype.str}
+        self.view(meta, writeable=True)[...] = array
+        return RingSlot(self, meta)
+
+    def view(self, meta, writeable: bool = False) -> np.ndarray:
+        """numpy view of a slot's frame (read-only unless `writeable`)."""
+        offset = meta["slot"] * self.slot_bytes
+        array = np.ndarray(meta["shape"], dtype=np.dtype(meta["dtype"]), buffer=self.shm.buf, offset=offset)
+        array.flags.writeable = writeable
+        return array
+
+    def release(self, slot: int):
+        with self._lock:
+            self._free.append(slot)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _untrack(shm):
+    # Before Python 3.13 attaching registers the block with this process's
+    # resource tracker, which would unlink it when the worker exits.
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+# -------------------------
+# Worker side
+# -------------------------
+_ring = None
+_ocr_engine = None
+_ocr_config = None
+
+# Models each worker loads and warms up before it takes its first frame
+WORKER_MODELS = ("owlv2", "doclayout")
+
+
+def _init_worker(ring_name, slots, slot_bytes, parent_sys_path, ocr_config, ready_queue):
+    global _ring, _ocr_config
+    for path in parent_sys_path:
+        if path not in sys.path:
+            sys.path.append(path)
+    _ring = SharedFrameRing(slots, slot_bytes, name=ring_name)
+    _ocr_config = ocr_config
+    # Load in parallel, then wait; each worker reports (pid, error or None) once done
+    error = None
+    try:
+        import owlv2_singleImage  # noqa: F401  (registers "owlv2")
+        import doclayout_singleImage  # noqa: F401  (registers "doclayout")
+        from modelRegistry import REGISTRY
+        REGISTRY.load_in_background(WORKER_MODELS)
+        for name in WORKER_MODELS:
+            REGISTRY.get(name)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    ready_queue.put((os.getpid(), error))
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+def _resolve(image):
+    """Slot metadata -> shared view; anything else (fallback array) is used as is."""
+    if isinstance(image, dict):
+        return _ring.view(image)
+    return image
+
+
+def _worker_detect_pens(images, threshold):
+    import owlv2_singleImage as owl  # loaded once per worker process
+    return owl.detect_pens_batch([_resolve(image) for image in images], threshold=threshold)
+
+
+def _worker_predict_document(images, kwargs):
+    import doclayout_singleImage as dlo
+    return dlo.predict_document(_resolve(images[0]), **kwargs)
+
+
+def _worker_predict_document_roi(images, pen_boxes, kwargs):
+    import doclayout_singleImage as dlo
+    return dlo.predict_document_roi(_resolve(images[0]), pen_boxes, **kwargs)
+
+
+def _worker_ocr_regions(images, detections):
+    global _ocr_engine
+    if _ocr_engine is None:
+        from ocrEngine import OcrEngine
+        _ocr_engine = OcrEngine(**_ocr_config)
+    return _ocr_engine.ocr_regions(_resolve(images[0]), detections)
+
+
+# -------------------------
+# Server side
+# -------------------------
+class InProcessModels:
+    """Runs the model stages in the calling process (the default)."""
+
+    def detect_pens_batch(self, images, threshold=0.3):
+        import owlv2_singleImage as owl
+        return owl.detect_pens_batch(images, threshold=threshold)
+
+    def predict_document(self, image, **kwargs):
+        import doclayout_singleImage as dlo
+        return dlo.predict_document(image, **kwargs)
+
+    def predict_document_roi(self, image, pen_boxes, **kwargs):
+        import doclayout_singleImage as dlo
+        return dlo.predict_document_roi(image, pen_boxes, **kwargs)
+
+    def ocr_regions(self, image, detections):
+        import tesseractAndGemini as tg
+        return tg.ocr_regions(image, detections)
+
+
+class ProcessPoolModels:
+    """
+    Runs OWLv2, DocLayout and OCR in worker processes that each load their
+    models once, with frames passed through a SharedFrameRing.
+
+    Same interface as InProcessModels. If the ring is full (or a frame does
+    not fit a slot) the array is pickled instead, so callers never block.
+
+    All workers are started right away and load and warm up their models in
+    the pool initializer, before taking work; `wait_ready` blocks until every
+    worker process has reported back from it.
+
+    Args:
+        ring (SharedFrameRing): Ring owned by this process.
+        workers (int): Number of worker processes.
+        ocr_config (dict): OcrEngine keyword arguments for the workers.
+    """
+
+    def __init__(self, ring, workers=2, ocr_config=None):
+        self.ring = ring
+        context = multiprocessing.get_context("spawn")  # same behaviour on Windows and Linux
+        self.workers = workers
+        self._ready_queue = context.Queue()
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(ring.name, ring.slots, ring.slot_bytes, list(sys.path), ocr_config or {}, self._ready_queue),
+        )
+        self.shared = 0
+        self.pickled = 0
+        self.ready_pids = set()
+        self.load_error = None
+        self._share_lock = threading.Lock()
+        self._ready_lock = threading.Lock()
+        # Workers are spawned on demand, one per task while none is idle, so one
+        # task per worker starts all of them now (which worker runs which task
+        # does not matter: readiness is reported by each initializer)
+        self._spawned = [self.pool.submit(_worker_pid) for _ in range(workers)]
+
+    def wait_ready(self):
+        """Block until every worker process has loaded its models; raises if one of them failed."""
+        with self._ready_lock:
+            while len(self.ready_pids) < self.workers:
+                try:
+                    pid, error = self._ready_queue.get(timeout=1.0)
+                except queue.Empty:
+                    # A worker that died while loading breaks the pool and fails these futures
+                    for future in self._spawned:
+                        if future.done() and future.exception() is not None:
+                            raise RuntimeError(f"model worker failed to start: {future.exception()}")
+                    continue
+                if error is not None:
+                    self.load_error = RuntimeError(f"worker {pid} could not load its models: {error}")
+                self.ready_pids.add(pid)
+        if self.load_error is not None:
+            raise self.load_error
+        return self
+
+    def _share(self, image):
+        """(what to send to the worker, RingSlot in use or None)."""
+        slot = None
+        if isinstance(image, Frame):
+            with self._share_lock:
+                slot = image.shared_slot
+                if slot is None or not slot.use():
+                    # Not shared yet, or released after its job finished: copy it again
+                    slot = image.shared_slot = self.ring.put(image.bgr)
+                    if slot is not None:
+                        slot.use()
+        if slot is None:
+            self.pickled += 1
+            return load_bgr(image), None
+        self.shared += 1
+        return slot.meta, slot
+
+    def _call(self, fn, images, *args):
+        shared = [self._share(image) for image in images]
+        try:
+            return self.pool.submit(fn, [payload for payload, _ in shared], *args).result()
+        finally:
+            for _, slot in shared:
+                if slot is not None:
+                    slot.unuse()
+
+    def detect_pens_batch(self, images, threshold=0.3):
+        return self._call(_worker_detect_pens, images, threshold)
+
+    def predict_document(self, image, **kwargs):
+        return self._call(_worker_predict_document, [image], kwargs)
+
+    def predict_document_roi(self, image, pen_boxes, **kwargs):
+        return self._call(_worker_predict_document_roi, [image], pen_boxes, kwargs)
+
+    def ocr_regions(self, image, detections):
+        return self._call(_worker_ocr_regions, [image], detections)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,154 @@
+import io
+import itertools
+import threading
+import time
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+import tracing
+
+# EXIF tag holding the camera orientation (1 = upright)
+EXIF_ORIENTATION_TAG = 274
+# Rotation/flip that makes an image with a given EXIF orientation upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+_frame_ids = itertools.count(1)
+
+
+class Frame:
+    """
+    One JPEG received from the phone, decoded at most once.
+
+    The raw bytes are kept so the frame can still be written to disk as a
+    debug sink, and the decoded, EXIF-upright pixels are cached on first use
+    so every pipeline stage works on the same in-memory array.
+    """
+
+    def __init__(self, jpeg_bytes: bytes, frame_id: int = None, received_at: float = None, header=None):
+        self.jpeg_bytes = jpeg_bytes
+        self.header = header  # socketServer.FrameHeader of a version 2 frame (None for plain JPEG frames)
+        self.frame_id = next(_frame_ids) if frame_id is None else frame_id
+        self.received_at = time.time() if received_at is None else received_at
+        self.orientation = 1
+        self._pil = None
+        self._rgb = None
+        self._bgr = None
+        self._thumbnails = {}
+        self._lock = threading.Lock()
+        self.shared_slot = None  # frameRing.RingSlot once copied into shared memory
+        self.trace = None  # tracing.Trace following this frame through the server
+
+    @classmethod
+    def from_file(cls, path: str) -> "Frame":
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    def _decode(self):
+        with self._lock:
+            if self._pil is None:
+                start, t0 = time.time(), time.perf_counter()
+                image = Image.open(io.BytesIO(self.jpeg_bytes))
+                self._pil = self._upright(image).convert("RGB")
+                self._rgb = np.asarray(self._pil)
+                self._bgr = cv2.cvtColor(self._rgb, cv2.COLOR_RGB2BGR)
+                # May run on a batcher thread, so the span goes to the frame's own trace
+                tracing.record_span("decode", start, time.perf_counter() - t0, trace=self.trace)
+
+    def _upright(self, image: Image.Image) -> Image.Image:
+        # EXIF wins; frames without it may carry the capture orientation in their header
+        self.orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if self.orientation != 1:
+            return ImageOps.exif_transpose(image)
+        if self.header is not None and self.header.orientation in ORIENTATION_TRANSPOSE:
+            self.orientation = self.header.orientation
+            return image.transpose(ORIENTATION_TRANSPOSE[self.orientation])
+        return image
+
+    @property
+    def pil(self) -> Image.Image:
+        """Upright RGB PIL image (shared, copy before drawing on it)."""
+        if self._pil is None:
+            self._decode()
+        return self._pil
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """Upright RGB array (read-only view of the decoded image)."""
+        if self._pil is None:
+            self._decode()
+        return self._rgb
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """Upright BGR array in OpenCV channel order."""
+        if self._pil is None:
+            self._decode()
+        return self._bgr
+
+    def thumbnail(self, size=(64, 64)) -> np.ndarray:
+        """
+        Small upright grayscale array for cheap frame comparisons.
+
+        If the full image has not been decoded yet, the JPEG is decoded at a
+        reduced scale (PIL draft mode), which is much cheaper than a full decode.
+        """
+        if size not in self._thumbnails:
+            if self._pil is not None:
+                image = self._pil.convert("L")
+            else:
+                image = Image.open(io.BytesIO(self.jpeg_bytes))
+                image.draft("L", (size[0] * 2, size[1] * 2))
+                image = self._upright(image).convert("L")
+            image = image.resize(size, Image.BILINEAR)
+            self._thumbnails[size] = np.asarray(image)
+        return self._thumbnails[size]
+
+    @property
+    def size(self):
+        """(width, height) of the upright image."""
+        return self.pil.size
+
+    def release_shared(self):
+        """Give the frame's shared-memory slot back to the ring (its job is finished)."""
+        slot, self.shared_slot = self.shared_slot, None
+        if slot is not None:
+            slot.release()
+
+    def save(self, path: str):
+        """Write the original JPEG bytes to disk (debug sink)."""
+        with open(path, "wb") as f:
+            f.write(self.jpeg_bytes)
+
+
+# -------------------------
+# Stage input helpers
+# -------------------------
+# Every stage accepts a Frame, a numpy array (BGR, OpenCV order), a PIL image
+# or a file path, and converts it with one of these helpers.
+
+def load_pil(image) -> Image.Image:
+    if isinstance(image, Frame):
+        return image.pil
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return Frame.from_file(image).pil
+
+
+def load_bgr(image) -> np.ndarray:
+    if isinstance(image, Frame):
+        return image.bgr
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, Image.Image):
+        return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return Frame.from_file(image).bgr
@@ -0,0 +1,131 @@
+import argparse
+import glob
+import os
+import numpy as np
+import torch
+
+# Exported / quantized models are written here and reused on the next start
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exported_models")
+
+BACKEND_NAMES = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def pin_threads(num_threads: int = None):
+    """Pin the intra-op thread count of PyTorch (None keeps the default)."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+
+def export_path(name: str) -> str:
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    return os.path.join(EXPORT_DIR, name)
+
+
+def quantize_onnx_int8(src_path: str, dst_path: str) -> str:
+    """Dynamic INT8 weight quantization of an ONNX model (skipped if it already exists)."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    if not os.path.exists(dst_path):
+        quantize_dynamic(src_path, dst_path, weight_type=QuantType.QInt8)
+    return dst_path
+
+
+def create_onnx_session(model_path: str, num_threads: int = None):
+    """ONNX Runtime CPU session with a pinned thread count."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+# -------------------------
+# Parity check
+# -------------------------
+def box_iou(a, b) -> np.ndarray:
+    """Pairwise IoU between two (N, 4) and (M, 4) arrays of [x1, y1, x2, y2] boxes."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def compare_boxes(reference, candidate, iou_threshold: float = 0.5) -> dict:
+    """
+    Greedily match candidate boxes to reference boxes by IoU.
+
+    Returns:
+        dict: matched/missing/extra counts, mean IoU of the matches and
+        whether the two box sets agree ("passed").
+    """
+    iou = box_iou(reference, candidate)
+    matched_ious = []
+    if iou.size:
+        iou = iou.copy()
+        while True:
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[i, j] < iou_threshold:
+                break
+            matched_ious.append(float(iou[i, j]))
+            iou[i, :] = -1
+            iou[:, j] = -1
+    n_ref, n_cand = len(reference), len(candidate)
+    return {
+        "matched": len(matched_ious),
+        "missing": n_ref - len(matched_ious),
+        "extra": n_cand - len(matched_ious),
+        "mean_iou": float(np.mean(matched_ious)) if matched_ious else (1.0 if n_ref == n_cand == 0 else 0.0),
+        "passed": len(matched_ious) == n_ref == n_cand,
+    }
+
+
+def parity_check(reference_fn, candidate_fn, image_paths, iou_threshold: float = 0.5) -> dict:
+    """
+    Run a reference and a candidate detector over a fixture set and compare boxes.
+
+    Args:
+        reference_fn / candidate_fn (callable): image path -> list of [x1, y1, x2, y2].
+        image_paths (list): Fixture images.
+        iou_threshold (float): IoU at which two boxes count as the same detection.
+
+    Returns:
+        dict: Per-image comparison and overall pass flag.
+    """
+    per_image = {}
+    for path in image_paths:
+        per_image[os.path.basename(path)] = compare_boxes(reference_fn(path), candidate_fn(path), iou_threshold)
+    return {
+        "images": per_image,
+        "passed": all(r["passed"] for r in per_image.values()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare an inference backend against the eager PyTorch model.")
+    parser.add_argument("detector", choices=["owl", "doclayout"])
+    parser.add_argument("backend", choices=BACKEND_NAMES)
+    parser.add_argument("fixture_dir", help="Directory of .jpg fixture images")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.detector == "owl":
+        import owlv2_singleImage as detector
+    else:
+        import doclayout_singleImage as detector
+
+    fixtures = sorted(glob.glob(os.path.join(args.fixture_dir, "*.jpg")))
+    report = detector.check_backend_parity(args.backend, fixtures, iou_threshold=args.iou, num_threads=args.threads)
+    for name, result in report["images"].items():
+        print(f"{name}: {result}")
+    print("PASSED" if report["passed"] else "FAILED")
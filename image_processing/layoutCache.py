@@ -0,0 +1,151 @@
+import collections
+import threading
+import cv2
+import numpy as np
+from imageFrame import load_bgr
+
+# Rough per-detection overhead used for the memory cap (tuple + label + bbox)
+DETECTION_BYTES = 256
+
+
+class PageFingerprint:
+    """
+    Downscaled description of a page: a 64-bit difference hash for quick
+    candidate selection plus ORB features for aligning two views of it.
+    """
+
+    def __init__(self, image, match_size: int = 800, n_features: int = 1000):
+        gray = cv2.cvtColor(load_bgr(image), cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        self.image_size = (w, h)
+        self.scale = min(1.0, match_size / max(w, h))
+        small = cv2.resize(gray, (int(w * self.scale), int(h * self.scale)), interpolation=cv2.INTER_AREA)
+
+        tiny = cv2.resize(small, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (tiny[:, 1:] > tiny[:, :-1]).flatten()
+        self.dhash = int("".join("1" if b else "0" for b in bits), 2)
+
+        orb = cv2.ORB_create(nfeatures=n_features)
+        keypoints, self.descriptors = orb.detectAndCompute(small, None)
+        self.points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+
+    def hash_distance(self, other) -> int:
+        return bin(self.dhash ^ other.dhash).count("1")
+
+    def nbytes(self) -> int:
+        descriptors = self.descriptors.nbytes if self.descriptors is not None else 0
+        return descriptors + self.points.nbytes
+
+
+class LayoutCache:
+    """
+    LRU cache of DocLayout results keyed on page content.
+
+    A lookup selects cached pages whose dHash is close to the new frame, then
+    aligns each candidate with ORB feature matching and a RANSAC homography.
+    On a match the cached boxes are mapped into the new frame's coordinates,
+    so DocLayout does not run again when only the pens moved on the same page.
+
+    Args:
+        max_entries (int): Maximum number of cached pages.
+        max_bytes (int): Approximate memory cap for fingerprints and boxes.
+        hash_tolerance (int): Maximum dHash Hamming distance (of 64 bits) for
+            a page to be considered as a candidate.
+        max_candidates (int): Number of closest candidates to try aligning.
+        min_inliers (int): RANSAC inliers required to accept an alignment.
+    """
+
+    def __init__(self, max_entries: int = 16, max_bytes: int = 32 * 1024 * 1024,
+                 hash_tolerance: int = 20, max_candidates: int = 3, min_inliers: int = 25):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hash_tolerance = hash_tolerance
+        self.max_candidates = max_candidates
+        self.min_inliers = min_inliers
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # id -> (fingerprint, detections, nbytes)
+        self._next_id = 0
+        self._bytes = 0
+        self._matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        self._lock = threading.Lock()
+
+    def get_or_predict(self, image, predict_fn):
+        """Return cached (re-projected) detections for the page, or run `predict_fn(image)` and cache them."""
+        fingerprint = PageFingerprint(image)
+        detections = self.lookup(fingerprint)
+        if detections is not None:
+            return detections
+        detections = predict_fn(image)
+        self.store(fingerprint, detections)
+        return detections
+
+    def lookup(self, fingerprint):
+        with self._lock:
+            candidates = sorted(
+                ((fingerprint.hash_distance(fp), key) for key, (fp, _, _) in self._entries.items()),
+                key=lambda c: c[0],
+            )
+            candidates = [key for dist, key in candidates if dist <= self.hash_tolerance][:self.max_candidates]
+            entries = [(key, self._entries[key]) for key in candidates]
+
+        for key, (cached_fp, detections, _) in entries:
+            homography = self._align(cached_fp, fingerprint)
+            if homography is None:
+                continue
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+            return [self._project(det, homography, fingerprint.image_size) for det in detections]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, fingerprint, detections):
+        nbytes = fingerprint.nbytes() + DETECTION_BYTES * len(detections)
+        with self._lock:
+            self._entries[self._next_id] = (fingerprint, detections, nbytes)
+            self._next_id += 1
+            self._bytes += nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+
+    def _align(self, cached_fp, fingerprint):
+        """Full-resolution homography from the cached page to the new frame, or None."""
+        if cached_fp.descriptors is None or fingerprint.descriptors is None:
+            return None
+        matches = self._matcher.match(cached_fp.descriptors, fingerprint.descriptors)
+        if len(matches) < self.min_inliers:
+            return None
+        src = np.float32([cached_fp.points[m.queryIdx] for m in matches]).reshape(-1, 1, 2)
+        dst = np.float32([fingerprint.points[m.trainIdx] for m in matches]).reshape(-1, 1, 2)
+        homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+        if homography is None or int(mask.sum()) < self.min_inliers:
+            return None
+        # Fingerprint points live in downscaled coordinates; lift to full resolution
+        scale_src = np.diag([cached_fp.scale, cached_fp.scale, 1.0])
+        unscale_dst = np.diag([1.0 / fingerprint.scale, 1.0 / fingerprint.scale, 1.0])
+        return unscale_dst @ homography @ scale_src
+
+    @staticmethod
+    def _project(det, homography, image_size):
+        x1, y1, x2, y2 = det.bbox
+        corners = np.float32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]).reshape(-1, 1, 2)
+        mapped = cv2.perspectiveTransform(corners, homography).reshape(-1, 2)
+        w, h = image_size
+        nx1, ny1 = np.clip(mapped.min(axis=0), 0, [w, h])
+        nx2, ny2 = np.clip(mapped.max(axis=0), 0, [w, h])
+        return det._replace(bbox=[float(nx1), float(ny1), float(nx2), float(ny2)])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
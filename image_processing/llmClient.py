@@ -0,0 +1,371 @@
+import asyncio
+import base64
+import collections
+import io
+import json
+import queue
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import tracing
+
+
+# -------------------------
+# Providers
+# -------------------------
+class Provider:
+    """
+    One LLM backend. Calls are blocking and must give up after `timeout` seconds;
+    the client adds pooling, rate limiting, retries and hedging around them.
+    """
+
+    name = "provider"
+
+    def generate(self, prompt: str, image=None, timeout: float = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, image=None, timeout: float = None):
+        """Yield the answer in chunks (default: one chunk)."""
+        yield self.generate(prompt, image, timeout)
+
+    def is_retryable(self, error: Exception) -> bool:
+        return isinstance(error, (TimeoutError, ConnectionError, socket.timeout))
+
+
+class GeminiProvider(Provider):
+    """google.generativeai; `image` is a PIL image sent along with the prompt."""
+
+    # google.api_core exception names worth retrying (rate limit, overload, transient errors)
+    RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+                        "DeadlineExceeded", "InternalServerError", "GatewayTimeout"}
+
+    def __init__(self, model_name: str, api_key: str):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def _contents(self, prompt, image):
+        return prompt if image is None else [prompt, image]
+
+    def generate(self, prompt, image=None, timeout=None):
+        response = self.model.generate_content(self._contents(prompt, image), request_options={"timeout": timeout})
+        return response.text if response and hasattr(response, "text") else ""
+
+    def stream(self, prompt, image=None, timeout=None):
+        for chunk in self.model.generate_content(self._contents(prompt, image), stream=True,
+                                                 request_options={"timeout": timeout}):
+            # Chunks without text parts (e.g. the final safety/usage chunk) raise on .text
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+    def is_retryable(self, error):
+        return type(error).__name__ in self.RETRYABLE_ERRORS or super().is_retryable(error)
+
+
+class StubHTTPProvider(Provider):
+    """The local stub server (stubLLMServer.py), for tests and benchmarks."""
+
+    name = "stub"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def _request(self, prompt, image, stream, timeout):
+        body = {"prompt": prompt, "stream": stream}
+        if image is not None:
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=90)
+            body["image"] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        return urllib.request.urlopen(request, timeout=timeout or 120)
+
+    def generate(self, prompt, image=None, timeout=None):
+        with self._request(prompt, image, False, timeout) as response:
+            return json.loads(response.read())["text"]
+
+    def stream(self, prompt, image=None, timeout=None):
+        with self._request(prompt, image, True, timeout) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)["text"]
+
+    def is_retryable(self, error):
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code == 429 or error.code >= 500
+        return isinstance(error, urllib.error.URLError) or super().is_retryable(error)
+
+
+# -------------------------
+# Client
+# -------------------------
+class TokenBucket:
+    """Rate limiter: `rate` requests per second on average, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns how many seconds the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class LLMClient:
+    """
+    Concurrency-limited LLM client shared by all pipeline workers.
+
+    Requests run on a private asyncio loop: at most `max_concurrency` are in
+    flight, each waits for a token from the rate limiter, and every request
+    has a deadline that covers queueing, retries and hedges. A single attempt
+    gives up after `attempt_timeout`, and retryable errors (rate limits,
+    overload, timeouts) are retried with jittered exponential backoff. With
+    `hedge_percentile` set, a second identical request is sent when the first
+    one is slower than that percentile of recent latencies, and the first
+    answer wins. A concurrency slot is held until the provider call really
+    returns, also when its attempt was abandoned (timed out or lost a hedge).
+    Streams are retried only until their first chunk (`attempt_timeout`
+    bounds the wait for it) and are never hedged.
+
+    Args:
+        provider (Provider): Backend to call.
+        max_concurrency (int): Requests in flight at once.
+        requests_per_minute (float): Average request rate (None = unlimited).
+        burst (int): Requests allowed back to back before the rate applies.
+        timeout (float): Default deadline per call in seconds.
+        attempt_timeout (float): Seconds one attempt may take (for a stream:
+            until its first chunk) before it is retried.
+        max_retries (int): Retries after the first attempt.
+        backoff (float): First retry delay in seconds, doubled per retry.
+        max_backoff (float): Upper bound for a retry delay.
+        hedge_percentile (float): Latency percentile (e.g. 95) after which a
+            hedged request is sent; None disables hedging.
+        hedge_min_samples (int): Latencies needed before hedging starts.
+    """
+
+    def __init__(self, provider, max_concurrency=4, requests_per_minute=60, burst=None, timeout=60.0,
+                 attempt_timeout=20.0, max_retries=3, backoff=0.5, max_backoff=8.0, hedge_percentile=None,
+                 hedge_min_samples=20):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.bucket = None
+        if requests_per_minute:
+            self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max_concurrency)
+        self.latencies = collections.deque(maxlen=200)
+        self.counts = collections.Counter()
+
+        # Every provider call holds a semaphore slot until it returns, so this many threads suffice
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True).start()
+        self._semaphore = self._run(self._make_semaphore())
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.counts["timeouts"] += 1
+            raise TimeoutError("LLM request deadline exceeded")
+        return remaining
+
+    async def _admit(self, deadline):
+        """Wait for the rate limiter (the caller already holds a concurrency slot)."""
+        if self.bucket is None:
+            return
+        wait = self.bucket.reserve()
+        if wait >= deadline - time.monotonic():
+            self.bucket.refund()
+            self.counts["timeouts"] += 1
+            raise TimeoutError("LLM rate limit wait exceeds the deadline")
+        if wait > 0:
+            self.counts["throttled"] += 1
+            await asyncio.sleep(wait)
+
+    def _backoff_delay(self, attempt):
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _hedge_delay(self):
+        if self.hedge_percentile is None or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    async def _launch(self, deadline, call):
+        """
+        Take a concurrency slot and a rate-limit token, then start `call(remaining
+        seconds)` on the executor. The slot is released when the call returns,
+        not when the caller stops waiting for it; await the returned future
+        through `asyncio.shield` so that cancelling the caller leaves it running.
+        """
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            self.counts["timeouts"] += 1
+            raise TimeoutError("LLM request deadline exceeded while waiting for a free slot")
+        try:
+            await self._admit(deadline)
+            remaining = self._remaining(deadline)
+            self.counts["requests"] += 1
+            future = self._loop.run_in_executor(self._executor, call, remaining)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(self._call_finished)
+        return future, remaining
+
+    def _call_finished(self, future):
+        self._semaphore.release()
+        if not future.cancelled():
+            future.exception()  # an abandoned call's error is not "never retrieved"
+
+    async def _attempt(self, prompt, image, deadline):
+        start, t0 = time.time(), time.perf_counter()
+        future, remaining = await self._launch(
+            deadline, lambda remaining: self.provider.generate(prompt, image, min(self.attempt_timeout, remaining)))
+        result = await asyncio.wait_for(asyncio.shield(future), min(self.attempt_timeout, remaining))
+        self.latencies.append(time.perf_counter() - t0)
+        tracing.record_span("llm_request", start, time.perf_counter() - t0, provider=self.provider.name)
+        return result
+
+    async def _hedged(self, prompt, image, deadline):
+        first = asyncio.ensure_future(self._attempt(prompt, image, deadline))
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        if done:
+            return first.result()
+        self.counts["hedges"] += 1
+        second = asyncio.ensure_future(self._attempt(prompt, image, deadline))
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        self.counts["hedge_wins"] += 1
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def _with_retries(self, call, deadline, can_retry=None):
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                retryable = isinstance(e, asyncio.TimeoutError) or self.provider.is_retryable(e)
+                if can_retry is not None and not can_retry():
+                    retryable = False
+                delay = self._backoff_delay(attempt)
+                if not retryable or attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.counts["failures"] += 1
+                    raise
+                print(f"[LLM] {type(e).__name__}: {e}; retrying in {delay:.1f} s")
+                self.counts["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def agenerate(self, prompt: str, image=None, timeout: float = None) -> str:
+        """Answer `prompt` (optionally about a PIL `image`) within `timeout` seconds."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        return await self._with_retries(lambda: self._hedged(prompt, image, deadline), deadline)
+
+    def generate(self, prompt: str, image=None, timeout: float = None) -> str:
+        """Blocking version of `agenerate`, callable from any thread."""
+        return self._run(self.agenerate(prompt, image, timeout))
+
+    async def _stream_into(self, prompt, image, deadline, chunks):
+        lock = threading.Lock()
+        progress = {"started": False}  # a chunk reached the caller: no more retries
+
+        async def attempt():
+            abandoned = [False]
+            first_chunk = asyncio.Event()
+
+            def produce(remaining):
+                for chunk in self.provider.stream(prompt, image, remaining):
+                    with lock:
+                        if abandoned[0]:
+                            return  # timed out before its first chunk; a retry has taken over
+                        progress["started"] = True
+                        chunks.put(("chunk", chunk))
+                    self._loop.call_soon_threadsafe(first_chunk.set)
+
+            future, remaining = await self._launch(deadline, produce)
+            first = asyncio.ensure_future(first_chunk.wait())
+            await asyncio.wait({future, first}, timeout=min(self.attempt_timeout, remaining),
+                               return_when=asyncio.FIRST_COMPLETED)
+            first.cancel()
+            with lock:
+                if not progress["started"] and not future.done():
+                    abandoned[0] = True
+                    raise asyncio.TimeoutError("no answer chunk within the attempt timeout")
+            # Streaming (or already finished): the rest may take until the deadline
+            await asyncio.shield(future)
+
+        try:
+            await self._with_retries(attempt, deadline, can_retry=lambda: not progress["started"])
+            chunks.put(("end", None))
+        except Exception as e:
+            chunks.put(("error", e))
+
+    def stream(self, prompt: str, image=None, timeout: float = None):
+        """Yield the answer chunk by chunk; retried only until the first chunk arrives."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        chunks = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._stream_into(prompt, image, deadline, chunks), self._loop)
+        while True:
+            try:
+                kind, value = chunks.get(timeout=self._remaining(deadline))
+            except queue.Empty:
+                self.counts["timeouts"] += 1
+                raise TimeoutError("LLM stream deadline exceeded")
+            if kind == "end":
+                return
+            if kind == "error":
+                raise value
+            yield value
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None
+        return dict(self.counts, provider=self.provider.name, p95_latency=p95)
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+# Readiness states of a registered model
+PENDING = "PENDING"  # registered, not loading yet
+LOADING = "LOADING"
+READY = "READY"
+FAILED = "FAILED"
+
+# MODEL_OFFLINE=1 starts without network access, from models already in the
+# Hugging Face cache (or MODEL_CACHE_DIR); a missing model then fails fast
+# instead of hanging on a download
+OFFLINE = os.environ.get("MODEL_OFFLINE", "0") == "1"
+CACHE_DIR = os.environ.get("MODEL_CACHE_DIR")
+if OFFLINE:
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+
+def hub_kwargs() -> dict:
+    """Keyword arguments for from_pretrained/hf_hub_download honouring the offline settings."""
+    kwargs = {}
+    if OFFLINE:
+        kwargs["local_files_only"] = True
+    if CACHE_DIR:
+        kwargs["cache_dir"] = CACHE_DIR
+    return kwargs
+
+
+class ModelHandle:
+    """
+    One lazily loaded model.
+
+    `loader()` returns the loaded object; the optional `warmup(value)` then
+    runs one inference on a synthetic input so the first real frame does not
+    pay for lazy initialisation (kernel selection, ONNX export, text queries).
+    """
+
+    def __init__(self, name, loader, warmup=None):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.state = PENDING
+        self.error = None
+        self.value = None
+        self.load_seconds = None
+        self._loading_thread = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _claim(self) -> bool:
+        """Move PENDING -> LOADING; returns False if someone else already started."""
+        with self._lock:
+            if self.state != PENDING:
+                return False
+            self.state = LOADING
+            return True
+
+    def _load(self, on_change):
+        on_change()
+        start = time.perf_counter()
+        self._loading_thread = threading.get_ident()
+        try:
+            # Set before the warm-up, which goes through the normal get() paths
+            self.value = self.loader()
+            if self.warmup is not None:
+                self.warmup(self.value)
+            self.state = READY
+            self.load_seconds = time.perf_counter() - start
+            print(f"[Models] {self.name} ready in {self.load_seconds:.1f} s")
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+            print(f"[Models] {self.name} failed to load: {e}")
+        self._done.set()
+        on_change()
+
+
+class ModelRegistry:
+    """
+    Named models with explicit readiness states, loaded on first use or in
+    background threads.
+
+    `get(name)` returns the loaded model: it loads it in the calling thread if
+    nobody has started yet, waits if a background load is running, and raises
+    if loading failed.
+    """
+
+    def __init__(self):
+        self._handles = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None):
+        with self._lock:
+            self._handles[name] = ModelHandle(name, loader, warmup)
+
+    def get(self, name, timeout=None):
+        handle = self._handles[name]
+        if handle._loading_thread == threading.get_ident() and handle.state == LOADING:
+            return handle.value  # called from this model's own warm-up
+        if handle._claim():
+            handle._load(self._notify)
+        elif not handle._done.wait(timeout):
+            raise TimeoutError(f"Model {name} is still loading")
+        if handle.state == FAILED:
+            raise RuntimeError(f"Model {name} failed to load: {handle.error}")
+        return handle.value
+
+    def load_in_background(self, names=None):
+        """Start loading the given (default: all) models, one thread each."""
+        for name in names or list(self._handles):
+            handle = self._handles[name]
+            if handle._claim():
+                threading.Thread(target=handle._load, args=(self._notify,),
+                                 name=f"load-{name}", daemon=True).start()
+
+    def wait_ready(self, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for handle in list(self._handles.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not handle._done.wait(remaining):
+                return False
+        return self.status() == READY
+
+    def states(self) -> dict:
+        return {name: handle.state for name, handle in self._handles.items()}
+
+    def status(self) -> str:
+        """Overall state: FAILED if any model failed, READY if all are, else LOADING."""
+        states = set(self.states().values())
+        if FAILED in states:
+            return FAILED
+        if states <= {READY}:
+            return READY
+        return LOADING
+
+    def add_listener(self, fn):
+        """Call `fn(status)` whenever a model changes state."""
+        self._listeners.append(fn)
+
+    def _notify(self):
+        status = self.status()
+        for listener in list(self._listeners):
+            listener(status)
+
+
+REGISTRY = ModelRegistry()
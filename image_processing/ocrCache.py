@@ -0,0 +1,246 @@
+import collections
+import math
+import sqlite3
+import threading
+import time
+import cv2
+import numpy as np
+
+# Regions are reduced to at most this many pixels per side to measure their skew
+DESKEW_MAX_SIDE = 512
+# Only rotations up to this many degrees are treated as skew (larger ones are layout)
+MAX_SKEW_DEGREES = 15
+# Regions are compared at glyph resolution: scaled so a text line is this many pixels high
+LINE_HEIGHT = 32
+# Longest side of a normalized region (a very long block is scaled down further)
+MAX_GLYPH_SIDE = 4096
+# Two regions differ if more than this many ink pixels in one LINE_HEIGHT/2 square
+# have no ink within a pixel in the other (a changed digit is several times this)
+MAX_GLYPH_DIFF = 12
+
+
+def _ink(gray: np.ndarray) -> np.ndarray:
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ink
+
+
+def deskew(gray: np.ndarray) -> np.ndarray:
+    """Rotate a grayscale text region so its ink lies level (small angles only)."""
+    scale = min(1.0, DESKEW_MAX_SIDE / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    points = cv2.findNonZero(_ink(small))
+    if points is None or len(points) < 20:
+        return gray
+    angle = cv2.minAreaRect(points)[-1]
+    # minAreaRect reports [-90, 0) or (0, 90] depending on the OpenCV version
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if abs(angle) < 0.5 or abs(angle) > MAX_SKEW_DEGREES:
+        return gray
+    h, w = gray.shape
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(gray, rotation, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def line_height(ink: np.ndarray) -> float:
+    """Median height of the runs of rows that contain ink (one run per text line)."""
+    rows = np.concatenate([[0], ink.any(axis=1).astype(np.int8), [0]])
+    edges = np.flatnonzero(np.diff(rows))
+    runs = edges[1::2] - edges[0::2]
+    return float(np.median(runs)) if len(runs) else float(ink.shape[0])
+
+
+def normalize_roi(roi: np.ndarray) -> np.ndarray:
+    """
+    Ink mask (uint8 0/1) of a BGR (or gray) region at glyph resolution.
+
+    The region is deskewed, trimmed to its ink (so crops a few pixels apart
+    line up) and scaled, keeping its aspect ratio, so that a text line is
+    LINE_HEIGHT pixels high.
+    """
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+    gray = deskew(gray)
+    points = cv2.findNonZero(_ink(gray))
+    if points is None:
+        return np.zeros((LINE_HEIGHT, LINE_HEIGHT), dtype=np.uint8)
+    x, y, w, h = cv2.boundingRect(points)
+    gray = gray[y:y + h, x:x + w]
+    scale = LINE_HEIGHT / max(1.0, line_height(_ink(gray)))
+    scale = min(scale, MAX_GLYPH_SIDE / max(w, h))
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    return _ink(cv2.resize(gray, size, interpolation=interpolation))
+
+
+def phash(glyphs: np.ndarray, hash_size: int = 16) -> int:
+    """Perceptual hash: signs of the lowest DCT frequencies against their median (hash_size^2 - 1 bits)."""
+    square = cv2.resize(glyphs.astype(np.float32), (64, 64), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(square)[:hash_size, :hash_size].flatten()[1:]  # without the DC term
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def same_glyphs(a: np.ndarray, b: np.ndarray) -> bool:
+    """
+    Whether two normalized regions show the same text.
+
+    Ink that has no ink within one pixel in the other region counts as a
+    difference, so anti-aliasing and sub-pixel shifts do not; any
+    LINE_HEIGHT/2 square with more than MAX_GLYPH_DIFF such pixels (e.g. a
+    "4" that became a "5") makes the regions different.
+    """
+    (ha, wa), (hb, wb) = a.shape, b.shape
+    if abs(ha - hb) > max(2, ha // 20) or abs(wa - wb) > max(2, wa // 20):
+        return False
+    if (ha, wa) != (hb, wb):
+        b = cv2.resize(b, (wa, ha), interpolation=cv2.INTER_NEAREST)
+    kernel = np.ones((3, 3), np.uint8)
+    diff = (a & (1 - cv2.dilate(b, kernel))) | (b & (1 - cv2.dilate(a, kernel)))
+    window = max(1, LINE_HEIGHT // 2)
+    local = cv2.boxFilter(diff.astype(np.float32), -1, (window, window), normalize=False)
+    return float(local.max()) <= MAX_GLYPH_DIFF
+
+
+def _pack(glyphs: np.ndarray) -> tuple:
+    return glyphs.shape, np.packbits(glyphs).tobytes()
+
+
+def _unpack(packed) -> np.ndarray:
+    (h, w), data = packed
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=h * w).reshape(h, w)
+
+
+class OcrCache:
+    """
+    Cache of OCR results keyed on what a region looks like, not where it is.
+
+    A region is normalized to an ink mask at glyph resolution (deskewed,
+    trimmed, a text line LINE_HEIGHT pixels high) and reduced to a 255-bit
+    perceptual hash; the key also holds the aspect ratio (in quarter-octave
+    buckets) and the OCR configuration (language and preprocessing), so a
+    setting change never returns stale text. The hash only finds candidates:
+    cached regions within `max_distance` bits, closest first. A candidate's
+    text is reused only if its stored mask matches the new one glyph for
+    glyph (`same_glyphs`), so the same paragraph cropped a few pixels
+    differently hits, while "124 + 357" never returns the text of "124 + 358".
+
+    Entries live in an in-memory LRU; with `db_path` they are also written to
+    SQLite and the most recent ones are loaded again on first use.
+
+    Args:
+        db_path (str): SQLite file for persistence (None = memory only).
+        max_entries (int): Size bound; least recently used entries are evicted.
+        max_distance (int): Maximum Hamming distance for a candidate.
+    """
+
+    def __init__(self, db_path=None, max_entries=2048, max_distance=12):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hits = 0
+        self.rejected = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        # (config, aspect, hash) -> (text, ocr seconds, packed ink mask)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._opened = False  # the SQLite file is read on first use, not on import
+
+    def _open(self):
+        if self._opened:
+            return
+        self._opened = True
+        if not self.db_path:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_regions ("
+            " config TEXT, aspect INTEGER, hash TEXT, text TEXT, seconds REAL, last_used REAL,"
+            " height INTEGER, width INTEGER, glyphs BLOB,"
+            " PRIMARY KEY (config, aspect, hash))"
+        )
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT config, aspect, hash, text, seconds, height, width, glyphs FROM"
+            " (SELECT * FROM ocr_regions ORDER BY last_used DESC LIMIT ?) ORDER BY last_used",
+            (self.max_entries,),
+        ).fetchall()
+        for config, aspect, hash_hex, text, seconds, height, width, glyphs in rows:
+            self._entries[(config, aspect, int(hash_hex, 16))] = (text, seconds, ((height, width), glyphs))
+
+    def settings(self) -> dict:
+        """Constructor arguments, e.g. to build the same cache in a worker process."""
+        return {"db_path": self.db_path, "max_entries": self.max_entries, "max_distance": self.max_distance}
+
+    @staticmethod
+    def key(roi: np.ndarray, config: str) -> tuple:
+        """(config, aspect, hash, ink mask) of a region; pass it to `get` and `put`."""
+        glyphs = normalize_roi(roi)
+        h, w = glyphs.shape
+        aspect = round(math.log2(w / h) * 4)
+        return config, aspect, phash(glyphs), glyphs
+
+    def get(self, key):
+        """Cached text for the region key, or None."""
+        config, aspect, value, glyphs = key
+        with self._lock:
+            self._open()
+            candidates = []
+            for cached_key in self._entries:
+                if cached_key[0] != config or cached_key[1] != aspect:
+                    continue
+                distance = bin(cached_key[2] ^ value).count("1")
+                if distance <= self.max_distance:
+                    candidates.append((distance, cached_key))
+            for _, cached_key in sorted(candidates):
+                text, seconds, packed = self._entries[cached_key]
+                if same_glyphs(glyphs, _unpack(packed)):
+                    break
+                self.rejected += 1
+            else:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(cached_key)
+            self.saved_seconds += seconds
+            if self._db is not None:
+                self._db.execute("UPDATE ocr_regions SET last_used = ? WHERE config = ? AND aspect = ? AND hash = ?",
+                                 (time.time(), cached_key[0], cached_key[1], format(cached_key[2], "x")))
+                self._db.commit()
+            return text
+
+    def put(self, key, text: str, seconds: float):
+        """Store the OCR text of a region and how long recognising it took."""
+        config, aspect, value, glyphs = key
+        packed = _pack(glyphs)
+        with self._lock:
+            self._open()
+            self._entries[(config, aspect, value)] = (text, seconds, packed)
+            self._entries.move_to_end((config, aspect, value))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self._db is not None:
+                (height, width), data = packed
+                self._db.execute("INSERT OR REPLACE INTO ocr_regions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (config, aspect, format(value, "x"), text, seconds, time.time(),
+                                  height, width, data))
+                self._db.execute(
+                    "DELETE FROM ocr_regions WHERE rowid IN"
+                    " (SELECT rowid FROM ocr_regions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "rejected": self.rejected,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import cv2
+import tesserocr
+from PIL import Image
+from imageFrame import load_bgr
+from ocrCache import OcrCache
+
+# tesserocr talks to libtesseract directly: one API object per worker is
+# created once and reused, instead of spawning a tesseract.exe per region.
+# It is required (on Windows: the prebuilt tesserocr wheels, or conda-forge);
+# tessdata_path points it at the language files, e.g. those installed with
+# tesseract.exe in C:\Program Files\Tesseract-OCR\tessdata.
+
+
+class OcrPreprocess:
+    """
+    Per-region preprocessing applied before Tesseract.
+
+    The default passes the region to Tesseract in colour (RGB), as the
+    pipeline always has.
+
+    Args:
+        grayscale (bool): Convert the region to grayscale.
+        binarize (bool): Otsu binarization (implies grayscale).
+        upscale (float): Resize factor, e.g. 2.0 for small text in photos.
+        dpi (int): Resolution reported to Tesseract for the (upscaled) region.
+    """
+
+    def __init__(self, grayscale=False, binarize=False, upscale=1.0, dpi=300):
+        self.grayscale = grayscale
+        self.binarize = binarize
+        self.upscale = upscale
+        self.dpi = dpi
+
+    def key(self) -> str:
+        """Settings that change the OCR output, for cache keys."""
+        return f"gray={int(self.grayscale)},bin={int(self.binarize)},up={self.upscale},dpi={self.dpi}"
+
+    def apply(self, roi):
+        """BGR region -> RGB or single-channel array ready for OCR."""
+        if self.upscale != 1.0:
+            roi = cv2.resize(roi, None, fx=self.upscale, fy=self.upscale, interpolation=cv2.INTER_CUBIC)
+        if self.grayscale or self.binarize:
+            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+            if self.binarize:
+                _, roi = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return roi
+        return cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
+
+
+# -------------------------
+# Worker side
+# -------------------------
+# Each worker (thread or process) keeps its own long-lived Tesseract API.
+_worker = threading.local()
+
+
+def _init_worker(lang, tessdata_path):
+    if tessdata_path:
+        _worker.api = tesserocr.PyTessBaseAPI(path=tessdata_path, lang=lang)
+    else:
+        _worker.api = tesserocr.PyTessBaseAPI(lang=lang)
+
+
+def _ocr_roi(roi, preprocess, lang, tessdata_path):
+    if not hasattr(_worker, "api"):
+        _init_worker(lang, tessdata_path)
+    roi = preprocess.apply(roi)
+    _worker.api.SetVariable("user_defined_dpi", str(preprocess.dpi))
+    _worker.api.SetImage(Image.fromarray(roi))
+    return _worker.api.GetUTF8Text().strip()
+
+
+def _timed_ocr_roi(roi, preprocess, lang, tessdata_path):
+    start = time.perf_counter()
+    text = _ocr_roi(roi, preprocess, lang, tessdata_path)
+    return text, time.perf_counter() - start
+
+
+class OcrEngine:
+    """
+    Pool of long-lived OCR workers; regions of one frame are recognised in parallel.
+
+    Threads are the default: tesserocr releases the GIL while recognising,
+    and threads avoid re-importing the
+    server (and its models) in spawned processes on Windows. Use
+    executor="process" on hosts where the module is safe to spawn.
+
+    Args:
+        workers (int): Number of OCR workers.
+        lang (str): Tesseract language.
+        preprocess (OcrPreprocess): Per-region preprocessing.
+        tessdata_path (str): tessdata directory for tesserocr (None = default).
+        executor (str): "thread" or "process".
+        cache (OcrCache): Reuse text for regions seen before; a dict of
+            OcrCache arguments builds one (e.g. in a worker process).
+    """
+
+    def __init__(self, workers=4, lang="eng", preprocess=None, tessdata_path=None,
+                 executor="thread", cache=None):
+        self.workers = workers
+        self.lang = lang
+        self.preprocess = preprocess or OcrPreprocess()
+        self.tessdata_path = tessdata_path
+        pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        self.pool = pool_cls(max_workers=workers)
+        self.cache = OcrCache(**cache) if isinstance(cache, dict) else cache
+
+    def config_key(self) -> str:
+        """Everything besides the pixels that decides what Tesseract returns."""
+        return f"{self.lang}|{self.tessdata_path}|{self.preprocess.key()}"
+
+    def recognize(self, rois):
+        """OCR a list of BGR regions in parallel; results keep the input order."""
+        n = len(rois)
+        if self.cache is None:
+            return list(self.pool.map(_ocr_roi, rois, [self.preprocess] * n, [self.lang] * n,
+                                      [self.tessdata_path] * n))
+
+        # Only regions the cache has not seen go to Tesseract
+        config = self.config_key()
+        keys = [self.cache.key(roi, config) for roi in rois]
+        texts = [self.cache.get(key) for key in keys]
+        missing = [i for i, text in enumerate(texts) if text is None]
+        m = len(missing)
+        results = self.pool.map(_timed_ocr_roi, [rois[i] for i in missing], [self.preprocess] * m,
+                                [self.lang] * m, [self.tessdata_path] * m)
+        for i, (text, seconds) in zip(missing, results):
+            texts[i] = text
+            self.cache.put(keys[i], text, seconds)
+        return texts
+
+    def ocr_regions(self, image, detections):
+        """
+        OCR DocLayout detections of an image and join them in reading order.
+
+        Args:
+            image: Frame, BGR numpy array, PIL image or path to the original image.
+            detections (list[LayoutDetection]): DocLayout blocks to read.
+
+        Returns:
+            str: Recognised text of all non-empty regions, top to bottom.
+        """
+        image = load_bgr(image)
+
+        # Sort bounding boxes by top y-coordinate
+        sorted_boxes = sorted(detections, key=lambda d: d.bbox[1])
+
+        rois = []
+        for det in sorted_boxes:
+            x1, y1, x2, y2 = map(int, det.bbox)
+            rois.append(image[max(y1, 0):y2, max(x1, 0):x2])
+
+        texts = self.recognize([roi for roi in rois if roi.size])
+        return "\n".join(text for text in texts if text)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
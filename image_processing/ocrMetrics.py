@@ -0,0 +1,20 @@
+import re
+import jiwer
+
+
+def normalize_text(text: str) -> str:
+    """Lower-case and collapse whitespace, so layout noise does not count as OCR differences."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def text_error_rates(reference: str, hypothesis: str) -> dict:
+    """WER/CER of `hypothesis` against `reference` (jiwer), plus the matching accuracies."""
+    word_error = jiwer.wer(reference, hypothesis)
+    char_error = jiwer.cer(reference, hypothesis)
+
+    return {
+        "wer": word_error,
+        "wer_accuracy": 1 - word_error,
+        "cer": char_error,
+        "cer_accuracy": 1 - char_error
+    }
@@ -1,73 +1,266 @@
 import os
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+import threading
+from PIL import Image, ImageDraw, ImageFont
 import torch
 from transformers import Owlv2Processor, Owlv2ForObjectDetection
-import time
+from transformers.models.owlv2.modeling_owlv2 import Owlv2ObjectDetectionOutput
+import tracing
+from imageFrame import load_pil
+from stageResults import PenDetection
+import inferenceBackend as ib
+from modelRegistry import REGISTRY, hub_kwargs
 
-# Load model and processor once (keep in memory)
-processor = Owlv2Processor.from_pretrained("google/owlv2-base-patch16-ensemble")
-model = Owlv2ForObjectDetection.from_pretrained("google/owlv2-base-patch16-ensemble")
+MODEL_ID = "google/owlv2-base-patch16-ensemble"
+
+# Model and processor are loaded once, on first use or by REGISTRY.load_in_background()
+def _load_model():
+    processor = Owlv2Processor.from_pretrained(MODEL_ID, **hub_kwargs())
+    model = Owlv2ForObjectDetection.from_pretrained(MODEL_ID, **hub_kwargs())
+    return processor, model
+
+def _warmup(_):
+    # Builds the backend (ONNX export if needed) and the cached text queries
+    detect_pens_batch([Image.new("RGB", (640, 480), "white")])
+
+REGISTRY.register("owlv2", _load_model, warmup=_warmup)
+
+def get_processor_and_model():
+    """(processor, model), loaded through the model registry."""
+    return REGISTRY.get("owlv2")
 
 # Define text labels
 text_labels = [["a pen"]]
 label_to_id = {"a pen": 0}  # map class name to ID
 
-def detect_pens(image_path: str, save_img_path=None, save_label_path=None, threshold=0.3):
+# Text queries never change, so they are tokenized and embedded only once
+_text_queries = None
+
+def get_text_queries():
     """
-    Run Owlv2 object detection on the image.
+    Return the cached (query_embeds, query_mask) for `text_labels`.
 
-    Returns:
-        pen_count (int): number of pens detected above threshold
-        result_image (PIL.Image): optional image with bounding boxes drawn
+    query_embeds has shape (1, num_queries, dim) and is broadcast over the
+    image batch in `detect_pens_batch`.
     """
-    image = Image.open(image_path).convert("RGB")
-    image = ImageOps.exif_transpose(image)
-    width, height = image.size
+    global _text_queries
+    if _text_queries is None:
+        processor, model = get_processor_and_model()
+        text_inputs = processor(text=text_labels, return_tensors="pt")
+        with torch.no_grad():
+            query_embeds = model.owlv2.get_text_features(
+                input_ids=text_inputs["input_ids"],
+                attention_mask=text_inputs["attention_mask"],
+            )
+        query_embeds = query_embeds.reshape(1, -1, query_embeds.shape[-1])
+        query_mask = text_inputs["input_ids"][..., 0].reshape(1, -1) > 0
+        _text_queries = (query_embeds, query_mask)
+    return _text_queries
+
+def _run_heads(owl_model, pixel_values, query_embeds, query_mask):
+    """Image tower + class/box heads against precomputed text queries."""
+    batch_size = pixel_values.shape[0]
+    feature_map = owl_model.image_embedder(pixel_values=pixel_values)[0]
+    _, h, w, d = feature_map.shape
+    image_feats = feature_map.reshape(batch_size, h * w, d)
+    logits, _ = owl_model.class_predictor(
+        image_feats,
+        query_embeds.expand(batch_size, -1, -1),
+        query_mask.expand(batch_size, -1),
+    )
+    pred_boxes = owl_model.box_predictor(image_feats, feature_map)
+    return logits, pred_boxes
+
+# -------------------------
+# Inference backends
+# -------------------------
+class TorchOwlBackend:
+    """Eager PyTorch, optionally with dynamic INT8 quantization of the Linear layers."""
+
+    def __init__(self, quantize_int8=False, num_threads=None):
+        ib.pin_threads(num_threads)
+        _, model = get_processor_and_model()
+        self.model = model
+        if quantize_int8:
+            self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
 
-    inputs = processor(text=text_labels, images=image, return_tensors="pt")
-    outputs = model(**inputs)
+    def forward(self, pixel_values):
+        with torch.no_grad():
+            return _run_heads(self.model, pixel_values, *get_text_queries())
 
-    target_sizes = torch.tensor([(image.height, image.width)])
+class _OwlImageHead(torch.nn.Module):
+    """OWLv2 with the text queries baked in as constants, for ONNX export."""
 
-    start_time = time.time()    
-    results = processor.post_process_grounded_object_detection(
-        outputs=outputs,
-        target_sizes=target_sizes,
-        threshold=threshold,
-        text_labels=text_labels,
+    def __init__(self, owl_model, query_embeds, query_mask):
+        super().__init__()
+        self.owl_model = owl_model
+        self.register_buffer("query_embeds", query_embeds)
+        self.register_buffer("query_mask", query_mask)
+
+    def forward(self, pixel_values):
+        return _run_heads(self.owl_model, pixel_values, self.query_embeds, self.query_mask)
+
+class OnnxOwlBackend:
+    """ONNX Runtime on CPU; the model is exported (and quantized) once and cached on disk."""
+
+    def __init__(self, quantize_int8=False, num_threads=None):
+        onnx_path = ib.export_path("owlv2_pen.onnx")
+        if not os.path.exists(onnx_path):
+            processor, model = get_processor_and_model()
+            size = processor.image_processor.size["height"]
+            dummy = torch.zeros(1, 3, size, size)
+            with torch.no_grad():
+                torch.onnx.export(
+                    _OwlImageHead(model, *get_text_queries()).eval(), (dummy,), onnx_path,
+                    input_names=["pixel_values"], output_names=["logits", "pred_boxes"],
+                    dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}, "pred_boxes": {0: "batch"}},
+                    opset_version=17,
+                )
+        if quantize_int8:
+            onnx_path = ib.quantize_onnx_int8(onnx_path, ib.export_path("owlv2_pen_int8.onnx"))
+        self.session = ib.create_onnx_session(onnx_path, num_threads)
+
+    def forward(self, pixel_values):
+        logits, pred_boxes = self.session.run(None, {"pixel_values": pixel_values.numpy()})
+        return torch.from_numpy(logits), torch.from_numpy(pred_boxes)
+
+def create_backend(name, num_threads=None):
+    if name == "torch":
+        return TorchOwlBackend(num_threads=num_threads)
+    if name == "torch-int8":
+        return TorchOwlBackend(quantize_int8=True, num_threads=num_threads)
+    if name == "onnx":
+        return OnnxOwlBackend(num_threads=num_threads)
+    if name == "onnx-int8":
+        return OnnxOwlBackend(quantize_int8=True, num_threads=num_threads)
+    raise ValueError(f"Unknown OWLv2 backend: {name} (expected one of {ib.BACKEND_NAMES})")
+
+# Selected backend, created on first use (see get_backend)
+BACKEND = None
+_backend_config = ("torch", None)
+_backend_lock = threading.Lock()
+
+def set_backend(name, num_threads=None):
+    """Select the inference backend used by detect_pens/detect_pens_batch."""
+    global BACKEND, _backend_config
+    if name not in ib.BACKEND_NAMES:
+        raise ValueError(f"Unknown OWLv2 backend: {name} (expected one of {ib.BACKEND_NAMES})")
+    with _backend_lock:
+        _backend_config = (name, num_threads)
+        BACKEND = None
+
+def get_backend():
+    global BACKEND
+    with _backend_lock:
+        if BACKEND is None:
+            BACKEND = create_backend(*_backend_config)
+        return BACKEND
+
+def check_backend_parity(name, image_paths, iou_threshold=0.5, num_threads=None):
+    """Compare pen boxes of backend `name` against eager PyTorch on fixture images."""
+    reference, candidate = TorchOwlBackend(num_threads=num_threads), create_backend(name, num_threads)
+    return ib.parity_check(
+        lambda path: detect_pens_batch([path], backend=reference)[0].boxes,
+        lambda path: detect_pens_batch([path], backend=candidate)[0].boxes,
+        image_paths, iou_threshold,
     )
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f"Owlv2 process time taken: {elapsed_time:.4f} seconds")
 
-    result = results[0]
-    boxes, scores, predicted_labels = result["boxes"], result["scores"], result["text_labels"]
+def detect_pens_batch(images, threshold=0.3, backend=None):
+    """
+    Run Owlv2 object detection on several images in one forward pass.
+
+    Args:
+        images (list): Frames, BGR numpy arrays, PIL images or paths.
+        threshold (float): Score threshold.
+        backend: Inference backend to use instead of the selected BACKEND.
+
+    Returns:
+        list[PenDetection]: One detection per image (boxes in pixels of the image).
+    """
+    images = [load_pil(image) for image in images]
+
+    processor, _ = get_processor_and_model()
+    with tracing.span("owl_preprocess", batch=len(images)):
+        pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+    with tracing.span("owl_forward", batch=len(images)):
+        logits, pred_boxes = (backend or get_backend()).forward(pixel_values)
+    outputs = Owlv2ObjectDetectionOutput(logits=logits, pred_boxes=pred_boxes)
+
+    target_sizes = torch.tensor([(image.height, image.width) for image in images])
+
+    with tracing.span("owl_postprocess", batch=len(images)):
+        results = processor.post_process_grounded_object_detection(
+            outputs=outputs,
+            target_sizes=target_sizes,
+            threshold=threshold,
+            text_labels=text_labels * len(images),
+        )
+
+    detections = []
+    for image, result in zip(images, results):
+        detections.append(PenDetection(
+            boxes=[[round(i, 2) for i in box.tolist()] for box in result["boxes"]],
+            scores=[score.item() for score in result["scores"]],
+            labels=list(result["text_labels"]),
+            size=image.size,
+        ))
+    return detections
+
+def count_pens(detection):
+    return detection.count("a pen")
+
+def scale_detection(detection, size):
+    """Copy of `detection` with its boxes mapped to an image of `size` (width, height), e.g. a full-res frame."""
+    return detection.scaled(size)
+
+def draw_detection(image, detection):
+    """Copy of the image (anything load_pil accepts) with the pen boxes drawn on it."""
+    image = load_pil(image).copy()  # the decoded frame is shared with later stages
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    for box, score, label in zip(detection.boxes, detection.scores, detection.labels):
+        draw.rectangle(box, outline="red", width=20)
+        draw.text((box[0], box[1]), f"{label} ({round(score, 2)})", fill="red", font=font)
+    return image
+
+def yolo_labels(detection):
+    """The detection as YOLO label lines (class x_center y_center w h, normalized)."""
+    width, height = detection.size
+    yolo_lines = []
+    for (x_min, y_min, x_max, y_max), label in zip(detection.boxes, detection.labels):
+        x_center = (x_min + x_max) / 2 / width
+        y_center = (y_min + y_max) / 2 / height
+        w = (x_max - x_min) / width
+        h = (y_max - y_min) / height
+        class_id = label_to_id.get(label, 0)
+        yolo_lines.append(f"{class_id} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}")
+    return "\n".join(yolo_lines)
+
+def save_detection(image, detection, save_img_path=None, save_label_path=None):
+    """
+    Draw the boxes of `detection` on the image and/or write them as a YOLO label file.
+
+    This runs synchronously; the server hands the same work to its DebugWriter instead.
+    """
+    if save_img_path:
+        draw_detection(image, detection).save(save_img_path)
+    if save_label_path:
+        with open(save_label_path, "w") as f:
+            f.write(yolo_labels(detection))
+
+def detect_pens(image, save_img_path=None, save_label_path=None, threshold=0.3):
+    """
+    Run Owlv2 object detection on the image.
+
+    Args:
+        image: Frame, BGR numpy array, PIL image or path to the input image.
+
+    Returns:
+        pen_count (int): number of pens detected above threshold
+    """
+    detection = detect_pens_batch([image], threshold=threshold)[0]
 
     # Draw image if needed
     if save_img_path is not None or save_label_path is not None:
-        draw = ImageDraw.Draw(image)
-        font = ImageFont.load_default()
-        yolo_lines = []
-
-        for box, score, label in zip(boxes, scores, predicted_labels):
-            box = [round(i, 2) for i in box.tolist()]
-            x_min, y_min, x_max, y_max = box
-            x_center = (x_min + x_max) / 2 / width
-            y_center = (y_min + y_max) / 2 / height
-            w = (x_max - x_min) / width
-            h = (y_max - y_min) / height
-
-            class_id = label_to_id.get(label, 0)
-            yolo_lines.append(f"{class_id} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}")
-
-            draw.rectangle(box, outline="red", width=20)
-            draw.text((x_min, y_min), f"{label} ({round(score.item(),2)})", fill="red", font=font)
-
-        if save_img_path:
-            image.save(save_img_path)
-        if save_label_path:
-            with open(save_label_path, "w") as f:
-                f.write("\n".join(yolo_lines))
-
-    pen_count = sum([1 for label in predicted_labels if label == "a pen"])
-    return pen_count
+        save_detection(image, detection, save_img_path, save_label_path)
+
+    return count_pens(detection)
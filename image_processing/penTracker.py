@@ -0,0 +1,176 @@
+import threading
+import cv2
+import numpy as np
+from imageFrame import load_bgr
+
+
+class PenTracker:
+    """
+    Pen detection on keyframes, optical-flow tracking in between.
+
+    A full detection (`detect_fn`, e.g. OWLv2) runs on a keyframe: the first
+    frame, every `keyframe_interval` frames, and whenever tracking confidence
+    drops. On the frames in between, corner features inside each pen box are
+    followed with pyramidal Lucas-Kanade flow on a small grayscale copy of the
+    frame, checked forward-backward, and each box is moved by the median shift
+    of its surviving features.
+
+    `run` returns a PenDetection like `detect_pens_batch`, with `tracked`
+    (False on keyframes) and `confidence` filled in.
+
+    Args:
+        keyframe_interval (int): Frames between forced detections.
+        min_confidence (float): Minimum fraction of a box's features that must
+            survive the flow step; below it the frame becomes a keyframe.
+        min_points (int): Minimum surviving features per box.
+        track_width (int): Width of the grayscale copy used for tracking.
+        max_fb_error (float): Forward-backward error (pixels at track_width)
+            above which a feature is discarded.
+    """
+
+    def __init__(self, keyframe_interval: int = 15, min_confidence: float = 0.6, min_points: int = 6,
+                 track_width: int = 480, max_fb_error: float = 1.0):
+        self.keyframe_interval = keyframe_interval
+        self.min_confidence = min_confidence
+        self.min_points = min_points
+        self.track_width = track_width
+        self.max_fb_error = max_fb_error
+        self.keyframes = 0
+        self.tracked = 0
+        self.fallbacks = 0  # keyframes forced by low tracking confidence
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the tracked pens; the next frame is a keyframe."""
+        self._detection = None
+        self._prev_gray = None
+        self._boxes = []
+        self._points = []
+        self._since_keyframe = 0
+        self._last_frame_id = None
+
+    def _gray(self, image):
+        bgr = load_bgr(image)
+        scale = min(1.0, self.track_width / bgr.shape[1])
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    def _features(self, gray, box):
+        h, w = gray.shape
+        x1, y1, x2, y2 = np.clip(np.round(box), 0, [w, h, w, h]).astype(int)
+        mask = np.zeros_like(gray)
+        mask[y1:y2, x1:x2] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=40, qualityLevel=0.01, minDistance=3, mask=mask)
+
+    def _store_keyframe(self, detection, gray, scale):
+        self._detection = detection
+        self._prev_gray = gray
+        self._boxes = [np.asarray(box, dtype=np.float64) * scale for box in detection.boxes]
+        self._points = [self._features(gray, box) for box in self._boxes]
+        self._since_keyframe = 0
+
+    def _track(self, gray):
+        """New (boxes, points, confidence), or None if any pen was lost."""
+        boxes, points, confidence = [], [], 1.0
+        for box, pts in zip(self._boxes, self._points):
+            if pts is None or len(pts) < self.min_points:
+                return None
+            nxt, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, pts, None, winSize=(21, 21), maxLevel=3)
+            back, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, nxt, None, winSize=(21, 21), maxLevel=3)
+            fb_error = np.linalg.norm((pts - back).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (status_back.ravel() == 1) & (fb_error < self.max_fb_error)
+            confidence = min(confidence, float(good.mean()))
+            if good.sum() < self.min_points or confidence < self.min_confidence:
+                return None
+            shift = np.median((nxt - pts).reshape(-1, 2)[good], axis=0)
+            boxes.append(box + np.tile(shift, 2))
+            points.append(nxt[good].reshape(-1, 1, 2))
+        return boxes, points, confidence
+
+    def run(self, image, detect_fn):
+        """Return the pen detection for this frame, tracked or freshly detected."""
+        # Pen workers may finish out of order; an older frame must not rewind the tracker
+        frame_id = getattr(image, "frame_id", None)
+        gray, scale = self._gray(image)
+        with self._lock:
+            stale = frame_id is not None and self._last_frame_id is not None and frame_id < self._last_frame_id
+            if stale:
+                return self._detection._replace(tracked=True, confidence=0.0)
+            if self._detection is not None and self._since_keyframe < self.keyframe_interval:
+                result = self._track(gray)
+                if result is not None:
+                    self._boxes, self._points, confidence = result
+                    self._prev_gray = gray
+                    self._since_keyframe += 1
+                    self._last_frame_id = frame_id
+                    self.tracked += 1
+                    width, height = self._detection.size
+                    boxes = [[round(float(v), 2) for v in np.clip(box / scale, 0, [width, height, width, height])]
+                             for box in self._boxes]
+                    return self._detection._replace(boxes=boxes, tracked=True, confidence=confidence)
+                self.fallbacks += 1
+
+        # Keyframe: the (micro-batched) detection runs without the lock, so the
+        # session's other pen workers can join the same batch
+        detection = detect_fn(image)
+        with self._lock:
+            self.keyframes += 1
+            # A newer frame may have become the keyframe meanwhile; keep its state
+            if frame_id is None or self._last_frame_id is None or frame_id >= self._last_frame_id:
+                self._store_keyframe(detection, gray, scale)
+                self._last_frame_id = frame_id
+        return detection._replace(tracked=False, confidence=1.0)
+
+    def stats(self) -> dict:
+        total = self.keyframes + self.tracked
+        return {
+            "keyframes": self.keyframes,
+            "tracked": self.tracked,
+            "fallbacks": self.fallbacks,
+            "keyframe_rate": self.keyframes / total if total else 0.0,
+        }
+
+
+class TwoPenTrigger:
+    """
+    Hysteresis on the "exactly two pens" condition, so PAUSE does not flicker.
+
+    The trigger fires once when two pens have been seen on `on_frames`
+    consecutive frames, and re-arms only after `off_frames` consecutive frames
+    without exactly two pens (or after `reset`).
+    """
+
+    def __init__(self, on_frames: int = 3, off_frames: int = 5):
+        self.on_frames = on_frames
+        self.off_frames = off_frames
+        self.locked = False
+        self._on_count = 0
+        self._off_count = 0
+        self._lock = threading.Lock()
+
+    def update(self, pen_count: int) -> bool:
+        """Feed one frame's pen count; returns True when the trigger fires."""
+        with self._lock:
+            if pen_count == 2:
+                self._on_count += 1
+                self._off_count = 0
+            else:
+                self._off_count += 1
+                self._on_count = 0
+            if self.locked:
+                if self._off_count >= self.off_frames:
+                    self.locked = False
+                return False
+            if self._on_count >= self.on_frames:
+                self.locked = True
+                return True
+            return False
+
+    def reset(self):
+        with self._lock:
+            self.locked = False
+            self._on_count = 0
+            self._off_count = 0
@@ -0,0 +1,89 @@
+import threading
+import cv2
+import numpy as np
+from imageFrame import Frame, load_bgr
+
+
+class SceneChangeGate:
+    """
+    Cheap pre-filter in front of pen detection.
+
+    Each frame is reduced to a small grayscale thumbnail and compared with the
+    thumbnail of the last frame that was actually processed. If the fraction of
+    thumbnail pixels that changed by more than `pixel_threshold` stays below
+    `change_threshold`, the previous detection result is reused instead of
+    running the detector again.
+
+    Args:
+        change_threshold (float): Fraction of changed thumbnail pixels above
+            which the scene counts as changed.
+        pixel_threshold (int): Per-pixel gray-level difference (0-255) that
+            counts as a change; absorbs sensor noise and JPEG artifacts.
+        thumb_size (tuple): Thumbnail (width, height).
+        max_reuse (int): Force a fresh detection after this many skipped
+            frames in a row, so a slow drift can never go unnoticed.
+    """
+
+    def __init__(self, change_threshold: float = 0.01, pixel_threshold: int = 25,
+                 thumb_size=(64, 64), max_reuse: int = 30):
+        self.change_threshold = change_threshold
+        self.pixel_threshold = pixel_threshold
+        self.thumb_size = thumb_size
+        self.max_reuse = max_reuse
+        self.skipped = 0
+        self.processed = 0
+        self._last_thumb = None
+        self._last_result = None
+        self._reused = 0
+        self._lock = threading.Lock()
+
+    def _thumbnail(self, image) -> np.ndarray:
+        if isinstance(image, Frame):
+            return image.thumbnail(self.thumb_size)
+        gray = cv2.cvtColor(load_bgr(image), cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, self.thumb_size, interpolation=cv2.INTER_AREA)
+
+    def change_score(self, thumb: np.ndarray) -> float:
+        """Fraction of thumbnail pixels that differ from the last processed frame."""
+        if self._last_thumb is None:
+            return 1.0
+        diff = np.abs(thumb.astype(np.int16) - self._last_thumb.astype(np.int16))
+        return float(np.mean(diff > self.pixel_threshold))
+
+    def run(self, image, detect_fn):
+        """
+        Return `detect_fn(image)`, or the previous result if the scene is unchanged.
+        """
+        thumb = self._thumbnail(image)
+        with self._lock:
+            unchanged = (self._last_result is not None
+                         and self._reused < self.max_reuse
+                         and self.change_score(thumb) < self.change_threshold)
+            if unchanged:
+                self._reused += 1
+                self.skipped += 1
+                return self._last_result
+
+        result = detect_fn(image)
+
+        with self._lock:
+            self._last_thumb = thumb
+            self._last_result = result
+            self._reused = 0
+            self.processed += 1
+        return result
+
+    def reset(self):
+        """Forget the last frame, e.g. after the client resumes."""
+        with self._lock:
+            self._last_thumb = None
+            self._last_result = None
+            self._reused = 0
+
+    def stats(self) -> dict:
+        total = self.skipped + self.processed
+        return {
+            "skipped": self.skipped,
+            "processed": self.processed,
+            "skip_rate": self.skipped / total if total else 0.0,
+        }
@@ -0,0 +1,203 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from imageFrame import Frame, load_bgr
+from layoutCache import PageFingerprint
+
+
+def _thumbnail(image, size=(32, 32)) -> np.ndarray:
+    if isinstance(image, Frame):
+        return image.thumbnail(size)
+    gray = cv2.cvtColor(load_bgr(image), cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+def _changed_fraction(a, b, pixel_threshold=25) -> float:
+    """Fraction of thumbnail pixels that differ by more than `pixel_threshold` gray levels."""
+    if a is None or b is None:
+        return 1.0
+    return float(np.mean(np.abs(a.astype(np.int16) - b.astype(np.int16)) > pixel_threshold))
+
+
+class Speculation:
+    """One speculative DocLayout run for a session's page."""
+
+    def __init__(self, frame, thumb):
+        self.frame = frame
+        self.thumb = thumb
+        self.future = None
+        self.seconds = None
+
+
+class SpeculativeLayout:
+    """
+    Runs DocLayout on a page before the two-pen trigger fires.
+
+    Layout depends only on the page, so it can start while the user is still
+    pointing: as soon as one pen is seen, or when the page has been still for
+    `stable_frames` frames. When the trigger fires, `commit` hands back the
+    speculative result (re-projected through the layout cache if the
+    triggering frame is a later view of the same page), waiting for a run that
+    is still in flight instead of starting a second one. A speculation is
+    cancelled (or its result discarded) when the page changes or when the
+    session resumes; while one is kept, the session starts no other.
+
+    Speculative runs share `workers` threads and may use at most
+    `cpu_budget` of their wall time over the last `budget_window` seconds,
+    counting the time runs still in progress have used so far; beyond that,
+    no new speculation starts until older runs age out. No run is ever
+    queued: while all workers are busy, new speculations are skipped.
+
+    Per-session state lives in the objects returned by `for_session`.
+
+    Args:
+        predict_fn: Callable(image) -> list[LayoutDetection].
+        layout_cache (LayoutCache): Results are stored here, and later frames
+            of the same page are matched against them.
+        workers (int): Threads for speculative runs.
+        cpu_budget (float): Fraction (0-1) of the workers' time speculation may use.
+        budget_window (float): Seconds over which the budget is measured.
+        stable_frames (int): Still frames before speculating without a pen.
+        page_change (float): Fraction of changed thumbnail pixels (relative to
+            the speculated frame) at which the page counts as replaced.
+        commit_timeout (float): Seconds `commit` waits for an in-flight run.
+    """
+
+    def __init__(self, predict_fn, layout_cache, workers: int = 1, cpu_budget: float = 0.5,
+                 budget_window: float = 30.0, stable_frames: int = 5, page_change: float = 0.3,
+                 commit_timeout: float = 10.0):
+        self.predict_fn = predict_fn
+        self.layout_cache = layout_cache
+        self.workers = workers
+        self.cpu_budget = cpu_budget
+        self.budget_window = budget_window
+        self.stable_frames = stable_frames
+        self.page_change = page_change
+        self.commit_timeout = commit_timeout
+        self.counts = collections.Counter()
+        self.saved_seconds = 0.0
+        self._runs = collections.deque()  # (finished_at, seconds) within the budget window
+        self._active = {}  # submitted Speculation -> time its run started (None until then)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+
+    def for_session(self) -> "SessionSpeculation":
+        return SessionSpeculation(self)
+
+    def _spent(self, now) -> float:
+        while self._runs and self._runs[0][0] < now - self.budget_window:
+            self._runs.popleft()
+        running = sum(now - started for started in self._active.values() if started is not None)
+        return sum(seconds for _, seconds in self._runs) + running
+
+    def _start(self, spec) -> bool:
+        with self._lock:
+            if len(self._active) >= self.workers:
+                self.counts["busy_skips"] += 1
+                return False
+            if self._spent(time.monotonic()) >= self.cpu_budget * self.workers * self.budget_window:
+                self.counts["budget_skips"] += 1
+                return False
+            self.counts["started"] += 1
+            self._active[spec] = None
+        spec.future = self._executor.submit(self._run, spec)
+        return True
+
+    def _run(self, spec):
+        with self._lock:
+            self._active[spec] = time.monotonic()
+        t0 = time.perf_counter()
+        try:
+            detections = self.predict_fn(spec.frame)
+            self.layout_cache.store(PageFingerprint(spec.frame), detections)
+            return detections
+        finally:
+            spec.seconds = time.perf_counter() - t0
+            with self._lock:
+                self._active.pop(spec, None)
+                self._runs.append((time.monotonic(), spec.seconds))
+
+    def _drop(self, spec):
+        """Cancel a speculation that will not be committed (or count its work as wasted)."""
+        if spec.future is None:
+            return
+        with self._lock:
+            if spec.future.cancel():
+                self._active.pop(spec, None)
+                self.counts["cancelled"] += 1
+            else:
+                self.counts["discarded"] += 1
+
+    def _commit(self, spec, image):
+        if spec is None or spec.future is None:
+            with self._lock:
+                self.counts["misses"] += 1
+            return None
+        try:
+            detections = spec.future.result(timeout=self.commit_timeout)
+        except Exception as e:
+            print(f"[Speculation] Layout run unusable: {e}")
+            with self._lock:
+                self.counts["misses"] += 1
+            return None
+        if image is not spec.frame:
+            # A later view of the page: map the speculative boxes onto it
+            detections = self.layout_cache.lookup(PageFingerprint(image))
+        with self._lock:
+            if detections is None:
+                self.counts["misses"] += 1
+            else:
+                self.counts["hits"] += 1
+                self.saved_seconds += spec.seconds or 0.0
+        return detections
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.counts["hits"], self.counts["misses"]
+            return dict(self.counts,
+                        hit_rate=hits / (hits + misses) if hits + misses else 0.0,
+                        saved_seconds=round(self.saved_seconds, 3),
+                        budget_used=self._spent(time.monotonic()) / (self.workers * self.budget_window))
+
+
+class SessionSpeculation:
+    """One session's speculation state (see SpeculativeLayout)."""
+
+    def __init__(self, owner: SpeculativeLayout):
+        self.owner = owner
+        self._last_thumb = None
+        self._still = 0
+        self._spec = None
+        self._lock = threading.Lock()
+
+    def observe(self, image, pen_count: int):
+        """Feed a frame that did not fire the trigger; may start or drop a speculation."""
+        thumb = _thumbnail(image)
+        with self._lock:
+            self._still = self._still + 1 if _changed_fraction(thumb, self._last_thumb) < 0.01 else 0
+            self._last_thumb = thumb
+            if self._spec is not None and _changed_fraction(thumb, self._spec.thumb) >= self.owner.page_change:
+                self.owner._drop(self._spec)
+                self._spec = None
+            if self._spec is not None or not (pen_count >= 1 or self._still >= self.owner.stable_frames):
+                return
+            spec = Speculation(image, thumb)
+            if self.owner._start(spec):
+                self._spec = spec
+
+    def commit(self, image):
+        """Layout for the triggering frame from the speculation, or None to run it normally."""
+        with self._lock:
+            spec, self._spec = self._spec, None
+        return self.owner._commit(spec, image)
+
+    def reset(self):
+        with self._lock:
+            if self._spec is not None:
+                self.owner._drop(self._spec)
+            self._spec = None
+            self._last_thumb = None
+            self._still = 0
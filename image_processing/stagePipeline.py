@@ -0,0 +1,180 @@
+import collections
+import threading
+import tracing
+
+# Drop policies for a full stage queue
+DROP_OLDEST = "drop_oldest"  # keep the newest items, discard the stale ones
+BLOCK = "block"              # block the producer until there is room
+
+
+class StageQueue:
+    """
+    Bounded FIFO between two stages.
+
+    With DROP_OLDEST a put on a full queue evicts the oldest item, so a slow
+    stage always works on the most recent frame. With BLOCK the producer waits,
+    which propagates backpressure upstream.
+    """
+
+    def __init__(self, maxsize: int = 1, drop_policy: str = DROP_OLDEST):
+        if drop_policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, item) -> bool:
+        """Add an item; returns True if the queue was full (dropped or waited)."""
+        with self._cond:
+            was_full = len(self._items) >= self.maxsize
+            if self.drop_policy == BLOCK:
+                while len(self._items) >= self.maxsize:
+                    self._cond.wait()
+            elif was_full:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify_all()
+            return was_full
+
+    def get(self):
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+
+class Jump:
+    """Stage result that hands `item` to the stage named `stage` instead of the next one."""
+
+    def __init__(self, stage: str, item):
+        self.stage = stage
+        self.item = item
+
+
+class Stage:
+    """
+    One step of the pipeline: a pool of worker threads applying `fn`.
+
+    `fn(item)` returns the item to hand to the next stage, a Jump to skip
+    ahead to a later stage, or None to stop processing it (e.g. fewer than two
+    pens were detected).
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1, maxsize: int = 1,
+                 drop_policy: str = DROP_OLDEST, queue=None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue if queue is not None else StageQueue(maxsize, drop_policy)
+        self.processed = 0
+        self.failed = 0
+        self.congested = False  # set when a put found the queue full, cleared once a worker idles
+
+
+class Pipeline:
+    """
+    Stage-graph executor: stages run concurrently, connected by bounded queues,
+    so pen detection on frame N+1 overlaps with OCR/LLM for frame N.
+
+    Args:
+        stages (list[Stage]): Stages in execution order.
+        on_backpressure (callable): Called with True when a stage starts
+            dropping or blocking and with False once every stage keeps up again.
+        trace_of (callable): item -> tracing.Trace (or None). Each stage call
+            is recorded as a span named after the stage, and the trace is
+            finished when the item leaves the pipeline.
+        on_done (callable): Called with each item once it leaves the
+            pipeline (last stage done, stopped early or failed), e.g. to free
+            resources the item holds.
+    """
+
+    def __init__(self, stages, on_backpressure=None, trace_of=None, on_done=None):
+        self.stages = stages
+        self.on_backpressure = on_backpressure
+        self.trace_of = trace_of
+        self.on_done = on_done
+        self.backpressured = False
+        self._bp_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._run_stage, args=(stage, next_stage),
+                                     name=f"{stage.name}-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def submit(self, item, stage: str = None):
+        """Feed an item into the first stage, or into the stage named `stage`."""
+        self._put(self.stages[0] if stage is None else self._stage(stage), item)
+
+    def _stage(self, name):
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def _put(self, stage, item):
+        if stage.queue.put(item):
+            stage.congested = True
+            self._update_backpressure()
+
+    def _run_stage(self, stage, next_stage):
+        while True:
+            # Idle worker and nothing waiting: the stage is keeping up again
+            if stage.congested and stage.queue.qsize() == 0:
+                stage.congested = False
+                self._update_backpressure()
+            item = stage.queue.get()
+            trace = self.trace_of(item) if self.trace_of is not None else None
+            try:
+                with tracing.use_trace(trace), tracing.span(stage.name):
+                    result = stage.fn(item)
+                stage.processed += 1
+            except Exception as e:
+                stage.failed += 1
+                print(f"[Pipeline] Error in stage '{stage.name}': {e}")
+                self._finish(item, trace)
+                continue
+            if isinstance(result, Jump):
+                self._put(self._stage(result.stage), result.item)
+            elif result is not None and next_stage is not None:
+                self._put(next_stage, result)
+            else:
+                self._finish(item, trace)
+
+    def _finish(self, item, trace):
+        tracing.finish_trace(trace)
+        if self.on_done is not None:
+            try:
+                self.on_done(item)
+            except Exception as e:
+                print(f"[Pipeline] Error in on_done: {e}")
+
+    def queue_depths(self) -> dict:
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def stats(self) -> dict:
+        return {stage.name: {"queued": stage.queue.qsize(),
+                             "dropped": getattr(stage.queue, "dropped", 0),
+                             "processed": stage.processed,
+                             "failed": stage.failed}
+                for stage in self.stages}
+
+    def _update_backpressure(self):
+        with self._bp_lock:
+            congested = any(stage.congested for stage in self.stages)
+            if congested == self.backpressured:
+                return
+            self.backpressured = congested
+        if self.on_backpressure is not None:
+            self.on_backpressure(congested)
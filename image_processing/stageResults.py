@@ -0,0 +1,65 @@
+from typing import List, NamedTuple, Tuple
+
+# Results handed from stage to stage in memory. They are plain tuples, so they
+# pickle cheaply to the model worker processes (see frameRing.py) and cannot be
+# changed by a later stage that still shares them with a cache.
+
+
+class PenDetection(NamedTuple):
+    """OWLv2 result for one image; boxes are [x1, y1, x2, y2] in pixels of `size` (width, height)."""
+
+    boxes: List[List[float]]
+    scores: List[float]
+    labels: List[str]
+    size: Tuple[int, int]
+    tracked: bool = False     # boxes moved by optical flow instead of a fresh detection
+    confidence: float = 1.0   # tracking confidence (1.0 on detected frames)
+
+    def count(self, label: str = "a pen") -> int:
+        return sum(1 for other in self.labels if other == label)
+
+    def scaled(self, size) -> "PenDetection":
+        """Same detection with its boxes mapped to an image of `size`, e.g. a full-res frame."""
+        width, height = self.size
+        sx, sy = size[0] / width, size[1] / height
+        boxes = [[round(x1 * sx, 2), round(y1 * sy, 2), round(x2 * sx, 2), round(y2 * sy, 2)]
+                 for x1, y1, x2, y2 in self.boxes]
+        return self._replace(boxes=boxes, size=tuple(size))
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+class LayoutDetection(NamedTuple):
+    """One DocLayout block; bbox is [x1, y1, x2, y2] in pixels of the full image."""
+
+    label: str
+    confidence: float
+    bbox: List[float]
+
+    def translated(self, dx: float, dy: float) -> "LayoutDetection":
+        x1, y1, x2, y2 = self.bbox
+        return self._replace(bbox=[x1 + dx, y1 + dy, x2 + dx, y2 + dy])
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+class FilteredRegions(NamedTuple):
+    """DocLayout blocks kept between the two pen tips, with the geometry used to pick them."""
+
+    pens: List[List[float]]
+    pen_tip_line: Tuple[Tuple[float, float], Tuple[float, float]]
+    pen_tip_rectangle: List[float]
+    regions: List[LayoutDetection]
+    all_regions: List[LayoutDetection]
+
+    def to_dict(self) -> dict:
+        """Plain dict for JSON dumps (filtered_text_between_pens.json)."""
+        return {
+            "pens": self.pens,
+            "pen_tip_line": list(self.pen_tip_line),
+            "pen_tip_rectangle": self.pen_tip_rectangle,
+            "filtered_doclayout": [det.to_dict() for det in self.regions],
+            "all_doclayout": [det.to_dict() for det in self.all_regions],
+        }
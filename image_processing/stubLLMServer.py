@@ -0,0 +1,88 @@
+import argparse
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Gemini API, so the answer path (including streaming)
+# can be exercised without an API key or network access.
+#
+# POST / with {"prompt": "...", "stream": true|false}
+#   stream=false -> {"text": "<answer>"}
+#   stream=true  -> one JSON object per line: {"text": "<chunk>"}
+# An optional "image" (base64 JPEG) stands in for a multimodal request.
+
+
+def default_answer(prompt: str, image: bytes = None) -> str:
+    if image is not None:
+        return f"Stub answer for a prompt of {len(prompt)} characters and an image of {len(image)} bytes."
+    return f"Stub answer for a prompt of {len(prompt)} characters."
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if body.get("image"):
+            answer = self.server.answer_fn(body.get("prompt", ""), base64.b64decode(body["image"]))
+        else:
+            answer = self.server.answer_fn(body.get("prompt", ""))
+        time.sleep(self.server.first_token_delay)
+
+        self.send_response(200)
+        if not body.get("stream"):
+            payload = json.dumps({"text": answer}).encode("utf-8")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            chunk = word if i == len(words) - 1 else word + " "
+            self.wfile.write((json.dumps({"text": chunk}) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.chunk_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host="127.0.0.1", port=8765, answer_fn=None, chunk_delay=0.05, first_token_delay=0.2):
+    """
+    Start the stub LLM server on a background thread.
+
+    Args:
+        answer_fn (callable): prompt -> answer text, called as (prompt, image
+            bytes) for multimodal requests (default: a fixed stub answer).
+        chunk_delay (float): Seconds between streamed chunks.
+        first_token_delay (float): Seconds before the first byte is sent.
+
+    Returns:
+        ThreadingHTTPServer: Call `shutdown()` to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.answer_fn = answer_fn or default_answer
+    server.chunk_delay = chunk_delay
+    server.first_token_delay = first_token_delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub LLM server for testing the answer path.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.host, args.port, chunk_delay=args.chunk_delay)
+    print(f"Stub LLM server running on http://{args.host}:{args.port}/ (set LLM_STUB_URL to use it)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,11 +1,13 @@
+import os
 import sys
 sys.path.append(rf"C:\Users\88690\Desktop\Dissertation\image_processing")
 import cv2
-import pytesseract
-import jiwer
 from PIL import Image
-import json
-from test_callGemini import ask_model 
+from test_callGemini import ask_model, ask_model_stream, current_model_name
+from ocrEngine import OcrEngine, OcrPreprocess
+from ocrCache import OcrCache
+from ocrMetrics import text_error_rates
+from answerCache import AnswerCache
 
 def evaluate_ocr_text(ground_truth_path, ocr_text):
     with open(ground_truth_path, "r", encoding="utf-8") as f:
@@ -13,54 +15,79 @@ def evaluate_ocr_text(ground_truth_path, ocr_text):
     
     print("\nGround truth text:\n", ground_truth)
 
-    word_error = jiwer.wer(ground_truth, ocr_text)
-    char_error = jiwer.cer(ground_truth, ocr_text)
+    return text_error_rates(ground_truth, ocr_text)
+# Configure Tesseract (tesserocr reads the language files of the tesseract.exe install)
+TESSDATA_PATH = rf"C:\Program Files\Tesseract-OCR\tessdata"
 
-    return {
-        "wer": word_error,
-        "wer_accuracy": 1 - word_error,
-        "cer": char_error,
-        "cer_accuracy": 1 - char_error
-    }
-# Configure Tesseract
-pytesseract.pytesseract.tesseract_cmd = rf"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# Persistent OCR workers shared by all calls (see ocrEngine.py)
+# Regions already read (the same paragraph on a repeat pointing) skip Tesseract, also across restarts
+OCR_CACHE = OcrCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_cache.sqlite3"))
+OCR_ENGINE = OcrEngine(workers=4, lang="eng", preprocess=OcrPreprocess(),
+                       tessdata_path=TESSDATA_PATH if os.path.isdir(TESSDATA_PATH) else None, cache=OCR_CACHE)
 
-def process_image_and_query(image_path, image_json_path, prompt="give me answer to the question", ground_truth_path = None):
-    # Load JSON with filtered bounding boxes
-    with open(image_json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+def ocr_regions(image, detections, engine=None):
+    """
+    OCR the given DocLayout detections of an image, top to bottom.
 
-    # Load original image
-    image = cv2.imread(image_path)
+    Regions are recognised in parallel by the persistent OCR workers.
 
-    # Sort bounding boxes by top y-coordinate
-    sorted_boxes = sorted(data["filtered_doclayout"], key=lambda d: d["bbox"][1])
+    Args:
+        image: Frame, BGR numpy array, PIL image or path to the original image.
+        detections (list[LayoutDetection]): DocLayout blocks to read.
+        engine (OcrEngine): Engine to use instead of OCR_ENGINE.
 
-    extracted_texts = []
+    Returns:
+        str: Recognised text of all regions, one region per line block.
+    """
+    return (engine or OCR_ENGINE).ocr_regions(image, detections)
 
-    for i, det in enumerate(sorted_boxes):
-        x1, y1, x2, y2 = map(int, det["bbox"])
-        roi = image[y1:y2, x1:x2]
+def build_prompt(combined_text, prompt="give me answer to the question"):
+    # Prepare prompt for GenAI
+    return f"{prompt}\n\nContext:\n{combined_text}"
 
-        roi_rgb = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
-        text = pytesseract.image_to_string(roi_rgb, lang="eng").strip()
-        if text:
-            extracted_texts.append(text)
+# Answers for questions already asked (same or near-identical OCR text) skip the LLM call;
+# ANSWER_NEAR_MATCH=0 only reuses answers for exactly the same text
+ANSWER_NEAR_MATCH = os.environ.get("ANSWER_NEAR_MATCH", "1") == "1"
+ANSWER_CACHE = AnswerCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_cache.sqlite3"),
+                           near_match=ANSWER_NEAR_MATCH)
 
-    # Combine all OCR text
-    combined_text = "\n".join(extracted_texts)
+def query_model(combined_text, prompt="give me answer to the question"):
+    cached = ANSWER_CACHE.get(current_model_name(), prompt, combined_text)
+    if cached is not None:
+        print("Answer cache hit, skipping the LLM call")
+        return cached
 
-    print(f"\nThis is text recognized by OCR:\n{combined_text}")
+    # Call the imported function
+    answer = ask_model(build_prompt(combined_text, prompt))
+    if answer:
+        ANSWER_CACHE.put(current_model_name(), prompt, combined_text, answer)
+    return answer
 
-    # Evaluate OCR accuracy
-    ocr_results = evaluate_ocr_text(ground_truth_path, combined_text)
-    print(f"\nWER: {ocr_results['wer']:.2f}, WER Accuracy: {ocr_results['wer_accuracy']:.2f}")
-    print(f"CER: {ocr_results['cer']:.2f}, CER Accuracy: {ocr_results['cer_accuracy']:.2f}")
+def query_model_stream(combined_text, prompt="give me answer to the question"):
+    """Like query_model, but yields the answer in chunks as they are generated."""
+    cached = ANSWER_CACHE.get(current_model_name(), prompt, combined_text)
+    if cached is not None:
+        print("Answer cache hit, skipping the LLM call")
+        yield cached
+        return
 
-    # Prepare prompt for GenAI
-    full_prompt = f"{prompt}\n\nContext:\n{combined_text}"
+    chunks = []
+    for chunk in ask_model_stream(build_prompt(combined_text, prompt)):
+        chunks.append(chunk)
+        yield chunk
+    if chunks:
+        ANSWER_CACHE.put(current_model_name(), prompt, combined_text, "".join(chunks))
 
-    # Call the imported function
-    answer = ask_model(full_prompt)
-    return answer
+def process_image_and_query(image, filtered, prompt="give me answer to the question", ground_truth_path = None):
+    # Blocks kept between the pens (FilteredRegions from process_doclayout_with_pens)
+    combined_text = ocr_regions(image, filtered.regions)
+
+    print(f"\nThis is text recognized by OCR:\n{combined_text}")
+
+    # Evaluate OCR accuracy (only possible with a ground truth file)
+    if ground_truth_path is not None:
+        ocr_results = evaluate_ocr_text(ground_truth_path, combined_text)
+        print(f"\nWER: {ocr_results['wer']:.2f}, WER Accuracy: {ocr_results['wer_accuracy']:.2f}")
+        print(f"CER: {ocr_results['cer']:.2f}, CER Accuracy: {ocr_results['cer_accuracy']:.2f}")
 
+    return query_model(combined_text, prompt)
@@ -1,15 +1,61 @@
-import google.generativeai as genai
+import os
+from modelRegistry import READY, REGISTRY
+from llmClient import GeminiProvider, LLMClient, StubHTTPProvider
 
-with open(rf"C:\Users\88690\Desktop\Dissertation\image_processing\genai_api_key.txt", "r") as f:
-    api_key = f.read().strip()
+# Point this at stubLLMServer.py (e.g. http://127.0.0.1:8765/) to test without Gemini
+STUB_URL = os.environ.get("LLM_STUB_URL")
+API_KEY_PATH = rf"C:\Users\88690\Desktop\Dissertation\image_processing\genai_api_key.txt"
 
-genai.configure(api_key=api_key)
-#model = genai.GenerativeModel('gemma-3n-e4b-it')
-#model = genai.GenerativeModel('gemini-2.5-flash-lite')
-model = genai.GenerativeModel('gemini-2.5-pro')
+#MODEL_NAME = 'gemma-3n-e4b-it'
+#MODEL_NAME = 'gemini-2.5-flash-lite'
+MODEL_NAME = 'gemini-2.5-pro'
+
+# Shared by every pipeline worker and device (see llmClient.LLMClient)
+LLM_CLIENT_CONFIG = {
+    "max_concurrency": 4,        # Gemini requests in flight at once
+    "requests_per_minute": 60,   # token-bucket rate limit
+    "timeout": 60.0,             # deadline per question, including retries
+    "attempt_timeout": 20.0,     # one attempt (or the wait for a stream's first chunk) before retrying
+    "max_retries": 3,            # on rate limits, overload and timeouts
+    "hedge_percentile": None,    # e.g. 95: send a second request when the first is slower than p95
+}
+
+# The API key is read and the client configured on first use, not on import
+def _load_client():
+    if STUB_URL:
+        provider = StubHTTPProvider(STUB_URL)
+    else:
+        with open(API_KEY_PATH, "r") as f:
+            api_key = f.read().strip()
+        provider = GeminiProvider(MODEL_NAME, api_key)
+    return LLMClient(provider, **LLM_CLIENT_CONFIG)
+
+REGISTRY.register("gemini", _load_client)
+
+def get_client() -> LLMClient:
+    return REGISTRY.get("gemini")
+
+def current_model_name() -> str:
+    """Name of the model that actually answers (used to key cached answers)."""
+    return "stub" if STUB_URL else MODEL_NAME
 
 def ask_model(question: str) -> str:
-    response = model.generate_content(question)
-    return response.text if response and hasattr(response, "text") else ""
+    return get_client().generate(question)
+
+def ask_model_stream(question: str):
+    """Yield the answer text chunk by chunk as it is generated."""
+    yield from get_client().stream(question)
+
+def ask_model_multimodal(question: str, image) -> str:
+    """Ask about a PIL image (e.g. the crop around the pens) together with a text prompt."""
+    return get_client().generate(question, image=image)
 
+def ask_model_multimodal_stream(question: str, image):
+    """Like ask_model_multimodal, but yields the answer chunk by chunk."""
+    yield from get_client().stream(question, image=image)
 
+def client_stats() -> dict:
+    """Request, retry, hedge and latency counters of the LLM client (empty until it is loaded)."""
+    if REGISTRY.states().get("gemini") != READY:
+        return {}
+    return get_client().stats()
@@ -0,0 +1,249 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, from a fast thumbnail diff up to a slow LLM answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_trace_ids = itertools.count(1)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """
+    Timeline of one frame through the server: receive, decode, pen detect,
+    layout, filter, OCR, LLM and send.
+
+    Spans are (name, start offset, duration) relative to `started_at`, so a
+    trace dump shows both where the time went and what overlapped.
+    """
+
+    def __init__(self, frame_id=None, started_at: float = None, **attrs):
+        self.trace_id = next(_trace_ids)
+        self.frame_id = frame_id
+        self.started_at = time.time() if started_at is None else started_at
+        self.attrs = attrs
+        self.spans = []
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float, **attrs):
+        """Record a span that started at wall-clock time `start`."""
+        span = {"name": name, "start": round(start - self.started_at, 6), "duration": round(duration, 6)}
+        if attrs:
+            span["attrs"] = attrs
+        with self._lock:
+            self.spans.append(span)
+
+    def span_durations(self) -> dict:
+        """Total seconds per span name."""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration"]
+        return totals
+
+    @property
+    def duration(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.time()
+        return end - self.started_at
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {"trace_id": self.trace_id, "frame_id": self.frame_id, "started_at": self.started_at,
+                "duration": round(self.duration, 6), "attrs": self.attrs, "spans": spans}
+
+    def summary(self) -> str:
+        parts = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.span_durations().items())
+        return f"[Trace {self.trace_id}] frame {self.frame_id}: {parts} (total {self.duration * 1000:.0f} ms)"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, rendered in Prometheus text format."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """
+    Process-wide registry of histograms and callback gauges.
+
+    Histograms are keyed by metric name and one label (e.g. span="layout");
+    gauges are read on every scrape from a callback returning {label value: value}.
+    """
+
+    def __init__(self):
+        self._histograms = {}  # name -> (help, label, {label value: Histogram})
+        self._gauges = {}      # name -> (help, label, type, fn)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, label: str = None, label_value: str = None, help: str = ""):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = (help, label, {})
+            histograms = self._histograms[name][2]
+            if label_value not in histograms:
+                histograms[label_value] = Histogram()
+            histograms[label_value].observe(value)
+
+    def register_gauge(self, name: str, fn, label: str = None, help: str = "", type: str = "gauge"):
+        """`fn()` returns a number, or {label value: number} when `label` is given."""
+        with self._lock:
+            self._gauges[name] = (help, label, type, fn)
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = {name: (h, l, dict(v)) for name, (h, l, v) in self._histograms.items()}
+            gauges = dict(self._gauges)
+
+        for name, (help, label, by_value) in sorted(histograms.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for label_value, hist in sorted(by_value.items(), key=lambda kv: str(kv[0])):
+                base = f'{label}="{label_value}",' if label else ""
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{{base}le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{base}le="+Inf"}} {hist.count}')
+                suffix = f"{{{base.rstrip(',')}}}" if label else ""
+                lines.append(f"{name}_sum{suffix} {hist.sum:.6f}")
+                lines.append(f"{name}_count{suffix} {hist.count}")
+
+        for name, (help, label, type, fn) in sorted(gauges.items()):
+            try:
+                values = fn()
+            except Exception as e:
+                print(f"[Metrics] Gauge {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            if label:
+                for label_value, value in sorted(values.items(), key=lambda kv: str(kv[0])):
+                    lines.append(f'{name}{{{label}="{label_value}"}} {value}')
+            else:
+                lines.append(f"{name} {values}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+_trace_listeners = []
+_dump_lock = threading.Lock()
+_dump_file = None
+
+
+# -------------------------
+# Traces and spans
+# -------------------------
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def use_trace(trace):
+    """Make `trace` the current trace for spans opened in this thread/task."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record_span(name: str, start: float, duration: float, trace=None, **attrs):
+    """Add a finished span to the histograms and to `trace` (default: the current trace)."""
+    METRICS.observe("pipeline_span_seconds", duration, label="span", label_value=name,
+                    help="Duration of each processing step in seconds.")
+    trace = trace if trace is not None else _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, duration, **attrs)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Time a block; it is recorded even without a current trace (histograms only)."""
+    start, t0 = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.perf_counter() - t0, **attrs)
+
+
+def finish_trace(trace):
+    """Close a trace: observe its end-to-end latency, notify listeners and dump it."""
+    if trace is None or trace.finished_at is not None:
+        return
+    trace.finished_at = time.time()
+    METRICS.observe("pipeline_trace_seconds", trace.duration, help="End-to-end latency of a frame in seconds.")
+    for listener in list(_trace_listeners):
+        listener(trace)
+    with _dump_lock:
+        if _dump_file is not None:
+            _dump_file.write(json.dumps(trace.to_dict()) + "\n")
+            _dump_file.flush()
+
+
+def add_trace_listener(fn):
+    """Call `fn(trace)` for every finished trace (e.g. a benchmark collecting latencies)."""
+    _trace_listeners.append(fn)
+
+
+def set_trace_dump(path: str = None):
+    """Append every finished trace to a JSONL file (None stops dumping)."""
+    global _dump_file
+    with _dump_lock:
+        if _dump_file is not None:
+            _dump_file.close()
+        _dump_file = open(path, "a", encoding="utf-8") if path else None
+
+
+# -------------------------
+# Metrics endpoint
+# -------------------------
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serve GET /metrics (Prometheus text format) on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: Call `shutdown()` to stop it; None if the port
+        could not be bound (the server keeps running without metrics).
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Metrics server not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return server
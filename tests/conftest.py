@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules are run as scripts from their own folders, not installed as packages
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("image_processing", "Server"):
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,22 @@
+import pytest
+from debugWriter import DebugWriter
+
+
+@pytest.mark.parametrize("rate, expected", [(0.0, 0), (0.1, 100), (0.25, 250), (0.3, 300), (1.0, 1000)])
+def test_sample_keeps_the_configured_fraction_of_triggers(tmp_path, rate, expected):
+    writer = DebugWriter(str(tmp_path), sample_rate=rate)
+    assert sum(writer.sample() for _ in range(1000)) == expected
+
+
+def test_samples_are_spread_evenly(tmp_path):
+    writer = DebugWriter(str(tmp_path), sample_rate=0.3)
+    picks = [writer.sample() for _ in range(10)]
+    assert picks == [False, False, False, True, False, False, True, False, False, True]
+
+
+def test_submit_writes_the_rendered_artefact(tmp_path):
+    writer = DebugWriter(str(tmp_path), sample_rate=1.0)
+    assert writer.submit("trigger.json", lambda: {"pens": 2})
+    writer.flush()
+    assert (tmp_path / "trigger.json").read_text(encoding="utf-8").strip().startswith("{")
+    assert writer.stats()["written"] == 1
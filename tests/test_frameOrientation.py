@@ -0,0 +1,34 @@
+import io
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+from PIL import Image
+from imageFrame import Frame
+from socketServer import FrameHeader, TIER_FULL
+from stageResults import PenDetection
+
+
+def _jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_low_res_pens_scale_to_upright_full_res_frame():
+    # Portrait phone shot: the sensor encodes 4032x3024, orientation 6 turns it upright
+    data = _jpeg(4032, 3024)
+    header = FrameHeader(frame_id=1, timestamp_ms=0, width=4032, height=3024, orientation=6,
+                         tier=TIER_FULL, length=len(data))
+    frame = Frame(data, header=header)
+    assert frame.size == (3024, 4032)
+
+    # Pens found on the upright 480x640 low-res frame, near the bottom of the page
+    low_res = PenDetection(boxes=[[40, 560, 120, 600], [360, 560, 440, 600]], scores=[0.9, 0.9],
+                           labels=["a pen", "a pen"], size=(480, 640))
+    scaled = low_res.scaled(frame.size)
+    assert scaled.size == (3024, 4032)
+    assert scaled.boxes[0] == [252.0, 3528.0, 756.0, 3780.0]
+    # Every box lies inside the upright frame
+    for x1, y1, x2, y2 in scaled.boxes:
+        assert 0 <= x1 < x2 <= frame.size[0] and 0 <= y1 < y2 <= frame.size[1]
@@ -0,0 +1,64 @@
+import os
+import textwrap
+import pytest
+
+pytest.importorskip("numpy")
+from frameRing import ProcessPoolModels, SharedFrameRing
+
+# Stand-ins for the model modules: each worker imports them in its initializer
+FAKE_MODEL = textwrap.dedent("""
+    import os
+    import time
+    from modelRegistry import REGISTRY
+
+    def _load():
+        if os.environ.get("FAKE_MODEL_FAIL"):
+            raise OSError("no weights")
+        time.sleep(0.5)
+        open(os.path.join(os.environ["FAKE_MODEL_DIR"], f"{NAME}_{os.getpid()}"), "w").close()
+        return object()
+
+    REGISTRY.register(NAME, _load)
+""")
+
+
+@pytest.fixture
+def fake_models(tmp_path, monkeypatch):
+    for module, name in (("owlv2_singleImage", "owlv2"), ("doclayout_singleImage", "doclayout")):
+        (tmp_path / f"{module}.py").write_text(f"NAME = {name!r}\n" + FAKE_MODEL)
+    loaded = tmp_path / "loaded"
+    loaded.mkdir()
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv("FAKE_MODEL_DIR", str(loaded))
+    return loaded
+
+
+def _models(workers):
+    ring = SharedFrameRing(slots=2, slot_bytes=1024)
+    return ring, ProcessPoolModels(ring, workers=workers)
+
+
+def test_wait_ready_waits_for_every_worker(fake_models):
+    ring, models = _models(workers=3)
+    try:
+        models.wait_ready()
+        assert len(models.ready_pids) == 3
+        # Both models were loaded in every worker before READY
+        assert sorted(os.listdir(fake_models)) == sorted(
+            f"{name}_{pid}" for pid in models.ready_pids for name in ("owlv2", "doclayout"))
+        models.wait_ready()  # a second call (one per registry entry) returns right away
+    finally:
+        models.shutdown()
+        ring.close()
+
+
+def test_wait_ready_reports_a_load_failure(fake_models, monkeypatch):
+    monkeypatch.setenv("FAKE_MODEL_FAIL", "1")
+    ring, models = _models(workers=2)
+    try:
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="no weights"):
+                models.wait_ready()
+    finally:
+        models.shutdown()
+        ring.close()
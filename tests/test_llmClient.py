@@ -0,0 +1,41 @@
+import threading
+import time
+import pytest
+from llmClient import LLMClient, Provider
+
+
+class BlockingProvider(Provider):
+    """Answers "ok" once `release` is set; counts the calls that reached it."""
+
+    name = "blocking"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def generate(self, prompt, image=None, timeout=None):
+        self.calls += 1
+        self.release.wait(5)
+        return "ok"
+
+    def is_retryable(self, error):
+        return False
+
+
+def test_deadline_covers_waiting_for_a_slot():
+    provider = BlockingProvider()
+    client = LLMClient(provider, max_concurrency=1, requests_per_minute=None, attempt_timeout=10)
+    busy = threading.Thread(target=client.generate, args=("first",), kwargs={"timeout": 10})
+    busy.start()
+    while provider.calls == 0:
+        time.sleep(0.01)
+
+    t0 = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        client.generate("queued", timeout=0.3)
+    assert time.perf_counter() - t0 < 1.0
+    assert provider.calls == 1  # the queued request never reached the provider
+    assert client.counts["timeouts"] >= 1
+
+    provider.release.set()
+    busy.join()